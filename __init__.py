@@ -0,0 +1,38 @@
+bl_info = {
+    'name': 'Solar System',
+    'author': 'Kristin Riebe',
+    'version': (1, 0),
+    'blender': (2, 75, 0),
+    'location': 'Properties > Scene > Solar System',
+    'description': 'Create the planets of the solar system with their '
+                   'orbits, rings and animations',
+    'category': 'Add Mesh',
+}
+
+try:
+    import bpy
+except ImportError:
+    # imported outside of Blender, e.g. by pytest collecting the tests
+    bpy = None
+
+if bpy is not None:
+    import os
+    import sys
+    addon_dir = os.path.dirname(os.path.abspath(__file__))
+    if addon_dir not in sys.path:
+        sys.path.append(addon_dir)
+    import reloader
+    reloader.reload_changed(['addon'])
+    import addon
+
+
+def register():
+    addon.register()
+
+    return
+
+
+def unregister():
+    addon.unregister()
+
+    return
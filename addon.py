@@ -0,0 +1,120 @@
+import os
+import time
+import bpy
+from bpy.props import FloatProperty, IntProperty, StringProperty
+import reloader
+import scenesettings
+
+# The project as Blender add-on (registered by __init__.py): an operator
+# which creates (or updates) the solar system in the current scene, as
+# create_planet.py does. Install this directory as add-on (e.g. zipped,
+# or linked into Blender's scripts/addons/ directory as 'solarsystem')
+# and enable it; the operator is in Properties > Scene > Solar System.
+# The modules stay loaded between runs of the operator, with their
+# caches (parsed csv-files, image index, shared sphere meshes in the
+# blend-file), and only modules whose files changed are reloaded (see
+# reloader.py), so a rerun starts without re-importing or re-reading
+# anything that did not change.
+
+addon_dir = os.path.dirname(os.path.abspath(__file__))
+
+# operator properties which are entries of create_planet's settings
+SETTINGS = ['sizescale_basic', 'sizefactor_rockplanet',
+            'sizefactor_gasplanet', 'timefactor', 'startframe']
+
+
+def data_dir(path=''):
+    """Return the directory with planets.csv, rings.csv, textures/ etc.,
+    ending with os.sep: the given path, otherwise the directory of the
+    blend-file if it contains planets.csv, otherwise the add-on's
+    directory"""
+    if path:
+        return os.path.join(bpy.path.abspath(path), '')
+    blend_dir = os.path.dirname(bpy.data.filepath)
+    if blend_dir and os.path.isfile(os.path.join(blend_dir, 'planets.csv')):
+        return os.path.join(blend_dir, '')
+
+    return os.path.join(addon_dir, '')
+
+
+class CreatePlanets(bpy.types.Operator):
+    """Create the solar system in the current scene, or update the bodies
+    whose parameters changed"""
+    bl_idname = 'scene.create_planets'
+    bl_label = 'Create Solar System'
+    bl_options = {'REGISTER'}
+
+    datadir = StringProperty(
+        name='Data Directory', subtype='DIR_PATH', default='',
+        description="Directory with planets.csv and textures/ (default: "
+                    "the blend-file's directory, else the add-on's)")
+    sizescale_basic = FloatProperty(
+        name='Size Scale',
+        default=scenesettings.DEFAULTS['sizescale_basic'], min=0,
+        precision=6, description="Blender units per km")
+    sizefactor_rockplanet = FloatProperty(
+        name='Rocky Planet Factor',
+        default=scenesettings.DEFAULTS['sizefactor_rockplanet'], min=0,
+        description="Additional size factor for rocky planets")
+    sizefactor_gasplanet = FloatProperty(
+        name='Gas Planet Factor',
+        default=scenesettings.DEFAULTS['sizefactor_gasplanet'], min=0,
+        description="Additional size factor for gas planets")
+    timefactor = FloatProperty(
+        name='Time Factor',
+        default=scenesettings.DEFAULTS['timefactor'], min=0,
+        description="Frames per day")
+    startframe = IntProperty(
+        name='Start Frame',
+        default=scenesettings.DEFAULTS['startframe'],
+        description="First frame of the orbit animations")
+
+    def execute(self, context):
+        t0 = time.time()
+        reloaded = reloader.reload_changed(['create_planet'])
+        import create_planet
+        reloaded += reloader.reload_changed(create_planet.MODULES)
+
+        dir = data_dir(self.datadir)
+        settings = create_planet.default_settings(dir)
+        for name in SETTINGS:
+            settings[name] = getattr(self, name)
+        options = create_planet.parse_arguments([])
+        startup = time.time() - t0
+
+        create_planet.build(dir, settings, options)
+
+        self.report({'INFO'}, "Solar system done in %.2f s (started in "
+                    "%.3f s, %d module(s) reloaded)."
+                    % (time.time() - t0, startup, len(reloaded)))
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+
+class SolarSystemPanel(bpy.types.Panel):
+    """Button for the operator in the scene properties"""
+    bl_idname = 'SCENE_PT_solar_system'
+    bl_label = 'Solar System'
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = 'scene'
+
+    def draw(self, context):
+        self.layout.operator(CreatePlanets.bl_idname, icon='WORLD')
+
+
+def register():
+    bpy.utils.register_class(CreatePlanets)
+    bpy.utils.register_class(SolarSystemPanel)
+
+    return
+
+
+def unregister():
+    # the modules are kept loaded, with their caches, for re-enabling
+    bpy.utils.unregister_class(SolarSystemPanel)
+    bpy.utils.unregister_class(CreatePlanets)
+
+    return
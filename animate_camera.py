@@ -1,4 +1,14 @@
 import bpy
+import os
+import sys
+try:
+    import reloader
+except ImportError:
+    # run from the blend-file's text editor, without the add-on
+    sys.path.append(os.path.dirname(bpy.data.filepath))
+    import reloader
+reloader.reload_changed(['paths'])
+import paths
 
 
 def add_camera_path(pathname, radius, location):
@@ -38,7 +48,8 @@ def add_trackto_object(tracktoname, location):
     return objempty
 
 
-def animate_camera(objcamera, objpath, objtrackto, startframe=1, duration=200):
+def animate_camera(objcamera, objpath, objtrackto, startframe=1, duration=200,
+                   profile=paths.constant_speed):
     """Animate the camera by following along the given path, 
     with the view locked to the given trackto-object.
     NOTE: this also clears any animation data of the path beforehand, 
@@ -50,6 +61,8 @@ def animate_camera(objcamera, objpath, objtrackto, startframe=1, duration=200):
     startframe  -- frame at which animation will start, default: 1
     duration    -- duration of one complete fly-around along the path, 
                    in frames
+    profile     -- speed profile, e.g. paths.constant_speed or 
+                   paths.ease_in_out
     """
 
     # add FollowPath constraint
@@ -80,14 +93,11 @@ def animate_camera(objcamera, objpath, objtrackto, startframe=1, duration=200):
             if fcu.data_path == 'eval_time':
                 act.fcurves.remove(fcu)
 
-    # insert keyframes
-    objpath.data.path_duration = 100
-    objpath.data.eval_time = 0
-    objpath.data.keyframe_insert(data_path="eval_time", frame=startframe)
+    # insert keyframes, such that the camera moves with constant speed
+    # along the curve (or with the given speed profile)
+    paths.key_motion(objpath, startframe, duration, profile)
 
     endframe = startframe + duration
-    objpath.data.eval_time = 100
-    objpath.data.keyframe_insert(data_path="eval_time", frame=endframe)
 
     # set end-frame in Blender at least to the duration time
     # (comment this out, if you do not want this)
@@ -0,0 +1,149 @@
+"""Bake animations into F-curves in bulk.
+
+Instead of inserting keyframes one by one with keyframe_insert, the
+F-curves are created directly and all keyframe coordinates are written
+with a single foreach_set per curve. Optionally, keys which can be
+interpolated linearly from their neighbours within a given tolerance
+are dropped before writing.
+"""
+import bpy
+import numpy as np
+
+
+# enum values of keyframe interpolation types, for raw array access
+INTERPOLATION_TYPES = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+
+def reduce_keys(frames, values, tolerance):
+    """Remove keys that deviate at most by tolerance from a linear
+    interpolation of the remaining keys (Ramer-Douglas-Peucker).
+    Returns the reduced frames and values; first and last key are kept.
+    frames -- keyframe times, sorted
+    values -- keyframe values
+    tolerance -- maximum allowed deviation in value
+    """
+    frames = np.asarray(frames, dtype=float)
+    values = np.asarray(values, dtype=float)
+    n = len(frames)
+    if n < 3:
+        return frames, values
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, n-1)]
+    while segments:
+        i, j = segments.pop()
+        if j - i < 2:
+            continue
+        # deviation of the inner keys from the line between keys i and j
+        f = frames[i+1:j]
+        w = (f - frames[i]) / (frames[j] - frames[i])
+        dev = np.abs(values[i+1:j] - (values[i] + w*(values[j] - values[i])))
+        k = np.argmax(dev)
+        if dev[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            segments.append((i, k))
+            segments.append((k, j))
+
+    return frames[keep], values[keep]
+
+
+def get_action(idblock, name=None):
+    """Return the action of an ID-block (object, curve, ...),
+    create a new one if it does not have any yet
+    idblock -- the datablock to be animated
+    name -- name for a new action, default: name of the datablock + 'Action'
+    """
+    if idblock.animation_data is None:
+        idblock.animation_data_create()
+    action = idblock.animation_data.action
+    if action is None:
+        if name is None:
+            name = idblock.name + 'Action'
+        action = bpy.data.actions.new(name)
+        idblock.animation_data.action = action
+
+    return action
+
+
+def bake_fcurve(idblock, data_path, frames, values, index=0,
+                interpolation='LINEAR', tolerance=None, group=None):
+    """Create an F-curve with the given keys, replacing an existing one
+    idblock -- the datablock to be animated
+    data_path -- animated property, e.g. 'eval_time' or 'rotation_euler'
+    frames -- keyframe times
+    values -- keyframe values, one per frame (or a single value for all)
+    index -- array index, e.g. 2 for the z-component of a vector property
+    interpolation -- interpolation type of all keys
+    tolerance -- if given, drop keys within this tolerance (reduce_keys)
+    group -- name of the action group for the F-curve
+    """
+    frames = np.asarray(frames, dtype=float)
+    values = np.broadcast_to(np.asarray(values, dtype=float), frames.shape)
+    if tolerance is not None:
+        frames, values = reduce_keys(frames, values, tolerance)
+    n = len(frames)
+
+    action = get_action(idblock)
+    for fcu in action.fcurves:
+        if fcu.data_path == data_path and fcu.array_index == index:
+            action.fcurves.remove(fcu)
+            break
+    if group is None:
+        fcu = action.fcurves.new(data_path, index=index)
+    else:
+        fcu = action.fcurves.new(data_path, index=index, action_group=group)
+
+    # all keyframe points at once
+    co = np.empty(2*n, dtype=np.float32)
+    co[0::2] = frames
+    co[1::2] = values
+    fcu.keyframe_points.add(n)
+    fcu.keyframe_points.foreach_set("co", co)
+
+    # raw access to enum properties is not available in all Blender
+    # versions, then fall back to setting each key
+    try:
+        code = INTERPOLATION_TYPES[interpolation]
+        fcu.keyframe_points.foreach_set("interpolation", [code]*n)
+    except (TypeError, RuntimeError):
+        for p in fcu.keyframe_points:
+            p.interpolation = interpolation
+
+    # recalculate handles
+    fcu.update()
+
+    return fcu
+
+
+def bake_vector(idblock, data_path, frames, values, interpolation='LINEAR',
+                tolerance=None, group=None):
+    """Create one F-curve per component of a vector property
+    idblock -- the datablock to be animated
+    data_path -- animated property, e.g. 'location' or 'rotation_euler'
+    frames -- keyframe times, n values
+    values -- keyframe values, array of shape (n, number of components)
+    interpolation, tolerance, group -- see bake_fcurve
+    """
+    values = np.asarray(values, dtype=float)
+    fcurves = []
+    for index in range(values.shape[1]):
+        fcu = bake_fcurve(idblock, data_path, frames, values[:,index],
+                          index=index, interpolation=interpolation,
+                          tolerance=tolerance, group=group)
+        fcurves.append(fcu)
+
+    return fcurves
+
+
+def add_cycles_modifier(fcu, mode='REPEAT_OFFSET'):
+    """Repeat the animation of an F-curve before and after its keys
+    fcu -- the F-curve
+    mode -- how to repeat, e.g. 'REPEAT' or 'REPEAT_OFFSET'
+    """
+    mod = fcu.modifiers.new('CYCLES')
+    mod.mode_before = mode
+    mod.mode_after = mode
+
+    return mod
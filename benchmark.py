@@ -0,0 +1,272 @@
+import bpy
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+import tracemalloc
+import numpy as np
+blend_dir = os.path.dirname(bpy.data.filepath)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+for d in (blend_dir, script_dir):
+    if d not in sys.path:
+        sys.path.append(d)
+import create_planet
+import cleanup
+import planetdata
+import rings
+import kepler
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# Benchmark of the scene building stages, for synthetic systems with
+# increasing numbers of bodies. Run it headless with:
+#
+#   blender -b planets-template.blend --python benchmark.py -- \
+#       --sizes 10 100 1000 10000 --output benchmark.json
+#
+# For each size, a csv-file in the format of planets.csv is generated,
+# all bodies are built stage by stage and the time per stage, the peak
+# memory (in a second, untimed build) and the number of datablocks are
+# recorded. The results are written as JSON, including the scaling
+# exponent of each stage (time ~ bodies^exponent), so regressions
+# between versions show up.
+
+STAGES = ['add_sphere', 'add_material', 'add_texture', 'add_flattening',
+          'create_axis_parent', 'add_axial_tilt', 'add_orbit',
+          'add_orbit_animation', 'add_rotation_animation', 'add_rings']
+
+DATA_TYPES = ['objects', 'meshes', 'curves', 'materials', 'textures',
+              'images', 'actions']
+
+
+def write_synthetic_csv(filename, n, textures, seed=0):
+    """Write a csv-file with n random bodies in the format of planets.csv
+    filename -- name of the new csv-file
+    n -- number of bodies
+    textures -- names of texture images to be used (cyclic)
+    seed -- seed for the random numbers
+    """
+    rnd = random.Random(seed)
+    columns = [name for name, dtype, parser in planetdata.PLANET_SCHEMA]
+    with open(filename, 'w') as f:
+        f.write(';'.join(columns) + '\n')
+        for i in range(n):
+            distance = 5.8e7 * (1 + 100*rnd.random())
+            row = [
+                'Body%05d' % i,
+                '%.0f' % rnd.uniform(2000, 70000),
+                '%.3f' % (8 + 25*i/max(1, n-1)),
+                '%.0f' % distance,
+                '%.4f' % rnd.uniform(0, 0.1),
+                '%.2f' % rnd.uniform(0, 180),
+                '%.3f' % rnd.uniform(-180, 180),
+                '%.3f' % rnd.uniform(-30, 30),
+                '%.3f' % rnd.uniform(-180, 180),
+                '%.4f' % rnd.uniform(0.4, 60),
+                '%.4f' % rnd.uniform(0, 0.25),
+                '%.2f' % (365.25 * (distance/1.496e8)**1.5),
+                textures[i % len(textures)],
+                '[%.2f,%.2f,%.2f,1]' % (rnd.random(), rnd.random(),
+                                         rnd.random()),
+            ]
+            f.write(';'.join(row) + '\n')
+
+    return
+
+
+def datablock_counts():
+    """Return number of datablocks per type"""
+    return dict((t, len(getattr(bpy.data, t))) for t in DATA_TYPES)
+
+
+def clear_scene():
+    """Delete all generated objects and their unused datablocks"""
+    create_planet.delete_planets()
+    cleanup.purge_orphans(['materials', 'textures', 'meshes', 'curves',
+                           'actions'])
+
+    return
+
+
+def build_stages(planets, imgpath, timefactor=80, startframe=50,
+                 sizescale=2/100000.):
+    """Build all bodies stage by stage, return time and number of calls
+    per stage"""
+    times = dict((s, 0.) for s in STAGES)
+    calls = dict((s, 0) for s in STAGES)
+
+    def timed(stage, func, *args):
+        t0 = time.perf_counter()
+        result = func(*args)
+        times[stage] += time.perf_counter() - t0
+        calls[stage] += 1
+        return result
+
+    catalog = planetdata.load_rings(os.path.join(script_dir, 'rings.csv'))
+    saturn = catalog[catalog['planet'] == 'Saturno']
+    for k, planet in enumerate(planets):
+        name = str(planet['name'])
+        d = planet['art_distance']
+        ecc = planet['eccentricity']
+        obj = timed('add_sphere', create_planet.add_sphere, 'Planet-'+name,
+                    planet['radius']*sizescale, (d,0,0))
+        mat = timed('add_material', create_planet.add_material, obj, name,
+                    list(planet['color']))
+        timed('add_texture', create_planet.add_texture, mat,
+              imgpath + planet['texture'])
+        timed('add_flattening', create_planet.add_flattening, obj,
+              planet['flattening'])
+        axisobj = timed('create_axis_parent', create_planet.create_axis_parent,
+                        name, obj)
+        timed('add_axial_tilt', create_planet.add_axial_tilt, axisobj,
+              planet['tilt'], planet['tilt_x'], planet['tilt_y'],
+              planet['tilt_z'])
+        orbitobj = timed('add_orbit', create_planet.add_orbit,
+                         'Planet-'+name+'-Orbit', d, ecc)
+        axisobj.location = (0,0,0)
+        c = axisobj.constraints.new(type='FOLLOW_PATH')
+        c.target = orbitobj
+        duration = int(planet['orbitperiod']*timefactor + 0.5)
+        timed('add_orbit_animation', create_planet.add_orbit_animation,
+              orbitobj, startframe, duration, ecc)
+        rottime = int(planet['rotperiod']*timefactor + 0.5)
+        timed('add_rotation_animation', create_planet.add_rotation_animation,
+              obj, 1, rottime)
+        # rings for every tenth body
+        if k % 10 == 0:
+            timed('add_rings', rings.add_rings, obj, name, sizescale,
+                  saturn, imgpath)
+
+    return times, calls
+
+
+def run_size(n, tmpdir, imgpath, textures):
+    """Benchmark building a system with n bodies, returns result dict"""
+    csvname = os.path.join(tmpdir, 'bodies-%d.csv' % n)
+    write_synthetic_csv(csvname, n, textures)
+
+    clear_scene()
+    before = datablock_counts()
+
+    # timed pass, without tracemalloc (which slows down all allocations)
+    t0 = time.perf_counter()
+    planets = planetdata.load_planets(csvname, cachedir=tmpdir)
+    tload = time.perf_counter() - t0
+    times, calls = build_stages(planets, imgpath)
+    total = time.perf_counter() - t0
+    after = datablock_counts()
+
+    # untimed pass for the peak memory of the build
+    clear_scene()
+    tracemalloc.start()
+    build_stages(planetdata.load_planets(csvname, cachedir=tmpdir), imgpath)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stages = dict((s, {'time': times[s], 'calls': calls[s],
+                       'time_per_call': times[s]/calls[s] if calls[s] else 0.})
+                  for s in STAGES)
+    stages['load_csv'] = {'time': tload, 'calls': 1, 'time_per_call': tload}
+
+    print("%6d bodies: %8.3f s" % (n, total))
+
+    return {
+        'bodies': n,
+        'total_time': total,
+        'stages': stages,
+        'peak_python_memory': peak,
+        'max_rss_kb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                       if resource is not None else None),
+        'datablocks': dict((t, after[t] - before[t]) for t in DATA_TYPES),
+    }
+
+
+def bench_kepler(bodies, steps, chunk=100):
+    """Time the vectorized Kepler solver for all bodies at all time steps,
+    computed in chunks of time steps to limit the memory
+    bodies -- number of bodies
+    steps -- number of time steps
+    chunk -- number of time steps per chunk
+    """
+    rnd = np.random.RandomState(0)
+    a = rnd.uniform(1, 50, bodies)[:,None]
+    e = rnd.uniform(0, 0.3, bodies)[:,None]
+    period = 365.25 * a**1.5
+    t = np.linspace(0, 365.25*100, steps)
+
+    t0 = time.perf_counter()
+    for i in range(0, steps, chunk):
+        kepler.positions(t[None,i:i+chunk], a, e, period)
+    elapsed = time.perf_counter() - t0
+
+    print("Kepler solver: %d bodies x %d steps in %.3f s"
+          % (bodies, steps, elapsed))
+
+    return {'bodies': bodies, 'steps': steps, 'time': elapsed,
+            'positions_per_second': bodies*steps/elapsed}
+
+
+def scaling_exponents(results):
+    """Fit time ~ bodies^exponent for each stage (log-log fit)"""
+    exponents = {}
+    if len(results) < 2:
+        return exponents
+    n = np.log([r['bodies'] for r in results])
+    for stage in results[0]['stages']:
+        t = np.array([r['stages'][stage]['time'] for r in results])
+        if np.all(t > 0):
+            exponents[stage] = float(np.polyfit(n, np.log(t), 1)[0])
+
+    return exponents
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scene building stages.")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--kepler', type=int, nargs=2, default=None,
+                        metavar=('BODIES', 'STEPS'),
+                        help="also time the Kepler solver, e.g. 100000 10000")
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the last scene instead of clearing it")
+    args = parser.parse_args(argv)
+
+    imgpath = os.path.join(script_dir, 'textures') + os.sep
+    textures = sorted(n for n in os.listdir(imgpath)
+                      if n.endswith(('.jpg', '.png')) and
+                      not n.startswith('Saturn_rings'))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n in args.sizes:
+            results.append(run_size(n, tmpdir, imgpath, textures))
+
+    if not args.keep:
+        clear_scene()
+
+    report = {
+        'blender_version': bpy.app.version_string,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+        'scaling_exponents': scaling_exponents(results),
+    }
+    if args.kepler is not None:
+        report['kepler'] = bench_kepler(*args.kepler)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("Benchmark results written to %s." % args.output)
+
+    return report
+
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    main(argv)
@@ -0,0 +1,103 @@
+import bpy
+import time
+
+# Removal of objects and unused datablocks in batches.
+# Datablocks are collected first and then removed in one go with
+# bpy.data.batch_remove (Blender 2.80 and newer), instead of removing
+# them one by one while iterating over bpy.data. Older versions fall back
+# to removing them one after another, but still without operators.
+
+# datablock types handled by purge_orphans, as names of bpy.data collections
+DATA_TYPES = ['materials', 'textures', 'images', 'meshes', 'curves', 'actions']
+
+# name prefixes of datablocks created by the scripts of this project
+PREFIXES = ('Planet', 'Material-')
+
+
+def is_project_data(idblock):
+    """Check if a datablock was created by the scripts of this project"""
+    return (idblock.name.startswith(PREFIXES) or
+            idblock.get('body') is not None or
+            idblock.get('cache_path') is not None or
+            idblock.get('cache_key') is not None)
+
+
+def remove_datablocks(groups):
+    """Remove datablocks in one batch
+    groups -- dictionary: bpy.data collection name -> list of datablocks
+    """
+    ids = [idblock for idblocks in groups.values() for idblock in idblocks]
+    if not ids:
+        return
+
+    if hasattr(bpy.data, 'batch_remove'):
+        bpy.data.batch_remove(ids)
+        return
+
+    for collname, idblocks in groups.items():
+        collection = getattr(bpy.data, collname)
+        for idblock in idblocks:
+            if collname == 'objects':
+                for scene in idblock.users_scene:
+                    scene.objects.unlink(idblock)
+            collection.remove(idblock)
+
+    return
+
+
+def find_orphans(types=DATA_TYPES, only_project=True):
+    """Return unused datablocks (without any users)
+    types -- names of the bpy.data collections to check
+    only_project -- only datablocks created by this project
+    """
+    groups = {}
+    for collname in types:
+        groups[collname] = [idblock for idblock in getattr(bpy.data, collname)
+                            if idblock.users == 0 and
+                            (not only_project or is_project_data(idblock))]
+
+    return groups
+
+
+def purge_orphans(types=DATA_TYPES, only_project=True):
+    """Remove all unused datablocks of the given types. This is repeated
+    until nothing is left, since e.g. removing a material can leave its
+    textures unused. Returns number of removed datablocks per type and
+    elapsed time in seconds.
+    types -- names of the bpy.data collections to check
+    only_project -- only datablocks created by this project
+    """
+    t0 = time.time()
+    counts = dict((collname, 0) for collname in types)
+    while True:
+        groups = find_orphans(types, only_project)
+        n = sum(len(idblocks) for idblocks in groups.values())
+        if n == 0:
+            break
+        for collname, idblocks in groups.items():
+            counts[collname] += len(idblocks)
+        remove_datablocks(groups)
+    elapsed = time.time() - t0
+
+    print("Removed unused %s in %.3f s." % (', '.join("%d %s" % (counts[c], c)
+        for c in types), elapsed))
+
+    return counts, elapsed
+
+
+def delete_objects(objs):
+    """Delete the given objects in one batch, returns number and
+    elapsed time in seconds"""
+    t0 = time.time()
+    objs = list(objs)
+    remove_datablocks({'objects': objs})
+    elapsed = time.time() - t0
+
+    return len(objs), elapsed
+
+
+def delete_objects_by_prefix(prefix='Planet'):
+    """Delete all objects whose names start with the given prefix,
+    returns number and elapsed time in seconds"""
+    objs = [obj for obj in bpy.data.objects if obj.name.startswith(prefix)]
+    return delete_objects(objs)
@@ -1,25 +1,49 @@
 import bpy
 import os
 import sys
-import csv
 import math
-blend_dir = os.path.dirname(bpy.data.filepath)
-if blend_dir not in sys.path:
-   sys.path.append(blend_dir)
+import json
+import hashlib
+import argparse
+try:
+    import reloader
+except ImportError:
+    # run from the blend-file's text editor, without the add-on
+    sys.path.append(os.path.dirname(bpy.data.filepath))
+    import reloader
+
+# modules of this project, reloaded only if changed since the last run
+MODULES = ['scenesettings', 'cleanup', 'kepler', 'ephemeris', 'planetdata',
+           'bake', 'minor_bodies', 'texture_cache', 'texture_prefetch',
+           'profiling', 'lod', 'culling', 'trajectory', 'nbody', 'paths',
+           'mipmaps', 'proctex', 'rings']
+reloader.reload_changed(MODULES)
 import rings
-import imp
-imp.reload(rings)
+import cleanup
+import kepler
+import ephemeris
+import bake
+import minor_bodies
+import planetdata
+import texture_cache
+import texture_prefetch
+import profiling
+import lod
+import culling
+import trajectory
+import nbody
+import paths
+import mipmaps
+import proctex
+import scenesettings
 
 
 def delete_planets():
-    """Delete objects with names containing 'Planet*'"""
+    """Delete objects with names starting with 'Planet'"""
     
-    bpy.ops.object.select_all(action='DESELECT')
-    bpy.ops.object.select_pattern(pattern='Planet*')
-    n = len(bpy.context.selected_objects)
-    bpy.ops.object.delete()
+    n, elapsed = cleanup.delete_objects_by_prefix('Planet')
 
-    print("%d sphere(s) were deleted." % n)
+    print("%d object(s) were deleted in %.3f s." % (n, elapsed))
 
     return
 
@@ -31,52 +55,26 @@ def delete_unused_materials():
     # But since one may want to rerun this script many times, it can be
     # nicer to remove the unused materials automatically, after deleting
     # objects.
-    i = 0
-    for mat in bpy.data.materials:
-        if mat.users == 0:
-            name = mat.name
-            bpy.data.materials.remove(mat)
-            i = i + 1
-            print("Deleted material ", name)
+    counts, elapsed = cleanup.purge_orphans(['materials'], only_project=False)
 
-    print("%d materials were deleted." % i)
-
-    return
+    return counts['materials']
 
 
 def delete_unused_textures():
     """Delete all unused textures"""
     # Be careful, since this really deletes all textures which are not currently 
     # used. It may thus delete more than you wanted.
-    i = 0
-    for tex in bpy.data.textures:
-        if tex.users == 0:
-            name = tex.name
-            bpy.data.textures.remove(tex)
-            i = i + 1
-            print("Deleted texture ", name)
-            
-    print("%d textures were deleted." % i)
+    counts, elapsed = cleanup.purge_orphans(['textures'], only_project=False)
     
-    return
+    return counts['textures']
 
 
 def read_csv(filename):
-    """Read content of a csv-file into a dictionary"""
-    # With keys taken from first row, using csv-module.
-    # Assumes a "usual" csv-file, comma-separated, text enclosed within "".
-    # If you have a different csv-format, check the csv.Dictreader 
-    # documentation on how to adjust the commands below.
-  
-    if not os.path.isfile(filename):
-        print("Arquivo %s não encontrado!" % filename)
-        raise RuntimeError("read_csv: parando o script porque o arquivo não foi encontrado.") 
-
-    with open(filename) as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=';')
-        lines = [r for r in reader if not r[reader.fieldnames[0]].startswith("#")]
-                    
-    return lines
+    """Read planet parameters from a csv-file into a typed numpy array
+    (one row per planet, columns accessed by name, see planetdata.py)"""
+    # The file is only parsed again if it changed since the last run,
+    # invalid values are reported with their row and column.
+    return planetdata.load_planets(filename)
 
 
 def add_texture(mat, imgname):
@@ -85,10 +83,8 @@ def add_texture(mat, imgname):
     imgname -- name of texture image file, including file path
     """
     
-    # create texture, add image
-    img = bpy.data.images.load(imgname)
-    tex = bpy.data.textures.new(imgname, type='IMAGE')
-    tex.image = img
+    # get texture with image, reusing already loaded images
+    tex = texture_cache.get_image_texture(imgname)
     
     # add texture to material, set mapping
     mtex = mat.texture_slots.add()
@@ -137,26 +133,110 @@ def add_material(obj, name, color=[1,0,0,1]):
     mat.specular_intensity = 0.1
 
     # add material to the object
-    obj.data.materials.append(mat)
+    # Planet spheres share one mesh, so their material is linked to the
+    # object instead of the mesh; otherwise all planets get the same one.
+    if len(obj.material_slots) > 0:
+        slot = obj.material_slots[0]
+        slot.link = 'OBJECT'
+        slot.material = mat
+    else:
+        obj.data.materials.append(mat)
 
     return mat
 
 
+def create_sphere_mesh(meshname, segments=72, ring_count=36):
+    """Create a smooth UV-sphere mesh with radius 1, without operators
+    meshname -- name for the new mesh
+    segments -- number of vertices around the equator
+    ring_count -- number of rings from pole to pole
+    """
+
+    # vertices: north pole, rings from north to south, south pole
+    coords = [0, 0, 1]
+    for i in range(1, ring_count):
+        theta = i*math.pi/ring_count
+        z = math.cos(theta)
+        r = math.sin(theta)
+        for j in range(segments):
+            phi = j*2*math.pi/segments
+            coords.extend((r*math.cos(phi), r*math.sin(phi), z))
+    coords.extend((0, 0, -1))
+    nverts = len(coords) // 3
+    south = nverts - 1
+
+    def ring(i, j):
+        """index of vertex j (cyclic) in ring i (1 .. ring_count-1)"""
+        return 1 + (i-1)*segments + j % segments
+
+    # faces: triangle fans at the poles, quads in between,
+    # all counter-clockwise when seen from outside
+    indices = []
+    totals = []
+    for j in range(segments):
+        indices.extend((0, ring(1, j), ring(1, j+1)))
+        totals.append(3)
+    for i in range(1, ring_count-1):
+        for j in range(segments):
+            indices.extend((ring(i, j), ring(i+1, j),
+                            ring(i+1, j+1), ring(i, j+1)))
+            totals.append(4)
+    for j in range(segments):
+        indices.extend((south, ring(ring_count-1, j+1), ring(ring_count-1, j)))
+        totals.append(3)
+
+    starts = []
+    n = 0
+    for t in totals:
+        starts.append(n)
+        n += t
+
+    # fill the mesh in bulk
+    mesh = bpy.data.meshes.new(meshname)
+    mesh.vertices.add(nverts)
+    mesh.vertices.foreach_set("co", coords)
+    mesh.loops.add(len(indices))
+    mesh.loops.foreach_set("vertex_index", indices)
+    mesh.polygons.add(len(totals))
+    mesh.polygons.foreach_set("loop_start", starts)
+    mesh.polygons.foreach_set("loop_total", totals)
+    mesh.polygons.foreach_set("use_smooth", [True]*len(totals))
+    mesh.update(calc_edges=True)
+
+    # one (empty) material slot, to be linked per object
+    mesh.materials.append(None)
+
+    return mesh
+
+
+def get_sphere_mesh(segments=72, ring_count=36):
+    """Return the unit-sphere mesh shared by all planets, create it if needed
+    segments -- number of vertices around the equator
+    ring_count -- number of rings from pole to pole
+    """
+    meshname = 'Planet-Sphere-%dx%d' % (segments, ring_count)
+    mesh = bpy.data.meshes.get(meshname)
+    if mesh is None:
+        mesh = create_sphere_mesh(meshname, segments, ring_count)
+
+    return mesh
+
+
 def add_sphere(name, radius, location):
     """Add sphere to current scene at given location
     name -- name for new sphere object
+    radius -- radius of the sphere, set via the object's scale
     location -- location for the new sphere
     """
     
-    # add object
-    bpy.ops.mesh.primitive_uv_sphere_add(segments=72, ring_count=36, radius=radius,location=location, rotation=(0,0,0))
-    
-    # get object
-    obj = bpy.context.object
-    
-    # set name, smooth shading
-    obj.name = name
-    bpy.ops.object.shade_smooth()
+    # add object, using the shared sphere mesh
+    # (instead of primitive_uv_sphere_add, which creates a new mesh 
+    # and updates the scene for each planet)
+    mesh = get_sphere_mesh(segments=72, ring_count=36)
+    obj = bpy.data.objects.new(name, mesh)
+    obj.location = location
+    obj.scale = (radius, radius, radius)
+    bpy.context.scene.objects.link(obj)
        
     print("Sphere '%s' created." % name)
    
@@ -246,68 +326,112 @@ def add_axial_tilt(obj, tilt, angx, angy, angz):
     return
 
 
-def add_orbit(orbitname):
-    """Add orbit path as a circle
+def add_orbit(orbitname, radius, eccentricity=0., start_angle=0.5*math.pi):
+    """Add orbit path as an ellipse, with the sun in one focal point
     orbitname -- name of the orbit path
+    radius -- semi-major axis of the orbit
+    eccentricity -- eccentricity of the orbit, 0 for a circle
+    start_angle -- direction of the perihelion, measured from +x;
+                   the path starts at the perihelion
     """
     
-    orbitobj = add_circle(orbitname, d, location=(0,0,0), resolution=100)
-      
-    # switch direction (because most planets rotate counter-clockwise when 
-    # seen from earth's northern side)
-    bpy.context.scene.objects.active = orbitobj
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.curve.switch_direction()
-    bpy.ops.object.mode_set(mode='OBJECT')
-        
-    # rotate orbit path to start at +x
-    orbitobj.rotation_euler.z = math.pi
-    # apply rotation, to avoid problems with axis orientation later on
-    bpy.context.scene.objects.active = orbitobj
-    bpy.ops.object.transform_apply(location=True, rotation=True, scale=True)
+    # The curve is written directly as a Bezier ellipse with 4 points,
+    # running counter-clockwise (because most planets rotate 
+    # counter-clockwise when seen from earth's northern side).
+    # For circles, this gives exactly the points of a circle primitive 
+    # after switching its direction and applying a rotation by 180 degrees,
+    # if start_angle = 90 degrees.
+    # The ellipse is the affine image of the circle, so its handles 
+    # are the circle's handles, scaled along with the points.
+    E = [0, 0.5*math.pi, math.pi, 1.5*math.pi]
+    x, y = kepler.orbit_plane_positions(radius, eccentricity, E)
+    dx, dy = kepler.orbit_plane_tangents(radius, eccentricity, E)
+    # handle length of Blender's automatic handles for a 4-point circle
+    h = math.sqrt(2) / 2.5614
+    
+    co = []
+    handle_left = []
+    handle_right = []
+    c = math.cos(start_angle)
+    s = math.sin(start_angle)
+    for k in range(4):
+        px = c*x[k] - s*y[k]
+        py = s*x[k] + c*y[k]
+        tx = h*(c*dx[k] - s*dy[k])
+        ty = h*(s*dx[k] + c*dy[k])
+        co.extend((px, py, 0))
+        handle_left.extend((px - tx, py - ty, 0))
+        handle_right.extend((px + tx, py + ty, 0))
+
+    curve = bpy.data.curves.new(orbitname, type='CURVE')
+    spline = curve.splines.new('BEZIER')
+    spline.bezier_points.add(3)
+    spline.bezier_points.foreach_set("co", co)
+    spline.bezier_points.foreach_set("handle_left", handle_left)
+    spline.bezier_points.foreach_set("handle_right", handle_right)
+    for p in spline.bezier_points:
+        p.handle_left_type = 'ALIGNED'
+        p.handle_right_type = 'ALIGNED'
+    spline.use_cyclic_u = True
+    curve.resolution_u = 100
+    spline.resolution_u = 100
            
     # add bevel depth to make lines visible
-    orbitobj.data.fill_mode = 'FULL'
-    orbitobj.data.bevel_depth = 0.006
-    orbitobj.data.bevel_resolution = 4
+    curve.fill_mode = 'FULL'
+    curve.bevel_depth = 0.006
+    curve.bevel_resolution = 4
+
+    orbitobj = bpy.data.objects.new(orbitname, curve)
+    bpy.context.scene.objects.link(orbitobj)
 
-    # TODO: orbits are actually ellipses
+    # TODO: orientation (inclination, node, perihelion) of the orbits
 
     return orbitobj
 
 
-def add_orbit_animation(orbitobj, startframe, duration):
+def add_orbit_animation(orbitobj, startframe, duration, eccentricity=0.,
+                        samples=64, tolerance=None):
     """Add animation for the orbit path.
     This only works if the planet is connected to the 
     orbit path via a Follow_Path constraint.
     orbitobj -- orbit path object
     startframe -- first frame, for start of animation
     duration -- duration for complete orbital period, number of frames
+    eccentricity -- eccentricity of the orbit; for elliptic orbits the
+                    planet moves faster near the perihelion (Kepler's 
+                    second law), which is sampled with keyframes
+    samples -- number of keyframe intervals per orbit for elliptic orbits
+    tolerance -- if given, drop keys whose evaluation time deviates less 
+                 than this from a linear interpolation of the other keys
     """
     
     orbitobj.data.use_path = True
     orbitobj.data.path_duration = 100
     
-    # insert keyframes for evaluation time
-    orbitobj.data.eval_time = 0
-    orbitobj.data.keyframe_insert(data_path="eval_time", frame=startframe)
+    # evaluation time along the path for the keyframes, starting at 
+    # the perihelion. The path is evaluated by arc length, so convert 
+    # the planet's position (from Kepler's equation) to arc length.
+    if eccentricity > 0:
+        fractions = ephemeris.orbit_path_fractions(eccentricity, samples)
+        # Blender moves along the curve's polyline, not along the true 
+        # ellipse; correct for that with the arc-length table of the path
+        table = paths.get_table(orbitobj)
+        evaltimes = 100*paths.blender_fractions(table, fractions)
+        frames = [startframe + duration*k/samples for k in range(samples+1)]
+    else:
+        evaltimes = [0, 100]
+        frames = [startframe, startframe + duration]
+
+    # bake keyframes for evaluation time, 
+    # with linear interpolation: don't want to slow down the orbit 
+    # at the wrong point.
+    fcu = bake.bake_fcurve(orbitobj.data, 'eval_time', frames, evaltimes,
+                           interpolation='LINEAR', tolerance=tolerance)
 
-    endframe = startframe + duration
-    orbitobj.data.eval_time = 100
-    orbitobj.data.keyframe_insert(data_path="eval_time", frame=endframe)
-
-    # Change interpolation type for animation curve to linear,
-    # don't want to slow down the orbit at the wrong point.
     # Add cycles-modifier for repeating the orbit animation.
     # (modifier only works if Follow_Path is used, but not, 
     # if we only use parenting!)
-    for fcu in orbitobj.data.animation_data.action.fcurves:
-        if fcu.data_path == 'eval_time':
-            for p in fcu.keyframe_points:
-                p.interpolation = 'LINEAR'
-            mod = fcu.modifiers.new('CYCLES')
-            mod.mode_before = 'REPEAT_OFFSET'
-            mod.mode_after = 'REPEAT_OFFSET'
+    bake.add_cycles_modifier(fcu, mode='REPEAT_OFFSET')
                                     
     return
 
@@ -322,137 +446,422 @@ def add_rotation_animation(obj, startframe, rottime):
     # global z-axis. If the planet's axis is tilted, then add an axis-parent 
     # and tilt this parent, but keep the planet-object's axis unrotated. 
     # Otherwise the tilted axis would precess around global z-axis. 
-    obj.rotation_euler.z = 0
-    obj.keyframe_insert(data_path="rotation_euler", frame=startframe)
-
     endframe = startframe + rottime
-    obj.rotation_euler.z = 2*math.pi
-    obj.keyframe_insert(data_path='rotation_euler', frame=endframe)
-
-    # adjust animation graph: type linear, repeat
-    for fcu in obj.animation_data.action.fcurves:
-        if fcu.data_path == 'rotation_euler':
-            for p in fcu.keyframe_points:
-                p.interpolation = 'LINEAR'
-            mod = fcu.modifiers.new('CYCLES')
-            mod.mode_before = 'REPEAT_OFFSET'
-            mod.mode_after = 'REPEAT_OFFSET'
+    frames = [startframe, endframe]
+    rx = obj.rotation_euler.x
+    ry = obj.rotation_euler.y
+    rotations = [(rx, ry, 0), (rx, ry, 2*math.pi)]
+
+    # bake keys for all rotation axes, type linear, repeat
+    fcurves = bake.bake_vector(obj, 'rotation_euler', frames, rotations,
+                               interpolation='LINEAR',
+                               group='Object Transforms')
+    for fcu in fcurves:
+        bake.add_cycles_modifier(fcu, mode='REPEAT_OFFSET')
             
     return
 
 
-if __name__ == '__main__':
+def add_planet(planet, settings, ringrows=()):
+    """Add a planet (or the sun) with all its parts: sphere, material,
+    texture, axis, orbit, animations and rings
+    planet -- parameters of the planet, one row from read_csv
+    settings -- dictionary with the scale factors, timefactor, startframe
+                and path of the texture images (imgpath)
+    ringrows -- rows of the ring catalog for this planet (see rings.csv)
+    """
+    imgpath = settings['imgpath']
+    timefactor = settings['timefactor']
 
-    dir = os.path.dirname(bpy.data.filepath) + os.sep
-#    filename = dir + 'Planets-simple.csv'
-    filename = dir + 'planets.csv'
+    name = planet['name']
+    objname = 'Planet-' + name
+
+    sizescale = scenesettings.planet_sizescale(name, settings)
+    
+    radius = planet['radius'] * sizescale
+    
+    # just put at some distance, not the true one
+    d = planet['art_distance']
+    location = (d,0,0)
+
+    color = list(planet['color'])
+            
+    # create planet sphere and add material
+    obj = add_sphere(objname, radius, location)
+    mat = add_material(obj, name, color=color)
+    
+    # add texture, a procedural one if the file is missing
+    imgname = imgpath + planet['texture']
+    if not os.path.isfile(imgname):
+        imgname = proctex.fallback_texture(planet, imgpath)
+    add_texture(mat, imgname)
+
+    # add flattening of planet-sphere
+    flattening = planet['flattening']
+    add_flattening(obj, flattening)
+    
+    # add axis tilt
+    # via a parent for the axis-orientation,
+    # This allows to add planet rotation around itself (its z-axis) later on.
+    axisobj = create_axis_parent(name, obj)
+    
+    tilt = planet['tilt']
+    tiltx = planet['tilt_x']
+    tilty = planet['tilt_y']
+    tiltz = planet['tilt_z']
+    add_axial_tilt(axisobj, tilt, tiltx, tilty, tiltz)
+    
+    # add orbit paths, with planet distance as radius
+    if (name != 'Sol'):
+        
+        orbitname = 'Planet-' + name + '-Orbit'
+        ecc = planet['eccentricity']
+        orbitobj = add_orbit(orbitname, d, ecc)
+        
+        # add Follow_Path to planet, to stick it to its orbit
+        axisobj.location = (0,0,0)
+        c = axisobj.constraints.new(type='FOLLOW_PATH')
+        c.target = orbitobj
+
+        # add orbit animation
+        startframe = settings['startframe']
+        duration = int( planet['orbitperiod']*timefactor  + 0.5)
+        add_orbit_animation(orbitobj, startframe, duration, ecc)
+        
+    # add rotation of planet around its axis
+    # Beware of axis tilt!!  
+    startframe = 1
+    time = int(  planet['rotperiod']*timefactor  + 0.5)
+    add_rotation_animation(obj, startframe, time)
+
+    # add ring system, all rings as one mesh
+    rings.add_rings(obj, name, sizescale, ringrows, imgpath)
+
+    # sun adjustments
+    if name == 'Sol':
+        sunmat = obj.material_slots[0].material
+        sunmat.use_shadows = False # otherwise orbits cast shadow on sun-surface
+        sunmat.use_shadeless = True # now also no shadow received
+        
+        # allow light of point source to transmit through the sun's surface
+        sunmat.use_cast_shadows = False
+        sunmat.use_cast_buffer_shadows = False
+
+    return obj
+
+
+def add_moon(moon, settings):
+    """Add a moon: sphere with material and axis; it is moved by the
+    trajectory cache of an N-body integration (see nbody.py)
+    moon -- parameters of the moon, one row from planetdata.load_moons
+    settings -- dictionary with the scale factors, see add_planet
+    """
+    name = moon['name']
+    # same enlargement as its planet
+    radius = moon['radius'] * scenesettings.planet_sizescale(moon['parent'],
+                                                             settings)
+    obj = add_sphere('Planet-' + name, radius, (0,0,0))
+    add_material(obj, name, color=list(moon['color']))
+    create_axis_parent(name, obj)
+
+    return obj
+
+
+def add_minor_bodies(filename, planets, settings):
+    """Add minor bodies from a catalog of orbital elements
+    filename -- catalog file, see minor_bodies.read_catalog
+    planets -- planet data, used to scale the distances
+    settings -- dictionary with timefactor and startframe
+    """
+    catalog = minor_bodies.load_catalog(filename)
+    return minor_bodies.add_minor_bodies('MinorBodies', catalog, planets,
+        startframe=settings['startframe'], timefactor=settings['timefactor'])
+
+
+def body_hash(*params):
+    """Return a hash of all parameters of a body, to detect changes"""
+    return hashlib.sha1(repr(params).encode()).hexdigest()
+
+
+def find_bodies():
+    """Return the bodies in the scene, created via add_body, as
+    dictionary: body name -> list of its objects"""
+    bodies = {}
+    for obj in bpy.data.objects:
+        name = obj.get('body')
+        if name is not None:
+            bodies.setdefault(name, []).append(obj)
+
+    return bodies
+
+
+def add_body(name, bodyhash, func, *args):
+    """Create a body by calling func(*args) and mark all objects created
+    by it with the body's name and the hash of its parameters
+    (custom properties 'body' and 'body_hash')
+    name -- name of the body
+    bodyhash -- hash of the body's parameters, see body_hash
+    func -- function creating the body's objects, e.g. add_planet
+    """
+    before = set(bpy.data.objects.keys())
+    with profiling.body(name):
+        result = func(*args)
+    for obj in bpy.data.objects:
+        if obj.name not in before:
+            obj['body'] = name
+            obj['body_hash'] = bodyhash
+
+    return result
+
+
+def update_bodies(bodies):
+    """Update the scene incrementally: only bodies which are new or 
+    whose parameters changed are (re)created, bodies which are not 
+    given anymore are deleted.
+    bodies -- list of (name, hash, func, args), see add_body
+    """
+    existing = find_bodies()
+    wanted = dict((name, bodyhash) for name, bodyhash, func, args in bodies)
+
+    # objects of older runs without marks cannot be compared, remove them
+    unmarked = [obj for obj in bpy.data.objects 
+                if obj.name.startswith('Planet') and obj.get('body') is None]
+    cleanup.delete_objects(unmarked)
+
+    nremoved = 0
+    for name, objs in existing.items():
+        if wanted.get(name) != objs[0].get('body_hash'):
+            cleanup.delete_objects(objs)
+            if name not in wanted:
+                nremoved += 1
+
+    nadded = 0
+    nupdated = 0
+    for name, bodyhash, func, args in bodies:
+        if name in existing:
+            if existing[name][0].get('body_hash') == bodyhash:
+                continue
+            nupdated += 1
+        else:
+            nadded += 1
+        add_body(name, bodyhash, func, *args)
+
+    print("%d body(ies) unchanged, %d updated, %d added, %d removed." 
+          % (len(bodies) - nadded - nupdated, nupdated, nadded, nremoved))
+
+    return
+
+
+def parse_arguments(argv):
+    """Parse the options given after '--' on Blender's command line, e.g.
+    blender -b planets-template.blend --python create_planet.py -- \\
+        --settings '{"timefactor": 40}' --save variant.blend
+    """
+    parser = argparse.ArgumentParser(prog='create_planet.py')
+    parser.add_argument('--settings', type=json.loads, default={},
+                        help="JSON object overriding entries of settings")
+    parser.add_argument('--save', default=None,
+                        help="save the scene into this blend-file")
+    parser.add_argument('--decoded-cache', default=None,
+                        help="directory with decoded textures, shared "
+                             "with other processes")
+
+    return parser.parse_args(argv)
+
+
+def default_settings(dir):
+    """Return the default settings for a directory with the data files
+    dir -- directory with planets.csv and textures/, ending with os.sep
+    """
     imgpath = dir + 'textures' + os.sep
+    settings = dict(scenesettings.DEFAULTS, imgpath=imgpath)
 
-    # size scale factor
-    sizescale_basic = 1/100000.
+    return settings
 
-    # additional factors for sizes (enlarge planets for better visibility)
-    sizefactor_rockplanet = 2 #6
-    sizefactor_gasplanet = 2 #2
 
-    # time factor to convert from days to number of frames
-    timefactor = 80
+def build(dir, settings, options):
+    """Create the planets, orbits etc. in the current scene, or update
+    them (only the bodies whose parameters changed)
+    dir -- directory with planets.csv, rings.csv etc., ending with os.sep
+    settings -- dictionary, see default_settings
+    options -- options as from parse_arguments
+    """
+#    filename = dir + 'Planets-simple.csv'
+    filename = dir + 'planets.csv'
+    imgpath = settings['imgpath']
+    texture_prefetch.decoded_cachedir = options.decoded_cache
+
+    # only rebuild planets whose parameters changed since the last run;
+    # set to False to delete and rebuild everything
+    incremental = True
+
+    # record time, calls and scene updates per stage and body;
+    # optionally with cProfile and tracemalloc (slows down the build)
+    profile = False
+    profile_cprofile = False
+    profile_tracemalloc = False
+    tracefile = None # e.g. dir + 'create_planet-trace.json'
+    if profile:
+        profiling.instrument(sys.modules[__name__])
+        profiling.instrument(rings, ['add_rings'])
+        profiling.start(profile_cprofile, profile_tracemalloc)
     
+    texture_cache.reset_stats()
+
     # clear things first
-    delete_planets()
-    delete_unused_materials()
-    delete_unused_textures()
+    if not incremental:
+        delete_planets()
     
     # read planet data from file (including sun)
     planets = read_csv(filename)
+
+    # read the ring catalog (rings of all planets)
+    ringfile = dir + 'rings.csv'
+    ringcatalog = planetdata.load_rings(ringfile)
+
+    # synthesize the missing textures (cached on disk); in this process,
+    # since worker processes would be started as Blender (spawn start
+    # method on Windows and macOS). To fill the cache in parallel
+    # beforehand: python proctex.py planets.csv textures -w 4
+    fallbacks = proctex.fallback_textures(planets, imgpath, workers=1)
+
+    # decode all textures in the background while building the planets
+    texfiles = [fallbacks.get(name, imgpath + t)
+                for name, t in zip(planets['name'], planets['texture'])]
+    texfiles.extend(imgpath + t for t in set(ringcatalog['texture']) if t)
+    texture_prefetch.start(texfiles)
     
     # make one material for all orbits of planets
     orbitmaterial = create_orbit_material('Material-Orbits', color=[0.3,0.3,0.3,1])
         
+    settingshash = sorted(settings.items())
+    bodies = []
     for planet in planets:
-        
-        name = planet['name']
-        objname = 'Planet-' + name
-
-        if name in ['Mercurio', 'Venus', 'Terra', 'Marte']:
-            sizescale = sizescale_basic * sizefactor_rockplanet
-        elif name != 'Sun':
-            sizescale = sizescale_basic * sizefactor_gasplanet
+        ringrows = ringcatalog[ringcatalog['planet'] == planet['name']]
+        # rebuilt when a missing texture file appears
+        bodyhash = body_hash(planet.tolist(), ringrows.tolist(),
+                             fallbacks.get(str(planet['name'])), settingshash)
+        bodies.append((str(planet['name']), bodyhash, add_planet, 
+                       (planet, settings, ringrows)))
+
+    # add minor bodies (asteroids, trans-Neptunian objects), 
+    # if a catalog of their orbital elements is available
+    minorfile = dir + 'minor_bodies.csv'
+    if os.path.isfile(minorfile):
+        stat = os.stat(minorfile)
+        bodyhash = body_hash(minorfile, stat.st_mtime, stat.st_size,
+                             planets['distance'].tolist(),
+                             planets['art_distance'].tolist(), settingshash)
+        bodies.append(('MinorBodies', bodyhash, add_minor_bodies,
+                       (minorfile, planets, settings)))
+
+    # move planets and moons by an N-body integration instead of fixed
+    # Kepler orbits (via the trajectory cache below)
+    use_nbody = False
+    massfile = dir + 'masses.csv'
+    moonfile = dir + 'moons.csv'
+    if use_nbody and os.path.isfile(moonfile):
+        for moon in planetdata.load_moons(moonfile):
+            bodyhash = body_hash(moon.tolist(), settingshash)
+            bodies.append((str(moon['name']), bodyhash, add_moon,
+                           (moon, settings)))
+
+    if incremental:
+        update_bodies(bodies)
+    else:
+        for name, bodyhash, func, args in bodies:
+            add_body(name, bodyhash, func, *args)
+
+    # the timing of the orbits, so lod, culling and mipmaps can compute
+    # the planets' positions instead of evaluating the scene per frame
+    bpy.context.scene['ephemeris'] = {
+        'file': os.path.abspath(filename),
+        'startframe': settings['startframe'],
+        'timefactor': settings['timefactor']}
+
+    # lower the resolution of spheres, rings and orbits, which are small
+    # on screen (as seen from the scene's camera over the animation);
+    # per_frame=True switches the resolution also during the animation
+    use_lod = False
+    if use_lod:
+        lod.apply(get_sphere_mesh, per_frame=False)
+
+    # hide objects in frames where they are outside of the camera's view
+    # or behind a planet (keyed on hide_render, only where it changes)
+    use_culling = False
+    if use_culling:
+        culling.apply(step=1)
+
+    # use each texture only in the resolution needed for the body's size
+    # on screen (mip levels cached next to the textures), within a memory
+    # budget for all textures; small ones optionally share an atlas
+    use_texture_budget = False
+    texture_budget = 256*2**20 # bytes
+    use_texture_atlas = False
+    if use_texture_budget:
+        mipmaps.apply(budget=texture_budget, use_atlas=use_texture_atlas)
+
+    # move the planets by positions baked into a trajectory file, read by
+    # a frame change handler, instead of constraints and keyframes
+    use_trajectory_cache = False
+    if use_trajectory_cache or use_nbody:
+        scene = bpy.context.scene
+        trajfile = dir + 'planets.traj'
+        if options.save:
+            # one per saved variant
+            trajfile = options.save + '.traj'
+        if use_nbody:
+            sizescales = [scenesettings.planet_sizescale(name, settings)
+                          for name in planets['name']]
+            nbody.bake(trajfile, filename, massfile, moonfile,
+                       scene.frame_start, scene.frame_end,
+                       settings['startframe'], settings['timefactor'],
+                       sizescales)
         else:
-            sizescale = sizescale_basic
-        
-        radius = float(planet['radius']) * sizescale
-        
-        # just put at some distance, not the true one
-        d = float(planet['art_distance'])
-        location = (d,0,0)
-
-        # parse color value
-        color = [float(c) for c in planet['color'][1:-1].split(',')]
-                
-        # create planet sphere and add material
-        obj = add_sphere(objname, radius, location)
-        mat = add_material(obj, name, color=color)
-        
-        # add texture
-        imgname = imgpath + planet['texture']
-        add_texture(mat, imgname)
+            trajectory.bake(trajfile, filename, scene.frame_start,
+                            scene.frame_end, settings['startframe'],
+                            settings['timefactor'])
+        trajectory.attach(trajfile, scene)
+    else:
+        trajectory.detach()
+
+    # free the datablocks of deleted bodies in one batch;
+    # keep unused images, so they can be reused in the next run
+    cleanup.purge_orphans(['materials', 'textures', 'meshes', 'curves', 
+                           'actions'])
+
+    texture_prefetch.stop()
+    texture_cache.report()
+
+    if options.save:
+        # images from prefetched pixels are not read from their files
+        texture_prefetch.pack_images()
+        bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(options.save))
+
+    if profile:
+        profiling.stop()
+        profiling.uninstrument(sys.modules[__name__])
+        profiling.uninstrument(rings)
+        profiling.report()
+        profiling.write_cprofile()
+        if tracefile is not None:
+            profiling.write_chrome_trace(tracefile)
 
-        # add flattening of planet-sphere
-        flattening = float(planet['flattening'])
-        add_flattening(obj, flattening)
-        
-        # add axis tilt
-        # via a parent for the axis-orientation,
-        # This allows to add planet rotation around itself (its z-axis) later on.
-        axisobj = create_axis_parent(name, obj)
-        
-        tilt = float(planet['tilt'])
-        tiltx = float(planet['tilt_x'])
-        tilty = float(planet['tilt_y'])
-        tiltz = float(planet['tilt_z'])
-        add_axial_tilt(axisobj, tilt, tiltx, tilty, tiltz)
-        
-        # add orbit paths, with planet distance as radius
-        # link with orbit material defined outside of loop
-        if (name != 'Sun'):
-            
-            orbitname = 'Planet-' + name + '-Orbit'
-            orbitobj = add_orbit(orbitname)
-            
-            # add Follow_Path to planet, to stick it to its orbit
-            axisobj.location = (0,0,0)
-            c = axisobj.constraints.new(type='FOLLOW_PATH')
-            c.target = orbitobj
-
-            # add orbit animation
-            startframe = 50
-            duration = int( float(planet['orbitperiod'])*timefactor  + 0.5)
-            add_orbit_animation(orbitobj, startframe, duration)
-            
-        # add rotation of planet around its axis
-        # Beware of axis tilt!!  
-        startframe = 1
-        time = int(  float(planet['rotperiod'])*timefactor  + 0.5)
-        add_rotation_animation(obj, startframe, time)
+    return
 
-        # add Saturn rings
-        img = imgpath + 'Saturn_rings_thin.png'
 
-        if name == 'Saturn':
-            rings.add_saturn_rings(obj, name, sizescale, img)
-        
-        # add Uranus ring
-        if name == 'Uranus':
-            rings.add_uranus_rings(obj, name, sizescale)
+if __name__ == '__main__':
 
-    # sun adjustments
-    obj = bpy.data.objects['Planet-Sun']
-    sunmat = obj.material_slots[0].material
-    sunmat.use_shadows = False # otherwise orbits cast shadow on sun-surface
-    sunmat.use_shadeless = True # now also no shadow received
-    
-    # allow light of point source to transmit through the sun's surface
-    sunmat.use_cast_shadows = False
-    sunmat.use_cast_buffer_shadows = False
-    
\ No newline at end of file
+    dir = os.path.dirname(bpy.data.filepath) + os.sep
+    settings = default_settings(dir)
+
+    # options from the command line (e.g. from sweep.py)
+    argv = sys.argv[sys.argv.index('--')+1:] if '--' in sys.argv else []
+    options = parse_arguments(argv)
+    unknown = set(options.settings) - set(settings)
+    if unknown:
+        raise RuntimeError("create_planet: unknown settings %s."
+                           % ', '.join(sorted(unknown)))
+    settings.update(options.settings)
+
+    build(dir, settings, options)
@@ -0,0 +1,221 @@
+import bpy
+import numpy as np
+import bake
+import lod
+
+# Visibility culling, precomputed for the whole animation.
+# The camera and all objects of the project are sampled at every frame
+# (or every step-th frame), and each object's bounding sphere is tested
+# against the camera's view frustum, and against the planet spheres in
+# front of it (an object completely covered by a nearer sphere is hidden
+# as well). All tests run vectorized over frames and objects.
+# hide_render (and the viewport visibility) is then keyed with constant
+# interpolation, only at the frames where it changes.
+
+# maximum number of (frame, object, occluder) triples tested at once
+CHUNK_TRIPLES = 2**22
+
+
+def frustum_tangents(scene, camobj):
+    """Return half width and half height of the view, as tangents of the
+    half angles (perspective) or in Blender units (orthographic)"""
+    render = scene.render
+    w = render.resolution_x * render.pixel_aspect_x
+    h = render.resolution_y * render.pixel_aspect_y
+    cam = camobj.data
+    fit = cam.sensor_fit
+    if fit == 'AUTO':
+        fit = 'HORIZONTAL' if w >= h else 'VERTICAL'
+
+    if cam.type == 'ORTHO':
+        half = 0.5*cam.ortho_scale
+    elif cam.sensor_fit == 'VERTICAL':
+        half = 0.5*cam.sensor_height/cam.lens
+    else:
+        half = 0.5*cam.sensor_width/cam.lens
+
+    if fit == 'HORIZONTAL':
+        return half, half*h/w
+    return half*w/h, half
+
+
+def frustum_visible(cammats, centers, radii, tx, ty, clip_start, clip_end,
+                    ortho=False):
+    """Test bounding spheres against the view frustum,
+    returns bool array (frames, objects)
+    cammats -- camera matrices (frames, 4, 4), camera looks along -z
+    centers, radii -- bounding spheres (frames, objects, 3) and
+                      (frames, objects)
+    tx, ty -- see frustum_tangents
+    clip_start, clip_end -- clipping distances of the camera
+    ortho -- orthographic camera
+    """
+    inv = np.linalg.inv(cammats)
+    p = (np.einsum('fij,foj->foi', inv[:,:3,:3], centers)
+         + inv[:,None,:3,3])
+    x = np.abs(p[...,0])
+    y = np.abs(p[...,1])
+    d = -p[...,2]
+    r = radii
+
+    visible = (d + r > clip_start) & (d - r < clip_end)
+    if ortho:
+        visible &= (x - r < tx) & (y - r < ty)
+    else:
+        # distance to the side planes of the frustum
+        visible &= (x - tx*d)/np.sqrt(1 + tx**2) < r
+        visible &= (y - ty*d)/np.sqrt(1 + ty**2) < r
+
+    return visible
+
+
+def occluded(campos, centers, radii, occluder_radii):
+    """Test which bounding spheres are completely covered by a nearer
+    sphere, returns bool array (frames, objects)
+    campos -- camera positions (frames, 3)
+    centers, radii -- bounding spheres (frames, objects, 3) and
+                      (frames, objects)
+    occluder_radii -- radius of the opaque sphere around the center of
+                      each object (objects), 0 if it is no occluder
+    """
+    occluders = np.flatnonzero(occluder_radii > 0)
+    hidden = np.zeros(radii.shape, dtype=bool)
+    if len(occluders) == 0:
+        return hidden
+
+    # in chunks of frames, to limit the memory
+    step = max(1, CHUNK_TRIPLES // (radii.shape[1]*len(occluders)))
+    for first in range(0, len(campos), step):
+        s = slice(first, first + step)
+        hidden[s] = _occluded(campos[s], centers[s], radii[s],
+                              occluder_radii, occluders)
+
+    return hidden
+
+
+def _occluded(campos, centers, radii, occluder_radii, occluders):
+    """Occlusion test for a chunk of frames, see occluded
+    occluders -- indices of the objects with occluder_radii > 0
+    """
+    v = centers - campos[:,None,:]
+    dist = np.sqrt((v**2).sum(axis=2))
+    dist = np.maximum(dist, 1e-12)
+    u = v / dist[...,None]
+    # angular radius of each bounding sphere and of each occluder,
+    # and angle between the directions
+    alpha = np.arcsin(np.clip(radii/dist, 0, 1))
+    odist = dist[:,occluders]
+    beta = np.arcsin(np.clip(occluder_radii[occluders][None,:]/odist, 0, 1))
+    theta = np.arccos(np.clip(np.einsum('fji,fki->fjk', u, u[:,occluders]),
+                              -1, 1))
+
+    # j is hidden by k, if j lies behind the center of k (then k's
+    # visible surface is nearer) and j's disk is inside k's disk
+    behind = (dist - radii)[:,:,None] > odist[:,None,:]
+    inside = theta + alpha[:,:,None] <= beta[:,None,:]
+    hidden = behind & inside
+    hidden[:, occluders, np.arange(len(occluders))] = False
+
+    return hidden.any(axis=2)
+
+
+def dilate(visible):
+    """Make an object visible also at the sampled frames next to frames
+    where it is visible, so it is not hidden too early or too late
+    between the samples"""
+    result = visible.copy()
+    result[1:] |= visible[:-1]
+    result[:-1] |= visible[1:]
+
+    return result
+
+
+def key_visibility(obj, frames, visible, viewport=True):
+    """Key hide_render (and the viewport visibility) of an object at the
+    frames where its visibility changes; remove the keys if it is
+    always visible
+    obj -- the object
+    frames -- sampled frames
+    visible -- visibility at the sampled frames, bool array
+    viewport -- also hide in the viewport
+    """
+    paths = ['hide_render']
+    if viewport:
+        # hide_viewport in Blender 2.80 and newer
+        paths.append('hide_viewport' if hasattr(obj, 'hide_viewport')
+                     else 'hide')
+
+    if visible.all():
+        action = obj.animation_data.action if obj.animation_data else None
+        if action is not None:
+            for fcu in list(action.fcurves):
+                if fcu.data_path in paths:
+                    action.fcurves.remove(fcu)
+        for path in paths:
+            setattr(obj, path, False)
+        return 0
+
+    changes = np.flatnonzero(visible[1:] != visible[:-1]) + 1
+    keys = np.concatenate(([0], changes))
+    keyframes = np.asarray(frames)[keys]
+    values = ~visible[keys]
+    for path in paths:
+        bake.bake_fcurve(obj, path, keyframes, values,
+                         interpolation='CONSTANT', group='Visibility')
+
+    return len(keys)
+
+
+def apply(scene=None, camobj=None, step=1, margin=1.2, viewport=True,
+          use_occlusion=True):
+    """Compute the visibility of all objects of the project for all
+    frames of the scene, and key it at the changes.
+    Returns the fraction of hidden object-frames.
+    scene -- scene (default: current scene)
+    camobj -- camera (default: the scene's camera)
+    step -- test every step-th frame only
+    margin -- factor for the bounding spheres
+    viewport -- also hide in the viewport
+    use_occlusion -- also hide objects behind planet spheres
+    """
+    scene = scene or bpy.context.scene
+    camobj = camobj or scene.camera
+    if camobj is None:
+        print("No camera, visibility not changed.")
+        return 0.
+
+    frames = list(range(scene.frame_start, scene.frame_end+1, step))
+    if frames[-1] != scene.frame_end:
+        frames.append(scene.frame_end)
+
+    items = lod.lod_objects(scene)
+    objs = [obj for obj, kind in items]
+    cammats, centers, radii = lod.sample(scene, camobj, objs, frames)
+    radii = margin*radii
+
+    cam = camobj.data
+    tx, ty = frustum_tangents(scene, camobj)
+    visible = frustum_visible(cammats, centers, radii, tx, ty,
+                              cam.clip_start, cam.clip_end,
+                              cam.type == 'ORTHO')
+    if use_occlusion and cam.type != 'ORTHO':
+        # planet spheres (with radius 1) are scaled, but not animated
+        # in scale; the smallest scale gives a sphere inside a flattened
+        # planet
+        occluder_radii = np.array([min(obj.matrix_world.to_scale())
+                                   if kind == 'sphere' else 0.
+                                   for obj, kind in items])
+        visible &= ~occluded(cammats[:,:3,3], centers, radii,
+                             occluder_radii)
+    visible = dilate(visible)
+
+    nkeys = 0
+    for j, obj in enumerate(objs):
+        nkeys += key_visibility(obj, frames, visible[:,j], viewport)
+
+    hidden = 1. - visible.mean() if visible.size else 0.
+    print("Visibility of %d object(s) keyed from %d frames: %.0f%% of the "
+          "object-frames hidden, %d key(s)."
+          % (len(objs), len(frames), 100*hidden, nkeys))
+
+    return hidden
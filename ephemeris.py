@@ -0,0 +1,196 @@
+"""Positions and rotations of the planets, computed from planets.csv.
+
+The orbital elements of all bodies are loaded once into arrays, and
+positions, rotation angles and positions along the orbit paths are
+computed for arrays of dates, vectorized over bodies and times; the
+results have the shape (bodies, times, ...). Results are memoized, so
+asking again for the same dates costs nothing.
+This module does not need Blender, e.g.:
+
+    import ephemeris
+    el = ephemeris.load('planets.csv')
+    t = ephemeris.days(np.arange('2024-01', '2025-01', dtype='M8[D]'))
+    pos = ephemeris.positions(el, t)        # km, shape (9, 366, 3)
+
+Conventions are those of the scene built by create_planet.py: the orbits
+lie in the x-y-plane, the perihelion points along start_angle (+y) and
+each planet passes its perihelion at the epoch (time 0), since
+planets.csv has no phases. The sun stays at the origin.
+"""
+import hashlib
+import numpy as np
+import kepler
+import planetdata
+
+# reference date for times given as days
+EPOCH = np.datetime64('2000-01-01T12:00')
+
+# direction of the perihelion, as used for the orbit paths in the scene
+START_ANGLE = 0.5*np.pi
+
+# maximum number of memoized results
+MEMO_SIZE = 64
+
+# memoized results: (function, elements key, arguments) -> array
+_memo = {}
+
+
+def load(filename, cachedir=None):
+    """Load the orbital elements of all bodies from a csv-file like
+    planets.csv, as dictionary of arrays (one value per body)"""
+    planets = planetdata.load_planets(filename, cachedir)
+    return elements(planets)
+
+
+def elements(planets):
+    """Return the orbital elements as dictionary of arrays
+    planets -- structured array, see planetdata.load_planets
+    """
+    deg = np.pi/180.
+    period = planets['orbitperiod'].astype(float)
+    el = {
+        'name': planets['name'].copy(),
+        # semi-major axis, in km and in Blender units of the scene
+        'a': planets['distance'].astype(float),
+        'art_a': planets['art_distance'].astype(float),
+        'e': planets['eccentricity'].astype(float),
+        # orbital period in days; 0 for the sun, which does not move
+        'period': np.where(period > 0, period, np.inf),
+        'M0': np.zeros(len(planets)),
+        'inclination': np.zeros(len(planets)),
+        'node': np.zeros(len(planets)),
+        'periapsis': np.full(len(planets), START_ANGLE),
+        # rotation period in days, negative for retrograde rotation
+        'rotperiod': planets['rotperiod'].astype(float),
+        'tilt': np.stack([planets['tilt_x'], planets['tilt_y'],
+                          planets['tilt_z']], axis=-1)*deg,
+    }
+    el['key'] = hashlib.sha1(planets.tobytes()).hexdigest()
+
+    return el
+
+
+def index(el, name):
+    """Return the index of the body with the given name"""
+    found = np.flatnonzero(el['name'] == name)
+    if len(found) == 0:
+        raise KeyError("index: no body named %s." % name)
+    return int(found[0])
+
+
+def days(dates, epoch=EPOCH):
+    """Convert dates (numpy datetime64) to days since the epoch;
+    numbers are taken as days already"""
+    dates = np.asarray(dates)
+    if np.issubdtype(dates.dtype, np.datetime64):
+        return (dates - epoch) / np.timedelta64(1, 'D')
+    return dates.astype(float)
+
+
+def frames_to_days(frames, startframe, timefactor):
+    """Convert frame numbers of the scene to days since the epoch
+    startframe -- frame at the epoch (start of the orbit animations)
+    timefactor -- number of frames per day
+    """
+    return (np.asarray(frames, dtype=float) - startframe) / timefactor
+
+
+def _memoized(name, el, t, func):
+    """Return func(), memoized for the given elements and times"""
+    t = np.ascontiguousarray(t, dtype=float)
+    key = (name, el['key'], t.shape, hashlib.sha1(t.tobytes()).hexdigest())
+    result = _memo.get(key)
+    if result is None:
+        if len(_memo) >= MEMO_SIZE:
+            del _memo[next(iter(_memo))]
+        result = func()
+        result.flags.writeable = False
+        _memo[key] = result
+
+    return result
+
+
+def clear():
+    """Forget all memoized results"""
+    _memo.clear()
+
+    return
+
+
+def eccentric_anomalies(el, t):
+    """Return the eccentric anomalies, shape (bodies, times)
+    el -- orbital elements, see load
+    t -- times, in days since the epoch
+    """
+    t = np.asarray(t, dtype=float)
+
+    def compute():
+        M = kepler.mean_anomaly(t[None,:], el['period'][:,None],
+                                el['M0'][:,None])
+        return kepler.solve_kepler(M, el['e'][:,None])
+
+    return _memoized('eccentric_anomalies', el, t, compute)
+
+
+def positions(el, t, art=False):
+    """Return heliocentric positions, shape (bodies, times, 3)
+    el -- orbital elements, see load
+    t -- times, in days since the epoch
+    art -- in Blender units of the scene (art_distance) instead of km
+    """
+    t = np.asarray(t, dtype=float)
+
+    def compute():
+        E = eccentric_anomalies(el, t)
+        a = el['art_a' if art else 'a'][:,None]
+        x, y = kepler.orbit_plane_positions(a, el['e'][:,None], E)
+        x, y, z = kepler.rotate_to_ecliptic(x, y, el['inclination'][:,None],
+                                            el['node'][:,None],
+                                            el['periapsis'][:,None])
+        return np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+
+    return _memoized('positions-art' if art else 'positions', el, t,
+                     compute)
+
+
+def path_fractions(el, t):
+    """Return the position along the orbit paths as fraction of their
+    length, counting full orbits, shape (bodies, times); times 100 this
+    is the evaluation time of a path with path_duration 100
+    el -- orbital elements, see load
+    t -- times, in days since the epoch
+    """
+    t = np.asarray(t, dtype=float)
+
+    def compute():
+        E = eccentric_anomalies(el, t)
+        return kepler.arc_length_fraction(E, el['e'][:,None])
+
+    return _memoized('path_fractions', el, t, compute)
+
+
+def rotation_angles(el, t):
+    """Return the rotation angles of the bodies around their own axis,
+    in radians, shape (bodies, times); 0 at the epoch
+    el -- orbital elements, see load
+    t -- times, in days since the epoch
+    """
+    t = np.asarray(t, dtype=float)
+
+    def compute():
+        return 2*np.pi * t[None,:] / el['rotperiod'][:,None]
+
+    return _memoized('rotation_angles', el, t, compute)
+
+
+def orbit_path_fractions(eccentricity, samples):
+    """Return the fractions of the path length at samples+1 evenly spaced
+    times of one orbit (starting at the perihelion), for one orbit
+    eccentricity -- eccentricity of the orbit
+    samples -- number of time intervals
+    """
+    el = {'key': 'orbit-%r' % float(eccentricity), 'period': np.ones(1),
+          'M0': np.zeros(1), 'e': np.array([float(eccentricity)])}
+    t = np.arange(samples+1) / float(samples)
+
+    return path_fractions(el, t)[0]
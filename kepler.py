@@ -0,0 +1,199 @@
+"""Keplerian orbits, vectorized with numpy.
+
+Everything in here works on arrays of bodies and times at once and does
+not need Blender, so it can be used (and tested) in plain Python as well.
+Conventions: the central body sits in one focus of the ellipse,
+the perihelion lies along the +x-axis of the orbit plane, bodies move
+counter-clockwise when seen from +z. Angles are given in radians.
+Arrays for bodies and times are combined via numpy broadcasting,
+e.g. a[:,None] and t[None,:] give results of shape (bodies, times).
+"""
+import numpy as np
+
+
+def mean_anomaly(t, period, M0=0., t0=0.):
+    """Return the mean anomaly at given time(s)
+    t -- time(s), same unit as period
+    period -- orbital period
+    M0 -- mean anomaly at time t0
+    t0 -- reference time
+    """
+    t = np.asarray(t, dtype=float)
+    return M0 + 2*np.pi * (t - t0) / period
+
+
+def solve_kepler(M, e, tol=1e-10, maxiter=30):
+    """Solve Kepler's equation M = E - e*sin(E) for the eccentric anomaly E
+    M -- mean anomaly, array; not limited to [0, 2pi), so
+         the result is continuous over several orbits
+    e -- eccentricity (0 <= e < 1), broadcastable against M
+    tol -- tolerance for the Newton iteration
+    maxiter -- maximum number of Newton steps
+    """
+    M = np.asarray(M)
+    if not np.issubdtype(M.dtype, np.floating):
+        M = M.astype(float)
+    e = np.asarray(e, dtype=M.dtype)
+    tol = max(tol, 4*np.finfo(M.dtype).eps)
+
+    # starting value after Danby (1987), good for all e < 1
+    E = M + 0.85*e*np.sign(np.sin(M))
+
+    # Newton iteration, in place to keep the number of temporary
+    # arrays low for large numbers of bodies and times
+    f = np.empty_like(E)
+    g = np.empty_like(E)
+    for i in range(maxiter):
+        np.sin(E, out=f)
+        f *= e
+        f -= E
+        f += M      # f = -(E - e*sin(E) - M)
+        np.cos(E, out=g)
+        g *= e
+        g -= 1      # g = -(1 - e*cos(E))
+        f /= g
+        E -= f
+        if f.size == 0 or np.abs(f).max() < tol:
+            break
+
+    return E
+
+
+def true_anomaly(E, e):
+    """Return the true anomaly for given eccentric anomaly E
+    E -- eccentric anomaly; the result is continuous (unwrapped) as well
+    e -- eccentricity, broadcastable against E
+    """
+    E = np.asarray(E, dtype=float)
+    e = np.asarray(e, dtype=float)
+    beta = e / (1 + np.sqrt(1 - e*e))
+    return E + 2*np.arctan2(beta*np.sin(E), 1 - beta*np.cos(E))
+
+
+def orbit_plane_positions(a, e, E):
+    """Return x, y positions in the orbit plane for eccentric anomaly E
+    a -- semi-major axis
+    e -- eccentricity
+    E -- eccentric anomaly
+    """
+    b = a * np.sqrt(1 - np.asarray(e)**2)
+    x = a * (np.cos(E) - e)
+    y = b * np.sin(E)
+    return x, y
+
+
+def orbit_plane_tangents(a, e, E):
+    """Return derivatives dx/dE, dy/dE of the orbit plane positions
+    a -- semi-major axis
+    e -- eccentricity
+    E -- eccentric anomaly
+    """
+    b = a * np.sqrt(1 - np.asarray(e)**2)
+    dx = -a * np.sin(E)
+    dy = b * np.cos(E)
+    return dx, dy
+
+
+def ellipse_geometry(a, e, num=100):
+    """Return points along the orbit ellipse(s), sampled evenly in E
+    a -- semi-major axis, scalar or array of bodies
+    e -- eccentricity, scalar or array of bodies
+    num -- number of points per ellipse
+    Returns an array of shape (bodies, num, 2), resp. (num, 2) for scalars.
+    """
+    E = np.linspace(0, 2*np.pi, num, endpoint=False)
+    a = np.asarray(a, dtype=float)[..., None]
+    e = np.asarray(e, dtype=float)[..., None]
+    x, y = orbit_plane_positions(a, e, E)
+    return np.stack(np.broadcast_arrays(x, y), axis=-1)
+
+
+def rotate_to_ecliptic(x, y, inclination=0., node=0., periapsis=0.):
+    """Rotate orbit plane coordinates into the reference frame
+    x, y -- positions in the orbit plane (perihelion along +x)
+    inclination -- inclination of the orbit plane
+    node -- longitude of the ascending node
+    periapsis -- argument of periapsis
+    Returns x, y, z arrays.
+    """
+    cw, sw = np.cos(periapsis), np.sin(periapsis)
+    cn, sn = np.cos(node), np.sin(node)
+    ci, si = np.cos(inclination), np.sin(inclination)
+
+    # rotation matrix R_z(node) R_x(inclination) R_z(periapsis),
+    # applied to (x, y, 0)
+    xx = cn*cw - sn*sw*ci
+    xy = -cn*sw - sn*cw*ci
+    yx = sn*cw + cn*sw*ci
+    yy = -sn*sw + cn*cw*ci
+    zx = sw*si
+    zy = cw*si
+
+    return xx*x + xy*y, yx*x + yy*y, zx*x + zy*y
+
+
+def positions(t, a, e, period, M0=0., inclination=0., node=0.,
+              periapsis=0., t0=0.):
+    """Return positions of bodies at given times
+    t -- time(s)
+    a, e, period, M0 -- semi-major axis, eccentricity, period,
+                        mean anomaly at time t0
+    inclination, node, periapsis -- orientation of the orbit, see
+                                    rotate_to_ecliptic
+    All parameters are broadcast against each other, so use e.g.
+    t[None,:] and a[:,None] to get all bodies at all times.
+    Returns an array of shape (..., 3).
+    """
+    E = solve_kepler(mean_anomaly(t, period, M0, t0), e)
+    x, y = orbit_plane_positions(a, e, E)
+    x, y, z = rotate_to_ecliptic(x, y, inclination, node, periapsis)
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+
+
+def velocities(t, a, e, period, M0=0., inclination=0., node=0.,
+               periapsis=0., t0=0.):
+    """Return velocities of bodies at given times, in units of a per
+    unit of the period; parameters as for positions.
+    Returns an array of shape (..., 3).
+    """
+    E = solve_kepler(mean_anomaly(t, period, M0, t0), e)
+    # dE/dt from Kepler's equation
+    dEdt = 2*np.pi / period / (1 - e*np.cos(E))
+    dx, dy = orbit_plane_tangents(a, e, E)
+    vx, vy, vz = rotate_to_ecliptic(dx*dEdt, dy*dEdt, inclination, node,
+                                    periapsis)
+    return np.stack(np.broadcast_arrays(vx, vy, vz), axis=-1)
+
+
+def arc_length_fraction(E, e, samples=256):
+    """Return the fraction of the ellipse's circumference from perihelion
+    to eccentric anomaly E, counting full orbits (so 1.5 means half-way
+    through the second orbit)
+    E -- eccentric anomaly, may span several orbits
+    e -- eccentricity, broadcastable against E
+    samples -- number of samples for the arc length table of each ellipse
+    """
+    E = np.asarray(E, dtype=float)
+    e = np.asarray(e, dtype=float)
+    e, E = np.broadcast_arrays(e, E)
+    if E.size == 0:
+        return np.zeros(E.shape)
+    # one table per distinct eccentricity, since that is usually few
+    # (one per body) compared to the number of times
+    eu, inverse = np.unique(e, return_inverse=True)
+
+    # arc length element: ds = a*sqrt(1 - e^2 cos^2(E)) dE
+    grid = np.linspace(0, 2*np.pi, samples+1)
+    ds = np.sqrt(1 - (eu[:,None]*np.cos(grid))**2)
+    s = np.zeros((len(eu), samples+1))
+    np.cumsum(0.5*(ds[:,1:] + ds[:,:-1]), axis=1, out=s[:,1:])
+    s /= s[:,-1:]
+
+    turns = np.floor(E / (2*np.pi))
+    pos = (E - 2*np.pi*turns) / (2*np.pi) * samples
+    i = np.minimum(pos.astype(int), samples-1)
+    w = pos - i
+    row = inverse.reshape(E.shape)
+    frac = (1-w)*s[row, i] + w*s[row, i+1]
+
+    return turns + frac
@@ -0,0 +1,336 @@
+import os
+import bpy
+import mathutils
+import numpy as np
+import ephemeris
+import paths
+import rings
+
+# Level of detail, depending on the distance to the camera.
+# The camera and all bodies are sampled at a number of frames (so the
+# animated camera path and track-to target are taken into account, as
+# well as the orbits of the planets), and the largest size of each
+# object on screen, in pixels, selects its resolution:
+# - planet spheres get one of the shared sphere meshes,
+# - orbit paths get their curve resolution,
+# - ring meshes are rebuilt with fewer segments.
+# With per_frame=True, the sphere meshes and curve resolutions are in
+# addition switched per frame range by a frame change handler, using the
+# schedule stored in the objects (custom property 'lod_schedule').
+# The planets are not evaluated by Blender at the sampled frames: they
+# move by their orbital elements (scene['ephemeris'], set by
+# create_planet.py), objects without animation stay in place, and only
+# the camera and any other animated objects are evaluated per frame.
+
+# levels: minimum size on screen in pixels, sphere segments and rings,
+# curve resolution, ring segments; from fine to coarse
+LEVELS = [
+    (200, 72, 36, 100, 100),
+    (50, 48, 24, 48, 64),
+    (12, 24, 12, 24, 32),
+    (0, 12, 6, 12, 16),
+]
+
+# number of frames sampled at once
+CHUNK_FRAMES = 1000
+
+# function for the sphere meshes, used by the frame handler;
+# kept when the module is reloaded
+if '_state' not in globals():
+    _state = {}
+
+
+def pixels_per_unit(scene, camobj):
+    """Return the factor converting size/distance to pixels on screen
+    (for orthographic cameras, converting size to pixels)"""
+    render = scene.render
+    width = render.resolution_x * render.resolution_percentage / 100.
+    cam = camobj.data
+    if cam.type == 'ORTHO':
+        return width / cam.ortho_scale
+    return width * cam.lens / cam.sensor_width
+
+
+def bounding_sphere(obj):
+    """Return center and radius of the object's bounding box, in world
+    coordinates"""
+    mw = obj.matrix_world
+    corners = np.array([tuple(mw * mathutils.Vector(c))
+                        for c in obj.bound_box])
+    center = 0.5*(corners.min(axis=0) + corners.max(axis=0))
+    radius = np.sqrt(((corners - center)**2).sum(axis=1)).max()
+
+    return center, radius
+
+
+def lod_objects(scene):
+    """Return the objects of the project with adjustable resolution,
+    as list of (object, kind) with kind 'sphere', 'curve' or 'ringmesh'"""
+    objs = []
+    for obj in scene.objects:
+        if not obj.name.startswith('Planet'):
+            continue
+        if obj.type == 'MESH' and obj.data.name.startswith('Planet-Sphere-'):
+            objs.append((obj, 'sphere'))
+        elif obj.type == 'MESH' and obj.get('ring_radii') is not None:
+            objs.append((obj, 'ringmesh'))
+        elif obj.type == 'CURVE':
+            objs.append((obj, 'curve'))
+
+    return objs
+
+
+def body_motion(scene):
+    """Return the body names and a function returning their positions
+    (frames, bodies, 3) for an array of frames, from the orbital
+    elements stored in the scene by create_planet.py; ([], None) if
+    there are none"""
+    info = scene.get('ephemeris')
+    if info is None or not os.path.isfile(info['file']):
+        return [], None
+    el = ephemeris.load(info['file'])
+    startframe = info['startframe']
+    timefactor = info['timefactor']
+
+    def motion(frames):
+        t = ephemeris.frames_to_days(frames, startframe, timefactor)
+        pos = ephemeris.positions(el, t, art=True).transpose(1, 0, 2)
+        # not memoized, each chunk of frames is used once
+        ephemeris.clear()
+        return pos
+
+    return [str(name) for name in el['name']], motion
+
+
+def _moving_body(obj, index):
+    """Return the object (the given one or a parent) named after a body,
+    'Planet-<body>-Axes' or 'Planet-<body>', and the body's index;
+    (None, None) if there is none"""
+    while obj is not None:
+        name = obj.name
+        if name.endswith('-Axes'):
+            name = name[:-len('-Axes')]
+        body = name[len('Planet-'):] if name.startswith('Planet-') else None
+        if body in index:
+            return obj, index[body]
+        obj = obj.parent
+
+    return None, None
+
+
+def is_static(obj):
+    """Check if neither an object nor its parents are animated or
+    constrained"""
+    while obj is not None:
+        if obj.animation_data is not None:
+            return False
+        if any(not c.mute for c in obj.constraints):
+            return False
+        obj = obj.parent
+
+    return True
+
+
+def sample(scene, camobj, objs, frames):
+    """Return camera matrices (frames, 4, 4), object centers
+    (frames, objects, 3) and radii (frames, objects) at the given frames;
+    bodies move by their orbital elements (see body_motion), only the
+    camera and other animated objects are evaluated per frame"""
+    frames = np.asarray(frames, dtype=int)
+    names, motion = body_motion(scene)
+    index = dict((name, i) for i, name in enumerate(names))
+    current = scene.frame_current
+
+    cammats = np.zeros((len(frames), 4, 4))
+    centers = np.zeros((len(frames), len(objs), 3))
+    radii = np.zeros((len(frames), len(objs)))
+    moving = []
+    evaluated = []
+    for j, obj in enumerate(objs):
+        center, radius = bounding_sphere(obj)
+        radii[:,j] = radius
+        bodyobj, body = _moving_body(obj, index) if motion else (None, None)
+        if bodyobj is not None:
+            # offset from the body, added to its positions below
+            centers[:,j] = center - np.array(bodyobj.matrix_world.translation)
+            moving.append((j, body))
+        elif is_static(obj):
+            centers[:,j] = center
+        else:
+            evaluated.append(j)
+
+    static_camera = is_static(camobj)
+    if static_camera:
+        cammats[:] = [tuple(row) for row in camobj.matrix_world]
+    for first in range(0, len(frames), CHUNK_FRAMES):
+        chunk = frames[first:first+CHUNK_FRAMES]
+        if moving:
+            j, body = np.array(moving).T
+            centers[first:first+len(chunk), j] += motion(chunk)[:,body]
+        if static_camera and not evaluated:
+            continue
+        for i, frame in enumerate(chunk, first):
+            scene.frame_set(int(frame))
+            cammats[i] = [tuple(row) for row in camobj.matrix_world]
+            for j in evaluated:
+                centers[i,j], radii[i,j] = bounding_sphere(objs[j])
+    if len(evaluated) or not static_camera:
+        scene.frame_set(current)
+
+    return cammats, centers, radii
+
+
+def projected_sizes(campos, centers, radii, factor, ortho=False):
+    """Return the size on screen in pixels, shape (frames, objects)
+    campos -- camera positions, shape (frames, 3)
+    centers, radii -- bounding spheres, shape (frames, objects, 3)
+                      and (frames, objects)
+    factor -- see pixels_per_unit
+    ortho -- orthographic camera, size does not depend on the distance
+    """
+    if ortho:
+        return 2*radii*factor
+    dist = np.sqrt(((centers - campos[:,None,:])**2).sum(axis=2))
+    # inside the bounding sphere: full resolution
+    dist = np.maximum(dist - radii, 1e-9)
+
+    return 2*radii/dist*factor
+
+
+def choose_levels(sizes):
+    """Return the level index for given sizes on screen (array)"""
+    sizes = np.asarray(sizes)
+    levels = np.full(sizes.shape, len(LEVELS)-1, dtype=int)
+    for k in range(len(LEVELS)-1, -1, -1):
+        levels[sizes >= LEVELS[k][0]] = k
+
+    return levels
+
+
+def set_level(obj, kind, level, get_sphere_mesh):
+    """Set the resolution of an object to the given level"""
+    minsize, segments, ring_count, resolution, ringsegments = LEVELS[level]
+    if kind == 'sphere':
+        mesh = get_sphere_mesh(segments, ring_count)
+        if obj.data != mesh:
+            obj.data = mesh
+    elif kind == 'curve':
+        if (obj.data.splines and
+                obj.data.splines[0].resolution_u != resolution):
+            # with the keys of the orbit animation converted, which were
+            # made for the old resolution
+            paths.set_resolution(obj, resolution)
+    elif kind == 'ringmesh':
+        if obj['ring_segments'] != ringsegments:
+            radii = np.reshape(obj['ring_radii'], (-1, 2))
+            rings.fill_ring_mesh(obj, radii[:,0], radii[:,1],
+                                 obj['ring_uv_range'], ringsegments)
+
+    return
+
+
+def apply(get_sphere_mesh, scene=None, camobj=None, frames=None,
+          nsamples=60, margin=1.5, per_frame=False):
+    """Choose the resolution of all objects of the project from their
+    size on screen, returns dictionary object name -> level
+    get_sphere_mesh -- function returning the shared sphere mesh for
+                       given segments and ring_count (from create_planet)
+    scene -- scene (default: current scene)
+    camobj -- camera (default: the scene's camera)
+    frames -- frames to sample (default: nsamples frames of the scene's
+              frame range)
+    margin -- factor for the sizes, since the sizes between the sampled
+              frames can be larger
+    per_frame -- also switch sphere meshes and curve resolutions between
+                 the sampled frames, via a frame change handler
+    """
+    scene = scene or bpy.context.scene
+    camobj = camobj or scene.camera
+    if camobj is None:
+        print("No camera, level of detail not changed.")
+        return {}
+    if frames is None:
+        frames = np.unique(np.linspace(scene.frame_start, scene.frame_end,
+                                       nsamples).round().astype(int))
+    frames = [int(f) for f in frames]
+
+    items = lod_objects(scene)
+    objs = [obj for obj, kind in items]
+    cammats, centers, radii = sample(scene, camobj, objs, frames)
+    sizes = margin * projected_sizes(cammats[:,:3,3], centers, radii,
+                                     pixels_per_unit(scene, camobj),
+                                     camobj.data.type == 'ORTHO')
+    levels = choose_levels(sizes)
+
+    result = {}
+    for j, (obj, kind) in enumerate(items):
+        # finest level needed in the whole animation
+        level = int(levels[:,j].min())
+        result[obj.name] = level
+        if per_frame and kind != 'ringmesh':
+            # level from each sampled frame on: finest of both ends
+            # of the interval up to the next sampled frame
+            finest = np.minimum(levels[:,j], np.append(levels[1:,j],
+                                                       levels[-1,j]))
+            schedule = []
+            for frame, lev in zip(frames, finest):
+                if not schedule or lev != schedule[-1][1]:
+                    schedule.append([frame, int(lev)])
+            obj['lod_schedule'] = schedule
+            obj['lod_kind'] = kind
+            if kind == 'sphere':
+                # keep the meshes of all levels in the blend-file
+                for start, lev in schedule:
+                    get_sphere_mesh(*LEVELS[lev][1:3]).use_fake_user = True
+        elif 'lod_schedule' in obj:
+            del obj['lod_schedule']
+        set_level(obj, kind, level, get_sphere_mesh)
+
+    _state['get_sphere_mesh'] = get_sphere_mesh
+    if per_frame:
+        register_handler()
+
+    counts = np.bincount(list(result.values()), minlength=len(LEVELS))
+    print("Level of detail from %d frames: %s object(s) per level."
+          % (len(frames), ', '.join(str(c) for c in counts)))
+
+    return result
+
+
+def schedule_level(schedule, frame):
+    """Return the level of a schedule [[frame, level], ...] at a frame"""
+    level = schedule[0][1]
+    for start, lev in schedule:
+        if start > frame:
+            break
+        level = lev
+
+    return level
+
+
+def frame_change_handler(scene):
+    """Switch the resolution of objects with a schedule to the current
+    frame"""
+    get_sphere_mesh = _state.get('get_sphere_mesh')
+    if get_sphere_mesh is None:
+        return
+    for obj in scene.objects:
+        schedule = obj.get('lod_schedule')
+        if schedule is None:
+            continue
+        level = schedule_level(schedule, scene.frame_current)
+        set_level(obj, obj['lod_kind'], level, get_sphere_mesh)
+
+    return
+
+
+def register_handler():
+    """Add the frame change handler (once, also after module reloads)"""
+    handlers = bpy.app.handlers.frame_change_pre
+    for h in list(handlers):
+        if (h.__name__ == frame_change_handler.__name__ and
+                h.__module__ == frame_change_handler.__module__):
+            handlers.remove(h)
+    handlers.append(frame_change_handler)
+
+    return
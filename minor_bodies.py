@@ -0,0 +1,234 @@
+import bpy
+import os
+import sys
+import itertools
+import numpy as np
+try:
+    import reloader
+except ImportError:
+    # run from the blend-file's text editor, without the add-on
+    sys.path.append(os.path.dirname(bpy.data.filepath))
+    import reloader
+reloader.reload_changed(['kepler', 'planetdata'])
+import kepler
+import planetdata
+
+# Minor bodies (asteroids, trans-Neptunian objects, ...) in large numbers.
+# Instead of one sphere, material, orbit etc. per body, all bodies are
+# vertices of a single mesh, which instances one small shared mesh at
+# each vertex. The vertex positions are updated for each frame from the
+# orbital elements, with the vectorized Kepler solver.
+
+# columns of a catalog: semi-major axis in AU, eccentricity,
+# inclination, longitude of ascending node, argument of perihelion and
+# mean anomaly at the start frame, all angles in degrees
+CATALOG_COLUMNS = ['a', 'e', 'i', 'node', 'peri', 'M']
+
+AU = 149597870.7 #km
+
+# state of the minor bodies in the scene, used by the frame handler;
+# kept when the module is reloaded, since the objects stay in the scene
+if '_bodies' not in globals():
+    _bodies = {}
+
+
+def read_catalog(filename, chunksize=100000):
+    """Read a catalog of orbital elements in chunks, as dictionaries of
+    numpy arrays with keys CATALOG_COLUMNS
+    filename -- csv-file (separated by ';', with header, '#' for comments)
+                or npy-file with a structured array with these columns
+    chunksize -- number of rows per chunk
+    """
+    if not os.path.isfile(filename):
+        raise RuntimeError("read_catalog: file %s not found." % filename)
+
+    if filename.endswith('.npy'):
+        data = np.load(filename, mmap_mode='r')
+        for start in range(0, len(data), chunksize):
+            chunk = data[start:start+chunksize]
+            yield dict((c, np.array(chunk[c], dtype=float))
+                       for c in CATALOG_COLUMNS)
+        return
+
+    with open(filename) as csvfile:
+        lines = (l for l in csvfile if l.strip() and not l.startswith('#'))
+        header = [c.strip() for c in next(lines).split(';')]
+        missing = [c for c in CATALOG_COLUMNS if c not in header]
+        if missing:
+            raise RuntimeError("read_catalog: columns %s missing in %s."
+                               % (', '.join(missing), filename))
+        usecols = [header.index(c) for c in CATALOG_COLUMNS]
+        while True:
+            block = list(itertools.islice(lines, chunksize))
+            if not block:
+                break
+            values = np.loadtxt(block, delimiter=';', usecols=usecols,
+                                ndmin=2)
+            yield dict((c, values[:,k]) for k, c in enumerate(CATALOG_COLUMNS))
+
+
+def load_catalog(filename, chunksize=100000):
+    """Read a complete catalog of orbital elements, see read_catalog"""
+    chunks = list(read_catalog(filename, chunksize))
+    if not chunks:
+        return dict((c, np.zeros(0)) for c in CATALOG_COLUMNS)
+
+    return dict((c, np.concatenate([ch[c] for ch in chunks]))
+                for c in CATALOG_COLUMNS)
+
+
+def art_distances(a, planets):
+    """Convert semi-major axes (in AU) to artificial distances
+    (Blender units), interpolating between the planets, such that
+    the minor bodies fit into the scene with the planets.
+    a -- semi-major axes in AU
+    planets -- planets as read from the planets csv-file (planetdata),
+               with columns 'distance' (km) and 'art_distance'
+    """
+    d = np.array(planets['distance'], dtype=float) / AU
+    art = np.array(planets['art_distance'], dtype=float)
+    order = np.argsort(d)
+    d = d[order]
+    art = art[order]
+
+    a = np.asarray(a, dtype=float)
+    result = np.interp(a, d, art)
+    # beyond the outermost planet, continue with the last slope
+    slope = (art[-1] - art[-2]) / (d[-1] - d[-2])
+    outside = a > d[-1]
+    result[outside] = art[-1] + slope*(a[outside] - d[-1])
+
+    return result
+
+
+def create_instance_mesh(meshname, radius):
+    """Create a small octahedron mesh to be instanced for every body
+    meshname -- name for the new mesh
+    radius -- radius of the octahedron
+    """
+    r = radius
+    verts = [(r,0,0), (-r,0,0), (0,r,0), (0,-r,0), (0,0,r), (0,0,-r)]
+    faces = [(0,2,4), (2,1,4), (1,3,4), (3,0,4),
+             (2,0,5), (1,2,5), (3,1,5), (0,3,5)]
+    mesh = bpy.data.meshes.new(meshname)
+    mesh.from_pydata(verts, [], faces)
+    mesh.update()
+
+    return mesh
+
+
+def add_minor_bodies(name, catalog, planets, size=0.02, startframe=1,
+                     timefactor=80, color=[0.6,0.6,0.6,1]):
+    """Add minor bodies as instances on the vertices of one mesh
+    name -- basename for the new objects, e.g. 'Asteroids'
+    catalog -- orbital elements, see read_catalog/load_catalog
+    planets -- planets as read from the planets csv-file, for the distances
+    size -- radius of each body, in Blender units
+    startframe -- frame at which the bodies have mean anomaly M
+    timefactor -- number of frames per day
+    color -- color of the bodies
+    """
+    n = len(catalog['a'])
+    deg = np.pi/180.
+
+    # orbital elements in the units of the scene
+    a_au = catalog['a']
+    elements = {
+        'a': art_distances(a_au, planets),
+        'e': catalog['e'],
+        'inclination': catalog['i']*deg,
+        'node': catalog['node']*deg,
+        'periapsis': catalog['peri']*deg,
+        'M0': catalog['M']*deg,
+        # Kepler's third law, period in days
+        'period': 365.25 * a_au**1.5,
+    }
+
+    # point cloud: one vertex per body
+    mesh = bpy.data.meshes.new('Planet-'+name)
+    mesh.vertices.add(n)
+    cloudobj = bpy.data.objects.new('Planet-'+name, mesh)
+    bpy.context.scene.objects.link(cloudobj)
+    cloudobj.dupli_type = 'VERTS'
+
+    # one instanced body, child of the point cloud
+    instmesh = create_instance_mesh('Planet-'+name+'-Body', size)
+    mat = bpy.data.materials.new('Material-'+name)
+    mat.diffuse_color = color[:3]
+    mat.specular_intensity = 0.1
+    instmesh.materials.append(mat)
+    instobj = bpy.data.objects.new('Planet-'+name+'-Body', instmesh)
+    bpy.context.scene.objects.link(instobj)
+    instobj.parent = cloudobj
+
+    _bodies[cloudobj.name] = {
+        'elements': elements,
+        'startframe': startframe,
+        'timefactor': timefactor,
+    }
+    update_positions(cloudobj, bpy.context.scene.frame_current)
+    register_handler()
+
+    print("%d minor bodies '%s' created." % (n, name))
+
+    return cloudobj
+
+
+def update_positions(cloudobj, frame):
+    """Set the vertex positions of a point cloud of minor bodies
+    for the given frame
+    cloudobj -- point cloud object, created by add_minor_bodies
+    frame -- frame number
+    """
+    state = _bodies[cloudobj.name]
+    el = state['elements']
+    t = (frame - state['startframe']) / state['timefactor']
+    pos = kepler.positions(t, el['a'], el['e'], el['period'], el['M0'],
+                           el['inclination'], el['node'], el['periapsis'])
+    cloudobj.data.vertices.foreach_set("co",
+                                       pos.astype(np.float32).ravel())
+    cloudobj.data.update()
+
+    return
+
+
+def frame_change_handler(scene):
+    """Update all minor bodies in the scene to the current frame"""
+    for name in list(_bodies.keys()):
+        obj = scene.objects.get(name)
+        if obj is None:
+            # deleted in the meantime
+            del _bodies[name]
+            continue
+        update_positions(obj, scene.frame_current)
+
+    return
+
+
+def register_handler():
+    """Add the frame change handler (once, also after module reloads)"""
+    handlers = bpy.app.handlers.frame_change_pre
+    for h in list(handlers):
+        if (h.__name__ == frame_change_handler.__name__ and
+                h.__module__ == frame_change_handler.__module__):
+            handlers.remove(h)
+    handlers.append(frame_change_handler)
+
+    return
+
+
+def run(filename, planetsfile, name='MinorBodies'):
+    """Add the minor bodies from a catalog to the current scene
+    filename -- catalog of orbital elements, see read_catalog
+    planetsfile -- planets csv-file, for the distances
+    name -- basename for the new objects
+    """
+    planets = planetdata.load_planets(planetsfile)
+    catalog = load_catalog(filename)
+    return add_minor_bodies(name, catalog, planets)
+
+
+if __name__ == '__main__':
+
+    dir = os.path.dirname(bpy.data.filepath) + os.sep
+    run(dir + 'minor_bodies.csv', dir + 'planets.csv')
@@ -0,0 +1,461 @@
+"""Mip pyramids of the texture images and a texture memory budget.
+
+For every texture, downsampled levels (each half the size of the one
+before, box-filtered) are written once as PNG files into a cache
+directory (default: .cache/mips next to the textures), together with a
+small JSON manifest; they are built again only if the texture file
+changed. Level 0 is the original file.
+
+In Blender, apply chooses a level per body from its largest size on
+screen during the animation (sampled as for the level of detail, see
+lod.py): a sphere of D pixels shows about pi*D pixels of its texture
+around the equator. If all chosen levels together need more than the
+memory budget, the levels of the most oversampled bodies are lowered
+first. Optionally, the small textures are packed into one atlas image,
+each body's texture showing its part of it via the crop settings.
+
+Build the levels of all textures without Blender:
+    python mipmaps.py textures -w 4
+"""
+import os
+import sys
+import json
+import zlib
+import heapq
+import struct
+import hashlib
+import argparse
+import concurrent.futures
+import numpy as np
+import texture_prefetch
+try:
+    import bpy
+except ImportError:
+    # building the levels only
+    bpy = None
+if bpy is not None:
+    import lod
+    import texture_cache
+
+# file types taken as textures
+EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+# smallest level: longer side in pixels
+MIN_SIZE = 16
+
+# default memory budget for all body textures, in bytes
+BUDGET = 256*2**20
+
+# bytes per pixel of an image in Blender (8 bit RGBA)
+PIXEL_BYTES = 4
+
+
+def downsample(rgba):
+    """Return an image of half the size (rounded up), each pixel the
+    mean of 2x2 pixels; sides of length 1 are kept
+    rgba -- array (height, width, channels)
+    """
+    for axis in (0, 1):
+        n = rgba.shape[axis]
+        if n == 1:
+            continue
+        if n % 2:
+            # repeat the last row (column)
+            last = np.take(rgba, [n-1], axis=axis)
+            rgba = np.concatenate([rgba, last], axis=axis)
+        even = np.take(rgba, np.arange(0, rgba.shape[axis], 2), axis=axis)
+        odd = np.take(rgba, np.arange(1, rgba.shape[axis], 2), axis=axis)
+        rgba = 0.5*(even + odd)
+
+    return rgba
+
+
+def build_pyramid(rgba, min_size=MIN_SIZE):
+    """Return the list of levels of an image, starting with the image"""
+    levels = [rgba]
+    while max(levels[-1].shape[:2]) > min_size:
+        levels.append(downsample(levels[-1]))
+
+    return levels
+
+
+def encode_png(rgba):
+    """Encode an RGBA image (height, width, 4), values between 0 and 1,
+    first row at the top, as 8-bit PNG file content"""
+    height, width = rgba.shape[:2]
+    pixels = np.clip(np.round(rgba*255), 0, 255).astype(np.uint8)
+    raw = np.zeros((height, 1 + 4*width), dtype=np.uint8)
+    raw[:,1:] = pixels.reshape(height, -1)
+
+    def chunk(ctype, data):
+        return (struct.pack('>I', len(data)) + ctype + data +
+                struct.pack('>I', zlib.crc32(ctype + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6,
+                                       0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+def default_cachedir(filename):
+    """Return the cache directory for the levels of a texture file"""
+    return os.path.join(os.path.dirname(os.path.abspath(filename)),
+                        '.cache', 'mips')
+
+
+def manifest_name(filename, cachedir=None):
+    """Return the name of the manifest of a texture file, which depends
+    on the file's path, size and modification time"""
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = hashlib.sha1(repr((path, stat.st_size, stat.st_mtime))
+                       .encode()).hexdigest()
+    if cachedir is None:
+        cachedir = default_cachedir(path)
+
+    return os.path.join(cachedir, '%s-%s.json'
+                        % (os.path.basename(path), key[:16]))
+
+
+def build_levels(filename, cachedir=None, min_size=MIN_SIZE):
+    """Write the levels of a texture file into the cache, unless they
+    are there already. Returns the list of (width, height, filename) per
+    level. Files which cannot be decoded here (e.g. JPEG without PIL)
+    are scaled by Blender, if available; otherwise only level 0 (the
+    file itself) is returned, of unknown size (0, 0).
+    filename -- name of the texture file
+    cachedir -- directory for the levels, see default_cachedir
+    min_size -- longer side of the smallest level in pixels
+    """
+    path = os.path.abspath(filename)
+    manifest = manifest_name(path, cachedir)
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            levels = json.load(f)
+        if all(os.path.isfile(name) for w, h, name in levels):
+            return [tuple(level) for level in levels]
+
+    rgba = texture_prefetch.decode_file(path)
+    if rgba is None and bpy is None:
+        print("Could not decode %s, no mip levels." % path)
+        return [(0, 0, path)]
+
+    os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    base = manifest[:-len('.json')]
+    if rgba is None:
+        levels = scale_levels(path, base, min_size)
+        with open(manifest, 'w') as f:
+            json.dump(levels, f)
+        return levels
+
+    levels = []
+    for k, image in enumerate(build_pyramid(rgba, min_size)):
+        height, width = image.shape[:2]
+        if k == 0:
+            name = path
+        else:
+            name = '%s-%d-%dx%d.png' % (base, k, width, height)
+            with open(name, 'wb') as f:
+                f.write(encode_png(image))
+        levels.append((width, height, name))
+
+    with open(manifest, 'w') as f:
+        json.dump(levels, f)
+
+    return levels
+
+
+def scale_levels(path, base, min_size=MIN_SIZE):
+    """Write the levels of a texture file which only Blender can decode,
+    scaled by Blender (same sizes as build_pyramid); returns the list of
+    (width, height, filename) per level
+    path -- absolute name of the texture file
+    base -- file name of the levels without the suffix
+    min_size -- longer side of the smallest level in pixels
+    """
+    img = texture_cache.load_image(path)
+    width, height = img.size
+    levels = [(width, height, path)]
+    k = 0
+    while max(width, height) > min_size:
+        width = (width + 1)//2 if width > 1 else 1
+        height = (height + 1)//2 if height > 1 else 1
+        k += 1
+        name = '%s-%d-%dx%d.png' % (base, k, width, height)
+        level = img.copy()
+        level.scale(width, height)
+        level.filepath_raw = name
+        level.file_format = 'PNG'
+        level.save()
+        bpy.data.images.remove(level)
+        levels.append((width, height, name))
+
+    return levels
+
+
+def build_all(filenames, cachedir=None, workers=1):
+    """Build the levels of several texture files, in parallel processes
+    if workers > 1; returns dictionary filename -> levels"""
+    filenames = [os.path.abspath(name) for name in filenames]
+    if workers > 1 and len(filenames) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers) as pool:
+            results = list(pool.map(build_levels, filenames,
+                                    [cachedir]*len(filenames)))
+    else:
+        results = [build_levels(name, cachedir) for name in filenames]
+
+    return dict(zip(filenames, results))
+
+
+def level_bytes(levels):
+    """Return the memory of each level in bytes (array); infinite for a
+    level of unknown size, which never fits into the budget"""
+    return np.array([w*h*PIXEL_BYTES if w*h else np.inf
+                     for w, h, name in levels], dtype=float)
+
+
+def choose_levels(levels, needed, budget=BUDGET):
+    """Choose a level per texture: the smallest one which is at least as
+    wide as needed, then lower the levels of the most oversampled
+    textures until all fit into the budget. Returns the level indices
+    and the total memory in bytes.
+    levels -- list of levels per texture, see build_levels
+    needed -- needed width in pixels per texture
+    budget -- memory budget in bytes
+    """
+    chosen = []
+    for texlevels, width in zip(levels, needed):
+        widths = np.array([w for w, h, name in texlevels])
+        enough = np.flatnonzero(widths >= width)
+        chosen.append(int(enough[-1]) if len(enough) else 0)
+
+    sizes = [level_bytes(texlevels) for texlevels in levels]
+    total = sum(s[k] for s, k in zip(sizes, chosen))
+
+    # priority: the width left after lowering, relative to the needed one
+    def entry(i):
+        w = levels[i][chosen[i]+1][0]
+        return (-w / max(needed[i], 1.), i)
+
+    heap = [entry(i) for i in range(len(levels))
+            if chosen[i] + 1 < len(levels[i])]
+    heapq.heapify(heap)
+    while total > budget and heap:
+        ratio, i = heapq.heappop(heap)
+        total -= sizes[i][chosen[i]] - sizes[i][chosen[i]+1]
+        chosen[i] += 1
+        if chosen[i] + 1 < len(levels[i]):
+            heapq.heappush(heap, entry(i))
+
+    return chosen, total
+
+
+def pack_atlas(images, padding=2):
+    """Pack images into one atlas, in shelves of decreasing height.
+    Returns the atlas (height, width, 4) and the crop rectangle of each
+    image (xmin, ymin, xmax, ymax) in texture coordinates (0 to 1, y
+    upwards, as Blender's crop settings)
+    images -- list of arrays (height, width, 4), first row at the top
+    padding -- pixels repeated around each image, against bleeding
+    """
+    sizes = [(img.shape[0] + 2*padding, img.shape[1] + 2*padding)
+             for img in images]
+    area = sum(h*w for h, w in sizes)
+    width = max(max(w for h, w in sizes),
+                int(2**np.ceil(np.log2(np.sqrt(area)))))
+
+    # shelves: place the highest images first
+    order = sorted(range(len(images)), key=lambda i: -sizes[i][0])
+    places = [None]*len(images)
+    x = y = shelf = 0
+    for i in order:
+        h, w = sizes[i]
+        if x + w > width:
+            x, y, shelf = 0, y + shelf, 0
+        places[i] = (y, x)
+        x += w
+        shelf = max(shelf, h)
+    height = y + shelf
+
+    atlas = np.zeros((height, width, 4), dtype=np.float32)
+    rects = []
+    for img, (y, x) in zip(images, places):
+        padded = np.pad(img, ((padding, padding), (padding, padding), (0, 0)),
+                        mode='edge')
+        atlas[y:y+padded.shape[0], x:x+padded.shape[1]] = padded
+        y0 = y + padding
+        x0 = x + padding
+        rects.append((x0/float(width), 1 - (y0 + img.shape[0])/float(height),
+                      (x0 + img.shape[1])/float(width), 1 - y0/float(height)))
+
+    return atlas, rects
+
+
+def build_atlas(filenames, cachedir):
+    """Write the atlas of some (small) texture files into the cache,
+    unless it is there already; returns the atlas file name and the
+    crop rectangle per texture file (None if it cannot be decoded), see
+    pack_atlas"""
+    key = hashlib.sha1(repr([(os.path.abspath(name),
+                              os.path.getmtime(name))
+                             for name in filenames]).encode()).hexdigest()
+    base = os.path.join(cachedir, 'atlas-%s' % key[:16])
+    if os.path.isfile(base + '.png') and os.path.isfile(base + '.json'):
+        with open(base + '.json') as f:
+            rects = json.load(f)
+        return base + '.png', [tuple(rect) if rect is not None else None
+                              for rect in rects]
+
+    # files which cannot be decoded here keep their own texture (no rect)
+    images = [texture_prefetch.decode_file(name) for name in filenames]
+    decoded = [i for i, img in enumerate(images) if img is not None]
+    if not decoded:
+        return None, [None]*len(filenames)
+    atlas, packed = pack_atlas([images[i] for i in decoded])
+    rects = [None]*len(filenames)
+    for i, rect in zip(decoded, packed):
+        rects[i] = rect
+    os.makedirs(cachedir, exist_ok=True)
+    with open(base + '.png', 'wb') as f:
+        f.write(encode_png(atlas))
+    with open(base + '.json', 'w') as f:
+        json.dump(rects, f)
+
+    return base + '.png', rects
+
+
+def textured_bodies(scene):
+    """Return the objects of the project with an image texture in their
+    first material, as list of (object, kind, texture slot) with kind
+    'sphere' or 'ringmesh' (see lod.lod_objects)"""
+    items = []
+    for obj, kind in lod.lod_objects(scene):
+        if kind == 'curve' or not obj.material_slots:
+            continue
+        mat = obj.material_slots[0].material
+        if mat is None:
+            continue
+        for slot in mat.texture_slots:
+            if (slot is not None and slot.texture is not None and
+                    slot.texture.type == 'IMAGE' and
+                    slot.texture.image is not None and
+                    slot.texture.image.get('cache_path')):
+                items.append((obj, kind, slot))
+                break
+
+    return items
+
+
+def apply(scene=None, camobj=None, budget=BUDGET, use_atlas=False,
+          atlas_max=512, nsamples=60, margin=1.5, cachedir=None):
+    """Give every body the texture level needed for its size on screen,
+    within a memory budget; returns the total texture memory in bytes
+    scene -- scene (default: current scene)
+    camobj -- camera (default: the scene's camera)
+    budget -- memory budget for all body textures in bytes
+    use_atlas -- pack the levels of small sphere textures into one atlas
+    atlas_max -- widest level in pixels which is packed into the atlas
+    nsamples -- number of frames sampled
+    margin -- factor for the sizes on screen, see lod.apply
+    cachedir -- directory for the levels, default: next to each texture
+    """
+    scene = scene or bpy.context.scene
+    camobj = camobj or scene.camera
+    if camobj is None:
+        print("No camera, textures not changed.")
+        return None
+    frames = np.unique(np.linspace(scene.frame_start, scene.frame_end,
+                                   nsamples).round().astype(int))
+    frames = [int(f) for f in frames]
+
+    items = textured_bodies(scene)
+    objs = [obj for obj, kind, slot in items]
+    cammats, centers, radii = lod.sample(scene, camobj, objs, frames)
+    sizes = margin * lod.projected_sizes(cammats[:,:3,3], centers, radii,
+                                         lod.pixels_per_unit(scene, camobj),
+                                         camobj.data.type == 'ORTHO')
+    sizes = sizes.max(axis=0) if len(frames) else np.zeros(len(objs))
+    # a sphere shows its texture around the equator on pi times its size,
+    # the radial strip of rings spans half their size
+    needed = [size*np.pi if kind == 'sphere' else 0.5*size
+              for size, (obj, kind, slot) in zip(sizes, items)]
+
+    # the original texture file, also when a level is used already
+    sources = []
+    for obj, kind, slot in items:
+        source = slot.texture.get('mip_source',
+                                  slot.texture.image['cache_path'])
+        sources.append(source)
+    pyramids = build_all(sorted(set(sources)), cachedir)
+    levels = [pyramids[os.path.abspath(source)] for source in sources]
+    chosen, total = choose_levels(levels, needed, budget)
+
+    atlased = []
+    if use_atlas:
+        atlased = [j for j, (obj, kind, slot) in enumerate(items)
+                   if kind == 'sphere' and
+                   levels[j][chosen[j]][0] <= atlas_max]
+    crops = {}
+    if len(atlased) > 1:
+        names = [levels[j][chosen[j]][2] for j in atlased]
+        atlasname, rects = build_atlas(
+            names, cachedir or default_cachedir(sources[atlased[0]]))
+        for j, rect in zip(atlased, rects):
+            if rect is not None:
+                crops[j] = rect
+
+    for j, (obj, kind, slot) in enumerate(items):
+        source = sources[j]
+        if j in crops:
+            xmin, ymin, xmax, ymax = crops[j]
+            tex = texture_cache.get_image_texture(
+                atlasname, extension='EXTEND', crop_min_x=xmin,
+                crop_min_y=ymin, crop_max_x=xmax, crop_max_y=ymax)
+        else:
+            settings = dict((attr, getattr(slot.texture, attr))
+                            for attr in ('use_flip_axis', 'extension'))
+            tex = texture_cache.get_image_texture(levels[j][chosen[j]][2],
+                                                  **settings)
+        tex['mip_source'] = source
+        slot.texture = tex
+
+    unknown = [os.path.basename(source) for source, texlevels
+               in zip(sources, levels) if not texlevels[0][0]]
+    if unknown:
+        print("Unknown size of texture(s) %s, over the budget."
+              % ', '.join(sorted(set(unknown))))
+    counts = np.bincount(chosen, minlength=1) if chosen else []
+    print("Textures of %d body(ies) from %d frames: %.1f MB of %.1f MB, "
+          "%s texture(s) per level, %d in the atlas."
+          % (len(items), len(frames), total/2.**20, budget/2.**20,
+             ', '.join(str(c) for c in counts), len(crops)))
+
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the mip levels of all textures of a directory.")
+    parser.add_argument('imgdir')
+    parser.add_argument('-c', '--cachedir', default=None,
+                        help="directory for the levels "
+                             "(default: IMGDIR/.cache/mips)")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    filenames = [os.path.join(args.imgdir, name)
+                 for name in sorted(os.listdir(args.imgdir))
+                 if name.lower().endswith(EXTENSIONS)]
+    pyramids = build_all(filenames, args.cachedir, args.workers)
+    for filename, levels in sorted(pyramids.items()):
+        print("%s: %s" % (os.path.basename(filename),
+                          ', '.join('%dx%d' % (w, h) for w, h, name in levels)))
+
+    return 0
+
+
+if __name__ == '__main__' and bpy is None:
+    sys.exit(main())
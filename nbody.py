@@ -0,0 +1,447 @@
+"""Gravitational N-body integration of the planets and their moons.
+
+Instead of moving each body on its fixed Kepler ellipse, all bodies
+attract each other, so moons orbit their planets and the planets perturb
+each other. The state is seeded from the Kepler orbits (planets.csv,
+masses.csv and moons.csv, see planetdata.py) at the first frame and
+integrated with a kick-drift-kick leapfrog scheme (symplectic, second
+order), vectorized over all bodies.
+
+Accelerations are computed by direct summation over all massive bodies
+(in chunks, to limit the memory), or with a Barnes-Hut octree for large
+numbers of particles (theta > 0). Bodies without mass (test particles)
+feel the others but do not attract. With workers > 1, the targets are
+split between worker processes.
+
+The result is written as trajectory file (see trajectory.py), in the
+units of the scene, so the existing frame change handler moves the
+objects. Units: km, kg and days. This module does not need Blender:
+
+    python nbody.py planets.csv planets.traj -e 25000
+"""
+import os
+import sys
+import argparse
+import concurrent.futures
+import numpy as np
+import kepler
+import ephemeris
+import planetdata
+import trajectory
+
+# gravitational constant in km^3/(kg day^2)
+G = 6.67430e-20 * 86400.**2
+
+# maximum number of pair interactions computed at once
+CHUNK_PAIRS = 2**22
+
+
+def euler_matrix(angles):
+    """Return rotation matrices for Euler angles (mode XYZ, as used for
+    the axis tilts in the scene), shape (..., 3, 3)
+    angles -- array of shape (..., 3), in radians
+    """
+    angles = np.asarray(angles, dtype=float)
+    cx, cy, cz = np.cos(angles).T
+    sx, sy, sz = np.sin(angles).T
+    # R = Rz Ry Rx
+    R = np.array([
+        [cy*cz, sx*sy*cz - cx*sz, cx*sy*cz + sx*sz],
+        [cy*sz, sx*sy*sz + cx*cz, cx*sy*sz - sx*cz],
+        [-sy, sx*cy, cx*cy],
+    ])
+    return np.moveaxis(R, (0, 1), (-2, -1))
+
+
+def initial_state(planets, masses, moons, t0=0.):
+    """Return the bodies and their state at time t0 from the Kepler
+    orbits, as dictionary of arrays: name, parent (index of the parent
+    planet or -1), mass, radius, period, pos and vel (bodies, 3)
+    planets -- planet parameters, see planetdata.load_planets
+    masses -- masses of the sun and planets, see planetdata.load_masses
+    moons -- moon parameters, see planetdata.load_moons; the moons orbit
+             in the equatorial plane of their planet
+    t0 -- time in days since the epoch, see ephemeris.py
+    """
+    el = ephemeris.elements(planets)
+    massof = dict(zip(masses['name'], masses['mass']))
+    missing = [n for n in planets['name'] if n not in massof]
+    if missing:
+        raise RuntimeError("initial_state: no mass for %s."
+                           % ', '.join(missing))
+
+    t = np.array([float(t0)])
+    pos = ephemeris.positions(el, t)[:,0]
+    vel = kepler.velocities(t0, el['a'], el['e'], el['period'], el['M0'],
+                            el['inclination'], el['node'], el['periapsis'])
+
+    names = list(planets['name'])
+    parents = [-1]*len(names)
+    mass = [massof[n] for n in names]
+    radius = list(planets['radius'])
+    period = list(planets['orbitperiod'])
+
+    if len(moons) > 0:
+        index = dict((n, i) for i, n in enumerate(names))
+        unknown = [p for p in moons['parent'] if p not in index]
+        if unknown:
+            raise RuntimeError("initial_state: unknown parent planet(s) "
+                               "%s." % ', '.join(unknown))
+        pi = np.array([index[p] for p in moons['parent']])
+        a = moons['distance']
+        e = moons['eccentricity']
+        P = moons['orbitperiod']
+        rel = kepler.positions(t0, a, e, P)
+        relvel = kepler.velocities(t0, a, e, P)
+        # into the equatorial plane of the parent
+        R = euler_matrix(el['tilt'][pi])
+        rel = np.einsum('mij,mj->mi', R, rel)
+        relvel = np.einsum('mij,mj->mi', R, relvel)
+        # the Kepler orbit of a planet is the one of the barycenter of
+        # the planet and its moons
+        mtot = np.array(mass, dtype=float)
+        np.add.at(mtot, pi, moons['mass'])
+        shift = np.zeros(pos.shape)
+        vshift = np.zeros(vel.shape)
+        np.add.at(shift, pi, moons['mass'][:,None]*rel)
+        np.add.at(vshift, pi, moons['mass'][:,None]*relvel)
+        pos = pos - shift/mtot[:,None]
+        vel = vel - vshift/mtot[:,None]
+        pos = np.concatenate([pos, pos[pi] + rel])
+        vel = np.concatenate([vel, vel[pi] + relvel])
+        names += list(moons['name'])
+        parents += list(pi)
+        mass += list(moons['mass'])
+        radius += list(moons['radius'])
+        period += list(moons['orbitperiod'])
+
+    mass = np.array(mass, dtype=float)
+    vel = np.array(vel, dtype=float)
+    # no drift of the whole system: the sun (first body) balances the
+    # momentum of all others
+    sun = int(np.argmax(mass))
+    vel[sun] -= (mass[:,None]*vel).sum(axis=0) / mass[sun]
+
+    return {'name': names, 'parent': np.array(parents), 'mass': mass,
+            'radius': np.array(radius, dtype=float),
+            'period': np.array(period, dtype=float),
+            'pos': np.array(pos, dtype=float), 'vel': vel}
+
+
+def direct_accelerations(targets, sources, mass, eps=0.):
+    """Return the accelerations at the target positions caused by the
+    source masses, by direct summation
+    targets -- positions (n, 3)
+    sources -- positions (m, 3)
+    mass -- masses of the sources (m)
+    eps -- softening length
+    """
+    acc = np.zeros(targets.shape)
+    chunk = max(1, CHUNK_PAIRS // max(1, len(sources)))
+    for i in range(0, len(targets), chunk):
+        d = sources[None,:,:] - targets[i:i+chunk,None,:]
+        r2 = (d**2).sum(axis=2) + eps**2
+        with np.errstate(divide='ignore'):
+            w = G*mass[None,:] * r2**-1.5
+        # the body itself
+        w[r2 == 0] = 0.
+        acc[i:i+chunk] = np.einsum('ij,ijk->ik', w, d)
+
+    return acc
+
+
+def build_tree(pos, mass, leafsize=8, maxdepth=32):
+    """Build an octree over the positions, returns a list of nodes as
+    dictionaries with size (edge length), com (center of mass), mass,
+    children (list of node indices) and, for leaves, the particle indices
+    pos -- positions (n, 3)
+    mass -- masses (n)
+    leafsize -- maximum number of particles in a leaf
+    maxdepth -- maximum depth, e.g. for particles at the same place
+    """
+    nodes = []
+    lo = pos.min(axis=0)
+    hi = pos.max(axis=0)
+    center = 0.5*(lo + hi)
+    size = max((hi - lo).max(), 1e-12) * (1 + 1e-9)
+
+    stack = [(np.arange(len(pos)), center, size, 0, None)]
+    while stack:
+        idx, center, size, depth, parent = stack.pop()
+        m = mass[idx].sum()
+        com = ((mass[idx,None]*pos[idx]).sum(axis=0) / m if m > 0
+               else pos[idx].mean(axis=0))
+        node = {'size': size, 'com': com, 'mass': m, 'children': []}
+        k = len(nodes)
+        nodes.append(node)
+        if parent is not None:
+            nodes[parent]['children'].append(k)
+        if len(idx) <= leafsize or depth >= maxdepth:
+            node['particles'] = idx
+            continue
+        octant = ((pos[idx] > center) * [1, 2, 4]).sum(axis=1)
+        for o in range(8):
+            sub = idx[octant == o]
+            if len(sub) == 0:
+                continue
+            bits = np.array([o & 1, o >> 1 & 1, o >> 2 & 1])
+            offset = 0.25*size*(2*bits - 1)
+            stack.append((sub, center + offset, 0.5*size, depth + 1, k))
+
+    return nodes
+
+
+def tree_accelerations(targets, sources, mass, theta=0.5, eps=0.,
+                       leafsize=8):
+    """Return the accelerations at the target positions caused by the
+    source masses, with the Barnes-Hut approximation: a node of the tree
+    acts as one mass in its center of mass, if it appears smaller than
+    theta (size/distance); vectorized over the targets at each node
+    targets -- positions (n, 3)
+    sources -- positions (m, 3)
+    mass -- masses of the sources (m)
+    theta -- opening angle, 0 for exact summation
+    eps -- softening length
+    leafsize -- maximum number of particles in a leaf of the tree
+    """
+    acc = np.zeros(targets.shape)
+    if len(sources) == 0:
+        return acc
+    nodes = build_tree(sources, mass, leafsize)
+
+    stack = [(0, np.arange(len(targets)))]
+    while stack:
+        k, idx = stack.pop()
+        node = nodes[k]
+        d = node['com'][None,:] - targets[idx]
+        r2 = (d**2).sum(axis=1) + eps**2
+        far = node['size']**2 < theta**2 * r2
+        if far.any():
+            w = G*node['mass'] / r2[far]**1.5
+            acc[idx[far]] += w[:,None] * d[far]
+        near = idx[~far]
+        if len(near) == 0:
+            continue
+        if 'particles' in node:
+            p = node['particles']
+            acc[near] += direct_accelerations(targets[near], sources[p],
+                                              mass[p], eps)
+        else:
+            for child in node['children']:
+                stack.append((child, near))
+
+    return acc
+
+
+def _accelerations_task(targets, sources, mass, theta, eps):
+    """Accelerations for a part of the targets (worker processes)"""
+    if theta > 0:
+        return tree_accelerations(targets, sources, mass, theta, eps)
+    return direct_accelerations(targets, sources, mass, eps)
+
+
+def accelerations(pos, mass, theta=0., eps=0., pool=None, workers=1):
+    """Return the accelerations of all bodies
+    pos -- positions (n, 3)
+    mass -- masses (n); bodies without mass do not attract others
+    theta -- opening angle for Barnes-Hut, 0 for direct summation
+    eps -- softening length
+    pool -- executor of worker processes, or None
+    workers -- number of parts to split the targets into for the pool
+    """
+    massive = mass > 0
+    sources = pos[massive]
+    smass = mass[massive]
+    if pool is None or workers < 2:
+        return _accelerations_task(pos, sources, smass, theta, eps)
+
+    parts = np.array_split(np.arange(len(pos)), workers)
+    futures = [pool.submit(_accelerations_task, pos[p], sources, smass,
+                           theta, eps) for p in parts]
+
+    return np.concatenate([f.result() for f in futures])
+
+
+def integrate_chunks(state, dt, nout, substeps=1, theta=0., eps=0.,
+                     workers=1, chunksize=1000):
+    """Integrate with the kick-drift-kick leapfrog scheme, yields the
+    positions at nout output times in chunks, as (index of the first
+    output, array (outputs, bodies, 3)); the first output is the initial
+    state, then one after every substeps steps
+    state -- initial state, see initial_state (pos and vel are updated)
+    dt -- time step in days
+    nout -- number of output times
+    substeps -- number of time steps between two outputs
+    theta, eps -- see accelerations
+    workers -- number of worker processes
+    chunksize -- number of outputs per chunk
+    """
+    pos = state['pos']
+    vel = state['vel']
+    mass = state['mass']
+
+    pool = None
+    if workers > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        acc = accelerations(pos, mass, theta, eps, pool, workers)
+        for first in range(0, nout, chunksize):
+            out = np.empty((min(chunksize, nout - first),) + pos.shape)
+            for i in range(len(out)):
+                if first + i > 0:
+                    for s in range(substeps):
+                        vel += 0.5*dt*acc
+                        pos += dt*vel
+                        acc = accelerations(pos, mass, theta, eps, pool,
+                                            workers)
+                        vel += 0.5*dt*acc
+                out[i] = pos
+            yield first, out
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return
+
+
+def integrate(state, dt, nout, substeps=1, theta=0., eps=0., workers=1):
+    """Integrate with the kick-drift-kick leapfrog scheme, returns the
+    positions at nout output times, shape (nout, bodies, 3); see
+    integrate_chunks for the parameters (which keeps less in memory)
+    """
+    out = np.empty((nout,) + state['pos'].shape)
+    for first, chunk in integrate_chunks(state, dt, nout, substeps, theta,
+                                         eps, workers):
+        out[first:first+len(chunk)] = chunk
+
+    return out
+
+
+def to_scene(state, pos, planets, sizescales, moon_exponent=1/3.):
+    """Convert positions in km into the units of the scene, where the
+    planets are at artificial distances and enlarged
+    state -- bodies, see initial_state
+    pos -- positions in km, shape (..., bodies, 3)
+    planets -- planet parameters, for distance and art_distance
+    sizescales -- scale factors of the planet radii in the scene,
+                  one per planet
+    moon_exponent -- the distance of a moon from its planet, in planet
+                     radii, is shrunk to this power
+    """
+    # planets: heliocentric positions scaled by their own
+    # art_distance/distance, like the orbits drawn by add_orbit (and the
+    # positions of ephemeris.positions with art=True)
+    sun = int(np.argmax(state['mass']))
+    helio = pos - pos[...,sun:sun+1,:]
+    nplanets = len(planets)
+    distance = planets['distance'].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        factor = np.where(distance > 0,
+                          planets['art_distance'] / distance, 0.)
+    result = np.zeros(helio.shape)
+    result[...,:nplanets,:] = helio[...,:nplanets,:]*factor[:,None]
+
+    # moons: around their planet, with the planet's size scale
+    parent = state['parent']
+    for m in np.flatnonzero(parent >= 0):
+        p = parent[m]
+        rel = pos[...,m,:] - pos[...,p,:]
+        d = np.sqrt((rel**2).sum(axis=-1))
+        R = state['radius'][p]
+        scene_d = R*sizescales[p] * (d/R)**moon_exponent
+        result[...,m,:] = result[...,p,:] + rel*(scene_d/d)[...,None]
+
+    return result
+
+
+def bake(filename, planetsfile, massesfile, moonsfile, frame_start,
+         frame_end, startframe=50, timefactor=80, sizescales=None,
+         substeps=4, theta=0., eps=0., workers=1):
+    """Integrate the planets and moons and write their trajectories into
+    a trajectory file, in the units and timing of the scene
+    filename -- name of the trajectory file
+    planetsfile, massesfile, moonsfile -- csv-files, see planetdata.py;
+                                          moonsfile may be None
+    frame_start, frame_end -- frame range
+    startframe -- frame at which the planets are at their perihelion
+    timefactor -- number of frames per day
+    sizescales -- scale factors of the planet radii, one per planet
+                  (default: 1/100000)
+    substeps -- number of time steps per frame
+    theta, eps, workers -- see integrate
+    Returns the state (see initial_state).
+    """
+    planets = planetdata.load_planets(planetsfile)
+    masses = planetdata.load_masses(massesfile)
+    if moonsfile is not None and os.path.isfile(moonsfile):
+        moons = planetdata.load_moons(moonsfile)
+    else:
+        moons = np.zeros(0, dtype=planetdata.schema_dtype(
+            planetdata.MOON_SCHEMA))
+    if sizescales is None:
+        sizescales = np.full(len(planets), 1/100000.)
+
+    t0 = float(ephemeris.frames_to_days(frame_start, startframe, timefactor))
+    state = initial_state(planets, masses, moons, t0)
+    nframes = frame_end - frame_start + 1
+    frames = np.arange(frame_start, frame_end+1)
+    # rotation: planets as in the scene (from frame 1), moons turn
+    # once per orbit (tidally locked)
+    rotperiod = np.concatenate([planets['rotperiod'],
+                                state['period'][len(planets):]])
+    data = trajectory.write(filename, state['name'], frame_start, nframes)
+    # written chunk by chunk, the positions of all frames are not kept
+    for first, pos in integrate_chunks(state, 1./timefactor/substeps,
+                                       nframes, substeps, theta, eps,
+                                       workers):
+        chunk = data[first:first+len(pos)]
+        chunk[...,:3] = to_scene(state, pos, planets, sizescales)
+        trot = ephemeris.frames_to_days(frames[first:first+len(pos)], 1,
+                                        timefactor)
+        # wrapped before the cast to float32, see trajectory.bake
+        chunk[...,3] = np.mod(2*np.pi * trot[:,None] / rotperiod[None,:],
+                              2*np.pi)
+    data.flush()
+    del data
+
+    print("N-body trajectories of %d bodies for frames %d-%d written to %s."
+          % (len(state['name']), frame_start, frame_end, filename))
+
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Integrate planets and moons, write a trajectory file.")
+    parser.add_argument('planetsfile')
+    parser.add_argument('filename')
+    parser.add_argument('-m', '--masses', default=None,
+                        help="masses csv-file (default: masses.csv next to "
+                             "the planets file)")
+    parser.add_argument('--moons', default=None,
+                        help="moons csv-file (default: moons.csv next to "
+                             "the planets file)")
+    parser.add_argument('-s', '--start', type=int, default=1,
+                        help="first frame")
+    parser.add_argument('-e', '--end', type=int, required=True,
+                        help="last frame")
+    parser.add_argument('--startframe', type=int, default=50)
+    parser.add_argument('--timefactor', type=float, default=80)
+    parser.add_argument('--substeps', type=int, default=4)
+    parser.add_argument('--theta', type=float, default=0.,
+                        help="Barnes-Hut opening angle, 0: direct sum")
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    datadir = os.path.dirname(os.path.abspath(args.planetsfile))
+    masses = args.masses or os.path.join(datadir, 'masses.csv')
+    moons = args.moons or os.path.join(datadir, 'moons.csv')
+    bake(args.filename, args.planetsfile, masses, moons, args.start,
+         args.end, args.startframe, args.timefactor, substeps=args.substeps,
+         theta=args.theta, workers=args.workers)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import hashlib
+import numpy as np
+try:
+    import bpy
+    import bake
+except ImportError:
+    # arc-length tables only, e.g. for the tests
+    bpy = None
+
+# Arc-length tables for Bezier curves, for motion along paths with an
+# exact speed.
+# A Follow Path constraint maps eval_time/path_duration to the distance
+# along the curve as evaluated by Blender, i.e. along a polyline with
+# resolution_u points per Bezier segment. The table samples the Bezier
+# curve densely (vectorized) and stores, per sample, the fraction of the
+# true arc length and the fraction along Blender's polyline. With it,
+# - eval_time can be keyed so that the object is at the right place of
+#   the true curve at given times (a few keys suffice, see key_motion),
+# - or objects can be moved without constraint by a frame change handler
+#   (see attach), which evaluates the table directly.
+# Tables are cached by the control points and resolution of the curve
+# (the most recent ones only).
+
+# maximum number of cached tables (about 200 kB each with the default
+# samples)
+TABLE_CACHE_SIZE = 32
+
+# cached tables: hash of the curve geometry -> table
+_tables = {}
+
+# objects moved by the frame handler: object name -> (path object name,
+# start frame, duration, speed profile); kept when the module is reloaded
+if '_followers' not in globals():
+    _followers = {}
+
+
+def bezier_segments(spline):
+    """Return the control points of the cubic segments of a Bezier spline,
+    as array of shape (segments, 4, 3), in local coordinates"""
+    n = len(spline.bezier_points)
+    co = np.empty(3*n)
+    left = np.empty(3*n)
+    right = np.empty(3*n)
+    spline.bezier_points.foreach_get("co", co)
+    spline.bezier_points.foreach_get("handle_left", left)
+    spline.bezier_points.foreach_get("handle_right", right)
+    co = co.reshape(n, 3)
+    left = left.reshape(n, 3)
+    right = right.reshape(n, 3)
+
+    nxt = np.arange(1, n+1) % n
+    if not spline.use_cyclic_u:
+        nxt = nxt[:-1]
+    i = np.arange(len(nxt))
+
+    return np.stack([co[i], right[i], left[nxt], co[nxt]], axis=1)
+
+
+def evaluate(segments, u):
+    """Return points on the Bezier curve for the curve parameters u
+    (segment index + parameter within the segment), shape (..., 3)"""
+    u = np.asarray(u, dtype=float)
+    k = np.minimum(u.astype(int), len(segments)-1)
+    t = (u - k)[..., None]
+    P = segments[k]
+    s = 1 - t
+
+    return (s**3*P[...,0,:] + 3*s*s*t*P[...,1,:] + 3*s*t*t*P[...,2,:]
+            + t**3*P[...,3,:])
+
+
+def build_table(segments, resolution, samples=1024):
+    """Build the arc-length table of a Bezier curve
+    segments -- control points, see bezier_segments
+    resolution -- resolution_u of the curve (Blender's polyline)
+    samples -- samples per segment, at least 4 times the resolution
+    Returns dictionary with arrays u (curve parameters), points,
+    s (fraction of the true arc length), blender (fraction along
+    Blender's polyline) and the total length.
+    """
+    nseg = len(segments)
+    samples = max(samples, 4*resolution)
+    u = np.linspace(0, nseg, nseg*samples + 1)
+    points = evaluate(segments, u)
+    ds = np.sqrt((np.diff(points, axis=0)**2).sum(axis=1))
+    s = np.concatenate(([0.], np.cumsum(ds)))
+    length = s[-1]
+
+    # Blender's polyline: resolution points per segment
+    upoly = np.linspace(0, nseg, nseg*resolution + 1)
+    poly = evaluate(segments, upoly)
+    dpoly = np.sqrt((np.diff(poly, axis=0)**2).sum(axis=1))
+    spoly = np.concatenate(([0.], np.cumsum(dpoly)))
+    blender = np.interp(u, upoly, spoly)
+
+    return {'u': u, 'points': points, 's': s/length,
+            'blender': blender/spoly[-1], 'length': length}
+
+
+def get_table(pathobj, samples=1024):
+    """Return the (cached) arc-length table of the first spline of a
+    curve object"""
+    curve = pathobj.data
+    spline = curve.splines[0]
+    segments = bezier_segments(spline)
+    resolution = spline.resolution_u or curve.resolution_u
+    key = hashlib.sha1(segments.tobytes() + repr((resolution, samples))
+                       .encode()).hexdigest()
+    table = _tables.get(key)
+    if table is None:
+        if len(_tables) >= TABLE_CACHE_SIZE:
+            del _tables[next(iter(_tables))]
+        table = build_table(segments, resolution, samples)
+        _tables[key] = table
+
+    return table
+
+
+def blender_fractions(table, s):
+    """Convert fractions of the true arc length into fractions along
+    Blender's path (eval_time/path_duration), counting full turns
+    s -- arc length fractions, e.g. 1.25 for a quarter in the second turn
+    """
+    s = np.asarray(s, dtype=float)
+    turns = np.floor(s)
+    # the end of a turn stays the end, not the start of the next
+    turns = np.where((s == turns) & (s > 0), turns - 1, turns)
+
+    return turns + np.interp(s - turns, table['s'], table['blender'])
+
+
+def arc_fractions(table, b):
+    """Convert fractions along Blender's path into fractions of the true
+    arc length, counting full turns (inverse of blender_fractions)"""
+    b = np.asarray(b, dtype=float)
+    turns = np.floor(b)
+    turns = np.where((b == turns) & (b > 0), turns - 1, turns)
+
+    return turns + np.interp(b - turns, table['blender'], table['s'])
+
+
+def set_resolution(pathobj, resolution):
+    """Set the resolution of a path; keyed eval_time (e.g. from key_motion
+    or an orbit animation) is converted to the new polyline, so objects
+    following the path keep their motion along the true curve"""
+    curve = pathobj.data
+    old = get_table(pathobj)
+    curve.resolution_u = resolution
+    for spline in curve.splines:
+        spline.resolution_u = resolution
+    new = get_table(pathobj)
+
+    action = curve.animation_data.action if curve.animation_data else None
+    fcu = action.fcurves.find('eval_time') if action is not None else None
+    if fcu is None or new is old:
+        return
+    # all keys at once
+    co = np.zeros(2*len(fcu.keyframe_points))
+    fcu.keyframe_points.foreach_get('co', co)
+    values = co[1::2]
+    duration = curve.path_duration
+    deltas = duration*blender_fractions(
+        new, arc_fractions(old, values/duration)) - values
+    for kp, delta in zip(fcu.keyframe_points, deltas):
+        kp.co[1] += delta
+        kp.handle_left[1] += delta
+        kp.handle_right[1] += delta
+    fcu.update()
+
+    return
+
+
+def points_at(table, s):
+    """Return the points (local coordinates) at the given fractions of
+    the arc length, taken modulo 1"""
+    s = np.asarray(s, dtype=float) % 1.
+    x = np.interp(s, table['s'], table['points'][:,0])
+    y = np.interp(s, table['s'], table['points'][:,1])
+    z = np.interp(s, table['s'], table['points'][:,2])
+
+    return np.stack([x, y, z], axis=-1)
+
+
+def constant_speed(x):
+    """Speed profile: arc length fraction for time fraction x"""
+    return x
+
+
+def ease_in_out(x):
+    """Speed profile: start and stop smoothly (smoothstep)"""
+    return x*x*(3 - 2*x)
+
+
+def key_motion(pathobj, startframe, duration, profile=constant_speed,
+               nkeys=16, tolerance=1e-3, turns=1):
+    """Key eval_time of a path so that an object following it moves with
+    the given speed profile along the true curve
+    pathobj -- curve object
+    startframe -- frame at the start of the path
+    duration -- number of frames per turn
+    profile -- function of the time fraction in [0, 1], returning the
+               arc length fraction; e.g. constant_speed or ease_in_out
+    nkeys -- number of keys per turn before reducing them
+    tolerance -- drop keys within this tolerance of eval_time
+    turns -- number of turns
+    Returns the F-curve.
+    """
+    pathobj.data.use_path = True
+    pathobj.data.path_duration = 100
+    x = np.linspace(0, turns, turns*nkeys + 1)
+    s = np.floor(x) + profile(x - np.floor(x))
+    s[-1] = turns
+    evaltimes = 100*blender_fractions(get_table(pathobj), s)
+    frames = startframe + duration*x
+
+    return bake.bake_fcurve(pathobj.data, 'eval_time', frames, evaltimes,
+                            interpolation='LINEAR', tolerance=tolerance)
+
+
+def attach(obj, pathobj, startframe, duration, profile=constant_speed):
+    """Move an object along a path by the frame change handler, without
+    constraint and keys; the path repeats after duration frames
+    obj -- object to be moved (its location is set)
+    pathobj -- curve object
+    startframe -- frame at the start of the path
+    duration -- number of frames per turn
+    profile -- speed profile, see key_motion
+    """
+    _followers[obj.name] = (pathobj.name, startframe, duration, profile)
+    register_handler()
+    update(bpy.context.scene)
+
+    return
+
+
+def detach(obj):
+    """Stop moving an object by the frame change handler"""
+    _followers.pop(obj.name, None)
+
+    return
+
+
+def update(scene):
+    """Set the locations of all attached objects for the current frame"""
+    frame = scene.frame_current
+    for name, (pathname, startframe, duration, profile) in \
+            list(_followers.items()):
+        obj = scene.objects.get(name)
+        pathobj = scene.objects.get(pathname)
+        if obj is None or pathobj is None:
+            del _followers[name]
+            continue
+        x = (frame - startframe) / float(duration)
+        s = np.floor(x) + profile(x - np.floor(x))
+        co = points_at(get_table(pathobj), s)
+        mw = np.array([tuple(row) for row in pathobj.matrix_world])
+        obj.location = tuple(mw[:3,:3].dot(co) + mw[:3,3])
+
+    return
+
+
+def frame_change_handler(scene):
+    """Move the attached objects along their paths"""
+    update(scene)
+
+    return
+
+
+def register_handler():
+    """Add the frame change handler (once, also after module reloads)"""
+    handlers = bpy.app.handlers.frame_change_pre
+    for h in list(handlers):
+        if (h.__name__ == frame_change_handler.__name__ and
+                h.__module__ == frame_change_handler.__module__):
+            handlers.remove(h)
+    handlers.append(frame_change_handler)
+
+    return
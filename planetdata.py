@@ -0,0 +1,198 @@
+"""Typed loading of the planet parameters (and similar csv-files).
+
+The csv-file is parsed once according to a schema into a numpy
+structured array, i.e. one typed column per parameter, so that no one
+needs to convert strings with float(...) later on. Cells which cannot be
+parsed are reported together with their row and column.
+The parsed arrays are cached in memory (checked via the file's
+modification time) and on disk (keyed by a hash of the file content),
+so repeated runs do not parse the file again.
+This module does not need Blender.
+"""
+import os
+import csv
+import hashlib
+import numpy as np
+
+
+def parse_float(cell):
+    """Parse a floating point number"""
+    return float(cell)
+
+
+def parse_color(cell):
+    """Parse a color like '[1,0.5,0,1]' into 4 values (RGBA);
+    alpha is set to 1 if only 3 values are given"""
+    cell = cell.strip()
+    if not (cell.startswith('[') and cell.endswith(']')):
+        raise ValueError("color must be enclosed in [ ]")
+    values = [float(c) for c in cell[1:-1].split(',')]
+    if len(values) == 3:
+        values.append(1.)
+    if len(values) != 4:
+        raise ValueError("color needs 3 or 4 values")
+    return values
+
+
+# schema of planets.csv: column name, numpy type, parser
+PLANET_SCHEMA = [
+    ('name', 'U32', str),
+    ('radius', 'f8', parse_float),
+    ('art_distance', 'f8', parse_float),
+    ('distance', 'f8', parse_float),
+    ('flattening', 'f8', parse_float),
+    ('tilt', 'f8', parse_float),
+    ('tilt_x', 'f8', parse_float),
+    ('tilt_y', 'f8', parse_float),
+    ('tilt_z', 'f8', parse_float),
+    ('rotperiod', 'f8', parse_float),
+    ('eccentricity', 'f8', parse_float),
+    ('orbitperiod', 'f8', parse_float),
+    ('texture', 'U64', str),
+    ('color', ('f8', 4), parse_color),
+]
+
+# schema of masses.csv, masses of the sun and the planets in kg
+MASS_SCHEMA = [
+    ('name', 'U32', str),
+    ('mass', 'f8', parse_float),
+]
+
+# schema of moons.csv; distance to the parent in km, orbital period
+# in days (negative for retrograde orbits)
+MOON_SCHEMA = [
+    ('name', 'U32', str),
+    ('parent', 'U32', str),
+    ('radius', 'f8', parse_float),
+    ('mass', 'f8', parse_float),
+    ('distance', 'f8', parse_float),
+    ('eccentricity', 'f8', parse_float),
+    ('orbitperiod', 'f8', parse_float),
+    ('color', ('f8', 4), parse_color),
+]
+
+# schema of rings.csv; radii in km
+RING_SCHEMA = [
+    ('planet', 'U32', str),
+    ('name', 'U32', str),
+    ('inner', 'f8', parse_float),
+    ('outer', 'f8', parse_float),
+    ('opacity', 'f8', parse_float),
+    ('texture', 'U64', str),
+    ('color', ('f8', 4), parse_color),
+]
+
+# parsed files: absolute filename -> (mtime, size, array)
+_cache = {}
+
+
+def schema_dtype(schema):
+    """Return the numpy dtype for a schema"""
+    return np.dtype([(name, dtype) for name, dtype, parser in schema])
+
+
+def parse_csv(filename, schema, delimiter=';'):
+    """Parse a csv-file into a structured array according to the schema.
+    Rows starting with '#' and empty rows are skipped, columns which are
+    not in the schema are ignored. Raises a RuntimeError listing all
+    cells that could not be parsed.
+    filename -- name of the csv-file, with header in the first row
+    schema -- list of (column name, numpy type, parser function)
+    delimiter -- column separator
+    """
+    with open(filename, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=delimiter)
+        header = [h.strip() for h in next(reader)]
+        missing = [name for name, dtype, parser in schema
+                   if name not in header]
+        if missing:
+            raise RuntimeError("parse_csv: columns %s missing in %s."
+                               % (', '.join(missing), filename))
+        columns = [(header.index(name), name, parser)
+                   for name, dtype, parser in schema]
+
+        rows = []
+        errors = []
+        for row in reader:
+            if not row or not ''.join(row).strip():
+                continue
+            if row[0].lstrip().startswith('#'):
+                continue
+            values = []
+            for i, name, parser in columns:
+                cell = row[i].strip() if i < len(row) else ''
+                try:
+                    values.append(parser(cell))
+                except ValueError as err:
+                    values.append(None)
+                    errors.append("line %d, column %d (%s): '%s' (%s)"
+                                  % (reader.line_num, i+1, name, cell, err))
+            rows.append(tuple(values))
+
+    if errors:
+        raise RuntimeError("parse_csv: invalid values in %s:\n  %s"
+                           % (filename, '\n  '.join(errors)))
+
+    return np.array(rows, dtype=schema_dtype(schema))
+
+
+def load(filename, schema, cachedir=None):
+    """Load a csv-file as structured array, using the caches if possible
+    filename -- name of the csv-file
+    schema -- list of (column name, numpy type, parser function)
+    cachedir -- directory for the parsed files,
+                default: '.cache' next to the csv-file
+    """
+    if not os.path.isfile(filename):
+        raise RuntimeError("load: file %s not found." % filename)
+    filename = os.path.abspath(filename)
+    dtype = schema_dtype(schema)
+
+    # unchanged since the last call?
+    stat = os.stat(filename)
+    cached = _cache.get(filename)
+    if (cached is not None and cached[0] == stat.st_mtime
+            and cached[1] == stat.st_size and cached[2].dtype == dtype):
+        return cached[2]
+
+    # parsed before (also in another session)?
+    with open(filename, 'rb') as f:
+        content = f.read()
+    key = hashlib.sha1(content + str(dtype.descr).encode()).hexdigest()
+    if cachedir is None:
+        cachedir = os.path.join(os.path.dirname(filename), '.cache')
+    cachename = os.path.join(cachedir, '%s-%s.npy'
+                             % (os.path.basename(filename), key[:16]))
+    if os.path.isfile(cachename):
+        data = np.load(cachename)
+    else:
+        data = parse_csv(filename, schema)
+        try:
+            os.makedirs(cachedir, exist_ok=True)
+            np.save(cachename, data)
+        except OSError as err:
+            print("Could not write cache file %s: %s" % (cachename, err))
+
+    _cache[filename] = (stat.st_mtime, stat.st_size, data)
+
+    return data
+
+
+def load_planets(filename, cachedir=None):
+    """Load planet parameters from a csv-file like planets.csv"""
+    return load(filename, PLANET_SCHEMA, cachedir)
+
+
+def load_masses(filename, cachedir=None):
+    """Load masses from a csv-file like masses.csv"""
+    return load(filename, MASS_SCHEMA, cachedir)
+
+
+def load_moons(filename, cachedir=None):
+    """Load moon parameters from a csv-file like moons.csv"""
+    return load(filename, MOON_SCHEMA, cachedir)
+
+
+def load_rings(filename, cachedir=None):
+    """Load the ring catalog from a csv-file like rings.csv"""
+    return load(filename, RING_SCHEMA, cachedir)
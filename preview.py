@@ -0,0 +1,456 @@
+"""Preview frames of the animation without Blender.
+
+The scene of create_planet.py (planets.csv, rings.csv, the settings) and
+the camera animation of animate_camera.py (circular path around a target
+point, constant speed) are rebuilt here as arrays, and each frame is
+ray-cast with numpy: textured, shaded and flattened spheres lit by the
+sun, the ring systems (with their profiles, see rings.py) and the orbit
+lines, using a depth buffer. Each body is only cast for the pixels of
+its bounding square on screen, so small frames take a few milliseconds.
+
+Frames are written as PNG files, or every n-th frame into one contact
+sheet:
+    python preview.py -s 1 -e 2000 --size 160 90 -o preview/
+    python preview.py -s 1 -e 2000 --every 50 --sheet sheet.png
+
+This module does not need Blender.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import ephemeris
+import kepler
+import mipmaps
+import nbody
+import planetdata
+import proctex
+import rings
+import scenesettings
+import texture_prefetch
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# the camera animation of animate_camera.run
+CAMERA = {
+    'radius': 5.,
+    'center': (0., 0., 1.),
+    'target': (0., 0., 0.),
+    'startframe': 0,
+    'duration': 300,
+    # Blender's default camera
+    'lens': 35.,
+    'sensor': 32.,
+}
+
+# number of points per orbit line
+ORBIT_POINTS = 256
+
+ORBIT_COLOR = (0.3, 0.3, 0.3)
+
+# brightness of the dark side
+AMBIENT = 0.1
+
+
+def load_texture(filename, size):
+    """Return the RGB array of a texture, downsampled to at most size
+    pixels wide; None if it cannot be decoded"""
+    rgba = texture_prefetch.decode_file(filename)
+    if rgba is None:
+        return None
+    levels = mipmaps.build_pyramid(rgba, size)
+    texture = [level for level in levels if level.shape[1] <= size][0]
+
+    return np.ascontiguousarray(texture[...,:3], dtype=np.float32)
+
+
+def ring_profile(ringrows, sizescale, imgpath):
+    """Return the ring system of a planet as dictionary with the radii
+    of the profile ends (rmin, rmax) in Blender units and the RGBA
+    profile (pixels, 4), as the material of rings.add_rings"""
+    inner, outer = rings.widen(ringrows['inner'], ringrows['outer'], 300)
+    textured = ringrows['texture'] != ''
+    if textured.any():
+        rmin, rmax = inner[textured].min(), outer[textured].max()
+        strip = texture_prefetch.decode_file(
+            imgpath + ringrows['texture'][textured][0])
+    else:
+        rmin, rmax = inner.min(), outer.max()
+        strip = None
+    if strip is not None:
+        profile = strip.mean(axis=0)
+    else:
+        # also for ring textures which cannot be decoded
+        profile = rings.radial_profile(inner, outer, ringrows['opacity'],
+                                       ringrows['color'], (rmin, rmax))
+
+    return {'rmin': rmin*sizescale, 'rmax': rmax*sizescale,
+            'profile': profile}
+
+
+def load_scene(basedir=script_dir, settings=scenesettings.DEFAULTS,
+               texsize=256):
+    """Load the bodies of the scene as arrays
+    basedir -- directory with planets.csv, rings.csv and textures/
+    settings -- see scenesettings.DEFAULTS
+    texsize -- maximum width of the textures in pixels
+    """
+    planetsfile = os.path.join(basedir, 'planets.csv')
+    imgpath = os.path.join(basedir, 'textures') + os.sep
+    planets = planetdata.load_planets(planetsfile)
+    ringfile = os.path.join(basedir, 'rings.csv')
+    ringcatalog = (planetdata.load_rings(ringfile)
+                   if os.path.isfile(ringfile) else None)
+
+    scene = {'el': ephemeris.elements(planets), 'settings': settings,
+             'radius': [], 'flattening': planets['flattening'].copy(),
+             'textures': [], 'colors': planets['color'][:,:3].copy(),
+             'rings': [], 'shadeless': planets['orbitperiod'] == 0}
+    for planet in planets:
+        name = str(planet['name'])
+        sizescale = scenesettings.planet_sizescale(name, settings)
+        scene['radius'].append(planet['radius']*sizescale)
+
+        imgname = imgpath + planet['texture']
+        if not os.path.isfile(imgname):
+            imgname = proctex.fallback_texture(planet, imgpath)
+        scene['textures'].append(load_texture(imgname, texsize))
+
+        ringrows = (ringcatalog[ringcatalog['planet'] == name]
+                    if ringcatalog is not None else [])
+        scene['rings'].append(ring_profile(ringrows, sizescale, imgpath)
+                              if len(ringrows) else None)
+    scene['radius'] = np.array(scene['radius'])
+
+    # orbit lines, as the paths of create_planet.add_orbit
+    el = scene['el']
+    E = np.linspace(0, 2*np.pi, ORBIT_POINTS)
+    x, y = kepler.orbit_plane_positions(el['art_a'][:,None],
+                                        el['e'][:,None], E[None,:])
+    x, y, z = kepler.rotate_to_ecliptic(x, y, el['inclination'][:,None],
+                                        el['node'][:,None],
+                                        el['periapsis'][:,None])
+    orbits = np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+    scene['orbits'] = orbits[np.isfinite(el['period'])]
+
+    return scene
+
+
+def camera_positions(frames, camera=CAMERA):
+    """Return the camera positions (frames, 3): the circle path of
+    animate_camera, run through counter-clockwise from -y with constant
+    speed, once per duration"""
+    frames = np.asarray(frames, dtype=float)
+    angle = 2*np.pi*(frames - camera['startframe'])/camera['duration']
+    center = np.asarray(camera['center'], dtype=float)
+    r = camera['radius']
+
+    return center + np.stack([r*np.sin(angle), -r*np.cos(angle),
+                              np.zeros_like(angle)], axis=-1)
+
+
+def body_states(scene, frames):
+    """Return positions (bodies, frames, 3) and rotation matrices
+    (bodies, frames, 3, 3) of the bodies, as the trajectory cache"""
+    settings = scene['settings']
+    el = scene['el']
+    t = ephemeris.frames_to_days(frames, settings['startframe'],
+                                 settings['timefactor'])
+    trot = ephemeris.frames_to_days(frames, 1, settings['timefactor'])
+    pos = ephemeris.positions(el, t, art=True)
+    angle = ephemeris.rotation_angles(el, trot)
+
+    # tilt of the axis object, rotation of the planet around its z-axis
+    tilt = nbody.euler_matrix(el['tilt'])
+    c = np.cos(angle)
+    s = np.sin(angle)
+    spin = np.zeros(angle.shape + (3, 3))
+    spin[...,0,0] = c
+    spin[...,0,1] = -s
+    spin[...,1,0] = s
+    spin[...,1,1] = c
+    spin[...,2,2] = 1
+
+    return pos, np.einsum('bij,bfjk->bfik', tilt, spin)
+
+
+def camera_basis(campos, target):
+    """Return the unit vectors forward, right and up of a camera at
+    campos looking at target, with up towards +z (as the Track To
+    constraint of animate_camera)"""
+    forward = np.asarray(target, dtype=float) - campos
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, (0., 0., 1.))
+    if np.linalg.norm(right) < 1e-9:
+        right = np.cross(forward, (0., 1., 0.))
+    right /= np.linalg.norm(right)
+
+    return forward, right, np.cross(right, forward)
+
+
+def render_frame(scene, campos, target, pos, rot, width=160, height=90,
+                 camera=CAMERA):
+    """Render one frame, returns RGB array (height, width, 3), first row
+    at the top
+    scene -- see load_scene
+    campos, target -- position of the camera and of its target
+    pos, rot -- positions (bodies, 3) and rotation matrices
+                (bodies, 3, 3) of the bodies at this frame
+    width, height -- size in pixels
+    camera -- lens and sensor width, see CAMERA
+    """
+    forward, right, up = camera_basis(campos, target)
+    focal = camera['lens']/camera['sensor']*max(width, height)
+    image = np.zeros((height, width, 3), dtype=np.float32)
+    depth = np.full((height, width), np.inf)
+
+    # spheres, as seen along rays campos + t*d with d.forward = 1,
+    # so t is the depth
+    for b in range(len(pos)):
+        texture = scene['textures'][b]
+        radius = scene['radius'][b]
+        ringsys = scene['rings'][b]
+        extent = max(radius, ringsys['rmax'] if ringsys else 0.)
+        box = screen_box(pos[b] - campos, extent, forward, right, up,
+                         focal, width, height)
+        if box is None:
+            continue
+        x0, x1, y0, y1 = box
+        px = (np.arange(x0, x1) + 0.5 - 0.5*width)/focal
+        py = (0.5*height - np.arange(y0, y1) - 0.5)/focal
+        d = (forward + px[None,:,None]*right + py[:,None,None]*up)
+
+        # ray in the body's frame, the flattened sphere as unit sphere
+        R = rot[b]
+        o = R.T.dot(campos - pos[b])
+        dl = d.dot(R)
+        scale = np.array([1., 1., 1 - scene['flattening'][b]])*radius
+        os_ = o/scale
+        ds = dl/scale
+        a = (ds*ds).sum(axis=-1)
+        half_b = ds.dot(os_)
+        c = os_.dot(os_) - 1
+        disc = half_b*half_b - a*c
+        hit = disc >= 0
+        t = np.where(hit, (-half_b - np.sqrt(np.maximum(disc, 0)))/a, np.inf)
+        hit &= (t > 0) & (t < depth[y0:y1,x0:x1])
+        if hit.any():
+            th = t[hit]
+            q = os_ + th[:,None]*ds[hit]
+            # Blender's sphere mapping
+            u = (1 - np.arctan2(q[:,0], q[:,1])/np.pi)/2
+            rows = np.arccos(np.clip(q[:,2], -1, 1))/np.pi
+            if texture is not None:
+                tex_h, tex_w = texture.shape[:2]
+                color = texture[np.minimum((rows*tex_h).astype(int), tex_h-1),
+                                (u*tex_w).astype(int) % tex_w]
+            else:
+                color = np.broadcast_to(scene['colors'][b], q.shape)
+            if not scene['shadeless'][b]:
+                normal = (q/scale).dot(R.T)
+                normal /= np.linalg.norm(normal, axis=-1)[:,None]
+                point = campos + th[:,None]*d[hit]
+                light = -point/np.linalg.norm(point, axis=-1)[:,None]
+                shade = AMBIENT + (1 - AMBIENT)*np.maximum(
+                    (normal*light).sum(axis=-1), 0)
+                color = color*shade[:,None]
+            image[y0:y1,x0:x1][hit] = color
+            depth[y0:y1,x0:x1][hit] = th
+
+        if ringsys is not None:
+            draw_rings(image[y0:y1,x0:x1], depth[y0:y1,x0:x1], ringsys,
+                       campos, d, o, dl, R)
+
+    draw_lines(image, depth, scene['orbits'], campos, forward, right, up,
+               focal, ORBIT_COLOR)
+
+    return image
+
+
+def screen_box(v, extent, forward, right, up, focal, width, height):
+    """Return the pixel range (x0, x1, y0, y1) covered by a sphere of
+    radius extent at v relative to the camera, None if not visible"""
+    z = v.dot(forward)
+    if z + extent <= 0:
+        return None
+    if z - extent <= 0:
+        return 0, width, 0, height
+    # the sphere's silhouette fits into this radius
+    r = focal*extent/np.sqrt(max(z*z - extent*extent, 1e-12))
+    cx = 0.5*width + focal*v.dot(right)/z
+    cy = 0.5*height - focal*v.dot(up)/z
+    x0 = int(max(np.floor(cx - r), 0))
+    x1 = int(min(np.ceil(cx + r) + 1, width))
+    y0 = int(max(np.floor(cy - r), 0))
+    y1 = int(min(np.ceil(cy + r) + 1, height))
+    if x0 >= x1 or y0 >= y1:
+        return None
+
+    return x0, x1, y0, y1
+
+
+def draw_rings(region, depth, ringsys, campos, d, o, dl, R):
+    """Blend a ring system (in the body's x-y-plane) over a region
+    region, depth -- parts of the image and the depth buffer
+    ringsys -- see ring_profile
+    campos -- camera position
+    d -- ray directions (world), o and dl -- camera position and ray
+    directions in the body's frame, R -- rotation of the body
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = -o[2]/dl[...,2]
+    q = o + t[...,None]*dl
+    r = np.sqrt(q[...,0]**2 + q[...,1]**2)
+    profile = ringsys['profile']
+    u = (r - ringsys['rmin'])/(ringsys['rmax'] - ringsys['rmin'])
+    inside = (t > 0) & (t < depth) & (u >= 0) & (u < 1)
+    if not inside.any():
+        return
+    rgba = profile[(u[inside]*len(profile)).astype(int)]
+
+    # lit from the sun on either side
+    point = campos + t[inside][:,None]*d[inside]
+    light = -point/np.linalg.norm(point, axis=-1)[:,None]
+    shade = AMBIENT + (1 - AMBIENT)*np.abs(light.dot(R[:,2]))
+    alpha = rgba[:,3:4]
+    region[inside] = ((1 - alpha)*region[inside] +
+                      alpha*rgba[:,:3]*shade[:,None])
+
+    return
+
+
+def draw_lines(image, depth, lines, campos, forward, right, up, focal,
+               color):
+    """Draw polylines where they are in front of the depth buffer; each
+    segment is sampled at about one point per pixel
+    lines -- points of the polylines (lines, points, 3)
+    """
+    height, width = depth.shape
+    # camera coordinates: x right, y up, z depth
+    v = (lines - campos).dot(np.stack([right, up, forward], axis=1))
+    a = v[:,:-1].reshape(-1, 3)
+    b = v[:,1:].reshape(-1, 3)
+    # segments in front of the camera only (no clipping)
+    front = (a[:,2] > 1e-3) & (b[:,2] > 1e-3)
+    a = a[front]
+    b = b[front]
+    pa = np.stack([0.5*width + focal*a[:,0]/a[:,2],
+                   0.5*height - focal*a[:,1]/a[:,2]], axis=-1)
+    pb = np.stack([0.5*width + focal*b[:,0]/b[:,2],
+                   0.5*height - focal*b[:,1]/b[:,2]], axis=-1)
+    lo = np.minimum(pa, pb)
+    hi = np.maximum(pa, pb)
+    onscreen = ((hi[:,0] >= 0) & (lo[:,0] < width) &
+                (hi[:,1] >= 0) & (lo[:,1] < height))
+    a, b, pa, pb = a[onscreen], b[onscreen], pa[onscreen], pb[onscreen]
+    if len(a) == 0:
+        return
+
+    n = np.ceil(np.abs(pb - pa).max(axis=1)).astype(int) + 1
+    n = np.minimum(n, 4*(width + height))
+    seg = np.repeat(np.arange(len(n)), n)
+    starts = np.cumsum(n) - n
+    f = ((np.arange(n.sum()) - starts[seg]) / n[seg])[:,None]
+    p = pa[seg] + f*(pb[seg] - pa[seg])
+    z = a[seg,2] + f[:,0]*(b[seg,2] - a[seg,2])
+    x = p[:,0].astype(int)
+    y = p[:,1].astype(int)
+    inside = (p[:,0] >= 0) & (x < width) & (p[:,1] >= 0) & (y < height)
+    x, y, z = x[inside], y[inside], z[inside]
+    visible = z < depth[y, x]
+    image[y[visible], x[visible]] = color
+
+    return
+
+
+def render(scene, frames, width=160, height=90, camera=CAMERA):
+    """Render frames, yields (frame, RGB array)"""
+    frames = np.asarray(frames)
+    campos = camera_positions(frames, camera)
+    pos, rot = body_states(scene, frames)
+    for i, frame in enumerate(frames):
+        yield int(frame), render_frame(scene, campos[i], camera['target'],
+                                       pos[:,i], rot[:,i], width, height,
+                                       camera)
+
+
+def contact_sheet(images, columns=8, gap=2):
+    """Return the images (same size) arranged in a grid"""
+    height, width = images[0].shape[:2]
+    rows = -(-len(images) // columns)
+    columns = min(columns, len(images))
+    sheet = np.zeros((rows*(height + gap) - gap, columns*(width + gap) - gap,
+                      3), dtype=np.float32)
+    for k, img in enumerate(images):
+        y = (k // columns)*(height + gap)
+        x = (k % columns)*(width + gap)
+        sheet[y:y+height, x:x+width] = img
+
+    return sheet
+
+
+def write_png(filename, rgb):
+    """Write an RGB array (height, width, 3) as PNG file"""
+    rgba = np.ones(rgb.shape[:2] + (4,), dtype=np.float32)
+    rgba[...,:3] = rgb
+    with open(filename, 'wb') as f:
+        f.write(mipmaps.encode_png(rgba))
+
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render preview frames of the animation without "
+                    "Blender.")
+    parser.add_argument('-s', '--start', type=int, default=1,
+                        help="first frame")
+    parser.add_argument('-e', '--end', type=int, default=300,
+                        help="last frame")
+    parser.add_argument('--every', type=int, default=1,
+                        help="render every n-th frame only")
+    parser.add_argument('--size', type=int, nargs=2, default=(160, 90),
+                        metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('-o', '--outdir', default=None,
+                        help="directory for the frames")
+    parser.add_argument('--sheet', default=None,
+                        help="write the frames into this contact sheet")
+    parser.add_argument('--columns', type=int, default=8,
+                        help="frames per row of the contact sheet")
+    parser.add_argument('--settings', type=json.loads, default={},
+                        help="JSON object overriding the settings")
+    parser.add_argument('--camera', type=json.loads, default={},
+                        help="JSON object overriding entries of CAMERA")
+    args = parser.parse_args(argv)
+
+    settings = dict(scenesettings.DEFAULTS, **args.settings)
+    camera = dict(CAMERA, **args.camera)
+    scene = load_scene(script_dir, settings)
+    frames = np.arange(args.start, args.end+1, args.every)
+    width, height = args.size
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+
+    images = []
+    t0 = time.time()
+    for frame, image in render(scene, frames, width, height, camera):
+        if args.outdir:
+            write_png(os.path.join(args.outdir, 'frame_%05d.png' % frame),
+                      image)
+        if args.sheet:
+            images.append(image)
+    elapsed = time.time() - t0
+    if args.sheet and images:
+        write_png(args.sheet, contact_sheet(images, args.columns))
+
+    print("%d frame(s) of %dx%d in %.2f s (%.0f frames/s)."
+          % (len(frames), width, height, elapsed,
+             len(frames)/max(elapsed, 1e-9)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
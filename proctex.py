@@ -0,0 +1,276 @@
+"""Procedural textures for bodies without a texture file.
+
+Equirectangular maps (twice as wide as high) are synthesized from a
+body's color and a seed (derived from its name) in one of three styles:
+'banded' for gas giants, 'cratered' for rocky bodies and 'granulated' for
+stars. The noise is value noise on the unit sphere, evaluated
+vectorized for all pixels at once, so the maps wrap around without seam
+and do not pinch at the poles.
+
+Maps are written as PNG files into a cache directory (default:
+.cache/procedural next to the textures), named by a hash of all
+parameters, so each map is computed only once; several maps are
+computed in parallel processes. This module does not need Blender:
+    python proctex.py planets.csv textures -w 4
+"""
+import os
+import sys
+import zlib
+import hashlib
+import argparse
+import concurrent.futures
+import numpy as np
+import mipmaps
+import planetdata
+
+# version of the generators, part of the cache key
+VERSION = 1
+
+# default width of the maps in pixels
+WIDTH = 1024
+
+# bodies with at least this radius in km are taken as gas giants
+GAS_RADIUS = 15000.
+
+
+def sphere_points(width):
+    """Return the points on the unit sphere (height, width, 3) and the
+    latitudes (height, width) of the pixel centers of an
+    equirectangular map, first row at the top (north)"""
+    height = width // 2
+    lat = 0.5*np.pi - (np.arange(height) + 0.5)/height*np.pi
+    lon = (np.arange(width) + 0.5)/width*2*np.pi - np.pi
+    lon, lat = np.meshgrid(lon, lat)
+    p = np.stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon),
+                  np.sin(lat)], axis=-1)
+
+    return p, lat
+
+
+def _hash(i, j, k, seed):
+    """Return pseudo-random values in [0, 1) for integer lattice points"""
+    h = (i.astype(np.uint64)*np.uint64(374761393) +
+         j.astype(np.uint64)*np.uint64(668265263) +
+         k.astype(np.uint64)*np.uint64(2147483647) +
+         np.uint64(seed)*np.uint64(144665)) & np.uint64(0xffffffff)
+    h = ((h ^ (h >> np.uint64(13))) * np.uint64(1274126177)
+         & np.uint64(0xffffffff))
+    h ^= h >> np.uint64(16)
+
+    return h.astype(np.float64) / 2.**32
+
+
+def value_noise(p, seed=0):
+    """Return smooth value noise in [0, 1) at the points p (..., 3)"""
+    cell = np.floor(p)
+    f = p - cell
+    u = f*f*(3 - 2*f)
+    # shift to non-negative lattice indices
+    i, j, k = [(cell[...,n] + 2**20).astype(np.int64) for n in range(3)]
+
+    result = 0.
+    for di in (0, 1):
+        wx = u[...,0] if di else 1 - u[...,0]
+        for dj in (0, 1):
+            wy = u[...,1] if dj else 1 - u[...,1]
+            for dk in (0, 1):
+                wz = u[...,2] if dk else 1 - u[...,2]
+                result = result + wx*wy*wz*_hash(i+di, j+dj, k+dk, seed)
+
+    return result
+
+
+def fbm(p, seed=0, octaves=5, lacunarity=2., gain=0.5):
+    """Return fractal noise (sum of octaves of value noise) in [0, 1)"""
+    result = 0.
+    amplitude = 1.
+    total = 0.
+    for octave in range(octaves):
+        result = result + amplitude*value_noise(p, seed + octave)
+        total += amplitude
+        amplitude *= gain
+        p = p*lacunarity
+
+    return result / total
+
+
+def banded(p, lat, color, rng, seed):
+    """Gas giant: latitude bands, distorted by turbulence"""
+    nbands = rng.uniform(8, 16)
+    turbulence = fbm(3*p, seed, octaves=6) - 0.5
+    bands = np.sin(nbands*lat + 4*turbulence + rng.uniform(0, 2*np.pi))
+    detail = fbm(20*p, seed + 100, octaves=3) - 0.5
+    light = 0.5*(color + 1)
+    mix = (0.5 + 0.5*bands)[...,None]
+
+    return (mix*light + (1 - mix)*color) * (1 + 0.3*detail)[...,None]
+
+
+def cratered(p, lat, color, rng, seed, ncraters=300):
+    """Rocky body: mottled surface with craters of many sizes"""
+    shade = 0.75 + 0.5*(fbm(4*p, seed, octaves=6) - 0.5)
+    height, width = lat.shape
+
+    # crater centers evenly on the sphere, radii from a power law
+    centers = rng.normal(size=(ncraters, 3))
+    centers /= np.sqrt((centers**2).sum(axis=1))[:,None]
+    radii = 0.01 * (1 - rng.uniform(size=ncraters))**(-0.7)
+    radii = np.minimum(radii, 0.3)
+    for c, r in zip(centers, radii):
+        # only the rows which the crater (with its rim) reaches
+        clat = np.arcsin(c[2])
+        rows = np.flatnonzero(np.abs(lat[:,0] - clat) < 1.5*r)
+        if len(rows) == 0:
+            continue
+        band = p[rows[0]:rows[-1]+1]
+        d = np.arccos(np.clip(band.dot(c), -1, 1)) / r
+        bowl = np.where(d < 1, -0.3*(1 - d*d), 0.)
+        rim = 0.2*np.exp(-((d - 1)/0.15)**2)
+        shade[rows[0]:rows[-1]+1] += bowl + rim
+
+    return color * shade[...,None]
+
+
+def granulated(p, lat, color, rng, seed):
+    """Star: fine granulation cells and a few dark spots"""
+    cells = fbm(60*p, seed, octaves=3)
+    spots = fbm(4*p, seed + 100, octaves=4)
+    threshold = rng.uniform(0.68, 0.75)
+    # spots only near the equator, as sunspots
+    spots = np.clip((spots - threshold)*8, 0, 1) * (np.abs(lat) < 0.6)
+    shade = (0.9 + 0.3*(cells - 0.5)) * (1 - 0.6*spots)
+
+    return color * shade[...,None]
+
+
+STYLES = {'banded': banded, 'cratered': cratered, 'granulated': granulated}
+
+
+def style_for(planet):
+    """Return the style for a row of planets.csv: stars (without orbit)
+    are granulated, large bodies banded, the others cratered"""
+    if planet['orbitperiod'] == 0:
+        return 'granulated'
+    if planet['radius'] >= GAS_RADIUS:
+        return 'banded'
+    return 'cratered'
+
+
+def seed_for(name):
+    """Return a seed derived from the name of a body"""
+    return zlib.crc32(str(name).encode('utf-8')) & 0x7fffffff
+
+
+def synthesize(style, color, seed, width=WIDTH):
+    """Return the map (width/2, width, 4) of a style, values 0 to 1
+    style -- 'banded', 'cratered' or 'granulated'
+    color -- base color (RGB or RGBA)
+    seed -- integer seed
+    width -- width of the map in pixels
+    """
+    if style not in STYLES:
+        raise RuntimeError("synthesize: unknown style %s." % style)
+    rng = np.random.RandomState(seed)
+    p, lat = sphere_points(width)
+    rgb = STYLES[style](p, lat, np.asarray(color, dtype=float)[:3], rng,
+                        seed)
+    rgba = np.ones(lat.shape + (4,))
+    rgba[...,:3] = np.clip(rgb, 0, 1)
+
+    return rgba
+
+
+def default_cachedir(imgpath):
+    """Return the cache directory for the maps of a texture directory"""
+    return os.path.join(imgpath, '.cache', 'procedural')
+
+
+def texture_file(style, color, seed, width=WIDTH, cachedir='.'):
+    """Return the file of a map, synthesize and write it if it is not
+    in the cache yet (see synthesize for the parameters)"""
+    params = (VERSION, style, [round(float(c), 6) for c in color[:3]],
+              int(seed), int(width))
+    key = hashlib.sha1(repr(params).encode()).hexdigest()
+    filename = os.path.join(cachedir, '%s-%s.png' % (style, key[:16]))
+    if os.path.isfile(filename):
+        return filename
+
+    rgba = synthesize(style, color, seed, width)
+    os.makedirs(cachedir, exist_ok=True)
+    # write under another name first, so parallel runs never read
+    # half-written files
+    tmpname = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmpname, 'wb') as f:
+        f.write(mipmaps.encode_png(rgba))
+    os.replace(tmpname, filename)
+
+    return filename
+
+
+def _texture_file_task(args):
+    """Worker function for the process pool"""
+    return texture_file(*args)
+
+
+def fallback_texture(planet, imgpath, width=WIDTH, cachedir=None):
+    """Return the file of the procedural map for a row of planets.csv"""
+    return texture_file(style_for(planet), planet['color'],
+                        seed_for(planet['name']), width,
+                        cachedir or default_cachedir(imgpath))
+
+
+def fallback_textures(planets, imgpath, width=WIDTH, cachedir=None,
+                      workers=1):
+    """Synthesize the maps of all planets whose texture file is missing,
+    in parallel processes if workers > 1; returns dictionary
+    name -> file of the map
+    planets -- structured array, see planetdata.load_planets
+    imgpath -- path of the texture images
+    width -- width of the maps in pixels
+    cachedir -- directory for the maps, see default_cachedir
+    workers -- number of worker processes
+    """
+    cachedir = cachedir or default_cachedir(imgpath)
+    missing = [planet for planet in planets
+               if not os.path.isfile(os.path.join(imgpath,
+                                                  planet['texture']))]
+    jobs = [(style_for(planet), tuple(planet['color']),
+             seed_for(planet['name']), width, cachedir)
+            for planet in missing]
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers) as pool:
+            files = list(pool.map(_texture_file_task, jobs))
+    else:
+        files = [texture_file(*job) for job in jobs]
+
+    if missing:
+        print("Procedural texture(s) for %s."
+              % ', '.join(str(planet['name']) for planet in missing))
+
+    return dict((str(planet['name']), filename)
+                for planet, filename in zip(missing, files))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Synthesize the missing textures of a planets file.")
+    parser.add_argument('planetsfile')
+    parser.add_argument('imgdir')
+    parser.add_argument('--width', type=int, default=WIDTH,
+                        help="width of the maps in pixels")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="number of worker processes")
+    args = parser.parse_args(argv)
+
+    planets = planetdata.load_planets(args.planetsfile)
+    files = fallback_textures(planets, args.imgdir, args.width,
+                              workers=args.workers)
+    for name, filename in sorted(files.items()):
+        print("%s: %s" % (name, filename))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
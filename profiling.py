@@ -0,0 +1,269 @@
+import bpy
+import sys
+import time
+import json
+import cProfile
+import pstats
+import functools
+import contextlib
+import tracemalloc
+
+# Opt-in instrumentation of the scene building.
+# Functions are wrapped (see instrument) so that every call is recorded
+# as a stage, with wall time, the body it belongs to (see body) and the
+# number of scene/depsgraph updates during the call. Optionally, the
+# whole build runs under cProfile and tracemalloc. At the end, a summary
+# table can be printed and the stages can be written as Chrome trace
+# (open with chrome://tracing or https://ui.perfetto.dev).
+# When profiling is not started, stage and body do nothing.
+
+# functions of create_planet.py, which are instrumented by default
+STAGES = ['add_sphere', 'add_material', 'add_texture', 'add_flattening',
+          'create_axis_parent', 'add_axial_tilt', 'add_orbit',
+          'add_orbit_animation', 'add_rotation_animation',
+          'add_minor_bodies']
+
+enabled = False
+
+# recorded stages: dictionaries with stage, body, start, duration,
+# depth (nesting level), updates and memory
+_events = []
+_state = {'body': None, 'depth': 0, 'updates': 0, 't0': 0.,
+          'profiler': None, 'tracemalloc': False}
+
+
+def _update_handlers():
+    """Return the handler list called after scene/depsgraph updates"""
+    handlers = bpy.app.handlers
+    if hasattr(handlers, 'depsgraph_update_post'):
+        # Blender 2.80 and newer
+        return handlers.depsgraph_update_post
+    return handlers.scene_update_post
+
+
+def update_handler(*args):
+    """Count the scene/depsgraph updates"""
+    _state['updates'] += 1
+
+    return
+
+
+def _remove_handler():
+    handlers = _update_handlers()
+    for h in list(handlers):
+        if (h.__name__ == update_handler.__name__ and
+                h.__module__ == update_handler.__module__):
+            handlers.remove(h)
+
+    return
+
+
+def start(use_cprofile=False, use_tracemalloc=False):
+    """Start recording, discard earlier records
+    use_cprofile -- also run cProfile, see write_cprofile
+    use_tracemalloc -- also record the memory allocated by Python
+    """
+    global enabled
+
+    del _events[:]
+    _state.pop('peak_memory', None)
+    _state.update(body=None, depth=0, updates=0, t0=time.perf_counter())
+
+    _remove_handler()
+    _update_handlers().append(update_handler)
+
+    if use_tracemalloc:
+        tracemalloc.start()
+    _state['tracemalloc'] = use_tracemalloc
+
+    _state['profiler'] = None
+    if use_cprofile:
+        _state['profiler'] = cProfile.Profile()
+        _state['profiler'].enable()
+
+    enabled = True
+
+    return
+
+
+def stop():
+    """Stop recording (the records are kept for the reports)"""
+    global enabled
+
+    if _state['profiler'] is not None:
+        _state['profiler'].disable()
+    if _state['tracemalloc']:
+        _state['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    _remove_handler()
+    enabled = False
+
+    return
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Record the enclosed code as a stage of the current body"""
+    if not enabled:
+        yield
+        return
+
+    body = _state['body']
+    depth = _state['depth']
+    _state['depth'] += 1
+    updates = _state['updates']
+    memory = tracemalloc.get_traced_memory()[0] if _state['tracemalloc'] else 0
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t1 = time.perf_counter()
+        _state['depth'] = depth
+        event = {'stage': name, 'body': body, 'start': t0 - _state['t0'],
+                 'duration': t1 - t0, 'depth': depth,
+                 'updates': _state['updates'] - updates}
+        if _state['tracemalloc']:
+            event['memory'] = tracemalloc.get_traced_memory()[0] - memory
+        _events.append(event)
+
+    return
+
+
+@contextlib.contextmanager
+def body(name):
+    """Assign the stages of the enclosed code to the given body"""
+    if not enabled:
+        yield
+        return
+
+    previous = _state['body']
+    _state['body'] = name
+    try:
+        with stage('body'):
+            yield
+    finally:
+        _state['body'] = previous
+
+    return
+
+
+def timed(func, name=None):
+    """Return func wrapped to be recorded as stage (default: its name)"""
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return func(*args, **kwargs)
+
+    wrapper.profiling_wrapped = func
+
+    return wrapper
+
+
+def instrument(module, names=STAGES):
+    """Replace the given functions of a module by recording wrappers;
+    missing functions are skipped, wrapping twice has no effect
+    module -- module, e.g. sys.modules[__name__] of create_planet.py
+    names -- names of the functions
+    """
+    for name in names:
+        func = getattr(module, name, None)
+        if func is None or hasattr(func, 'profiling_wrapped'):
+            continue
+        setattr(module, name, timed(func, name))
+
+    return
+
+
+def uninstrument(module):
+    """Restore the original functions of a module"""
+    for name, func in list(vars(module).items()):
+        if hasattr(func, 'profiling_wrapped'):
+            setattr(module, name, func.profiling_wrapped)
+
+    return
+
+
+def summary():
+    """Return totals per stage and per body, as dictionaries:
+    name -> {'calls', 'time', 'max', 'updates'}"""
+    stages = {}
+    bodies = {}
+    for e in _events:
+        if e['stage'] == 'body':
+            key, totals = e['body'], bodies
+        else:
+            key, totals = e['stage'], stages
+        s = totals.setdefault(key, {'calls': 0, 'time': 0., 'max': 0.,
+                                    'updates': 0})
+        s['calls'] += 1
+        s['time'] += e['duration']
+        s['max'] = max(s['max'], e['duration'])
+        s['updates'] += e['updates']
+
+    return stages, bodies
+
+
+def report(nbodies=10, file=None):
+    """Print a table of the stages and of the slowest bodies
+    nbodies -- number of bodies to list
+    file -- output stream (default: sys.stdout)
+    """
+    file = file or sys.stdout
+    stages, bodies = summary()
+
+    line = "%-28s %7s %10s %10s %10s %8s"
+    print(line % ('stage', 'calls', 'total [s]', 'mean [ms]', 'max [ms]',
+                  'updates'), file=file)
+    for name, s in sorted(stages.items(), key=lambda item: -item[1]['time']):
+        print(line % (name, s['calls'], '%.3f' % s['time'],
+                      '%.2f' % (1000*s['time']/s['calls']),
+                      '%.2f' % (1000*s['max']), s['updates']), file=file)
+
+    print("", file=file)
+    line = "%-28s %10s %8s"
+    print(line % ('body', 'total [s]', 'updates'), file=file)
+    slowest = sorted(bodies.items(), key=lambda item: -item[1]['time'])
+    for name, s in slowest[:nbodies]:
+        print(line % (name, '%.3f' % s['time'], s['updates']), file=file)
+
+    if 'peak_memory' in _state:
+        print("\nPeak Python memory: %.1f MB"
+              % (_state['peak_memory']/1024.**2), file=file)
+
+    return
+
+
+def write_chrome_trace(filename):
+    """Write the recorded stages as Chrome trace (JSON)"""
+    events = []
+    for e in _events:
+        name = e['body'] if e['stage'] == 'body' else e['stage']
+        args = {'body': e['body'], 'updates': e['updates']}
+        if 'memory' in e:
+            args['memory'] = e['memory']
+        events.append({'name': name, 'cat': e['stage'], 'ph': 'X',
+                       'ts': 1e6*e['start'], 'dur': 1e6*e['duration'],
+                       'pid': 1, 'tid': 1, 'args': args})
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    print("Chrome trace written to %s." % filename)
+
+    return
+
+
+def write_cprofile(filename=None, nfunctions=20):
+    """Write the cProfile statistics to a file (for e.g. snakeviz),
+    or print the most expensive functions if no filename is given"""
+    if _state['profiler'] is None:
+        return
+    if filename is not None:
+        _state['profiler'].dump_stats(filename)
+        print("Profile written to %s." % filename)
+    else:
+        stats = pstats.Stats(_state['profiler'])
+        stats.sort_stats('cumulative').print_stats(nfunctions)
+
+    return
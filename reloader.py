@@ -0,0 +1,53 @@
+import os
+import sys
+import importlib
+
+# Reloading of the project's modules when rerunning the scripts in the
+# same Blender session (or via the add-on, see __init__.py).
+# A module is only reloaded when its file changed since it was (re)loaded;
+# unchanged modules keep their state, e.g. the parsed csv-files of
+# planetdata or the image index of texture_cache, so a rerun starts warm.
+# Modules are reloaded in place, so others which imported them before
+# (import module, not from module import ...) use the new code.
+
+# module name -> modification time of its file when it was (re)loaded
+if '_mtimes' not in globals():
+    _mtimes = {}
+
+
+def _file_mtime(module):
+    """Return the modification time of a module's file, or None"""
+    filename = getattr(module, '__file__', None)
+    if not filename or not os.path.isfile(filename):
+        return None
+
+    return os.path.getmtime(filename)
+
+
+def reload_changed(names):
+    """Import modules, reload the ones which changed on disk since they
+    were (re)loaded; returns the list of reloaded module names
+    names -- module names, modules used by others first
+    """
+    reloaded = []
+    for name in names:
+        module = sys.modules.get(name)
+        if module is None:
+            module = importlib.import_module(name)
+            _mtimes[name] = _file_mtime(module)
+            continue
+
+        mtime = _file_mtime(module)
+        if name not in _mtimes:
+            # imported elsewhere before, take it as current
+            _mtimes[name] = mtime
+        elif mtime != _mtimes[name]:
+            importlib.reload(module)
+            _mtimes[name] = mtime
+            reloaded.append(name)
+
+    if reloaded:
+        print("Reloaded changed module(s) %s." % ', '.join(reloaded))
+
+    return reloaded
+
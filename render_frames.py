@@ -0,0 +1,227 @@
+"""Render an animation with several local Blender processes in parallel.
+
+The frame range is split into chunks of about equal estimated cost,
+which are rendered by worker processes ('blender -b'), most expensive
+chunks first. Failed chunks are retried. Each chunk renders into its own
+temporary directory, and its frames are moved into the output directory
+only when the chunk succeeded, so the output is one complete sequence.
+The measured render time per frame is stored next to the blend-file and
+used as cost estimate for the next run.
+
+Usage (no Blender needed to start it):
+    python render_frames.py planets.blend -s 1 -e 2000 -w 8 -o render/
+
+This does not use bpy, it only starts Blender as external program.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import concurrent.futures
+
+
+def scene_frame_range(blender, blendfile):
+    """Return start and end frame of the blend-file's scene"""
+    expr = ("import bpy; s = bpy.context.scene; "
+            "print('FRAMERANGE', s.frame_start, s.frame_end)")
+    out = subprocess.run([blender, '-b', blendfile, '--python-expr', expr],
+                         stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True).stdout
+    for line in out.splitlines():
+        if line.startswith('FRAMERANGE'):
+            start, end = line.split()[1:3]
+            return int(start), int(end)
+
+    raise RuntimeError("scene_frame_range: could not read frame range "
+                       "of %s." % blendfile)
+
+
+def read_costs(filename):
+    """Read estimated render time per frame (frame -> seconds)"""
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return dict((int(k), v) for k, v in json.load(f).items())
+
+
+def write_costs(filename, costs):
+    """Write render time per frame (frame -> seconds)"""
+    with open(filename, 'w') as f:
+        json.dump(dict((str(k), v) for k, v in sorted(costs.items())), f)
+
+    return
+
+
+def split_frames(frames, costs, nchunks):
+    """Split frames into contiguous chunks of about equal total cost
+    frames -- list of frame numbers, sorted
+    costs -- estimated cost per frame (frame -> cost); frames without
+             estimate get the mean cost of the others (or 1)
+    nchunks -- number of chunks
+    Returns list of (first frame, last frame, estimated cost).
+    """
+    known = [costs[f] for f in frames if f in costs]
+    default = sum(known)/len(known) if known else 1.
+    c = [costs.get(f, default) for f in frames]
+    total = sum(c)
+    nchunks = max(1, min(nchunks, len(frames)))
+
+    chunks = []
+    start = 0
+    acc = 0.
+    for i, cost in enumerate(c):
+        acc += cost
+        remaining_chunks = nchunks - len(chunks) - 1
+        remaining_frames = len(frames) - i - 1
+        target = total * (len(chunks)+1) / nchunks
+        if remaining_chunks > 0 and (acc >= target or
+                                     remaining_frames == remaining_chunks):
+            chunks.append((frames[start], frames[i], sum(c[start:i+1])))
+            start = i + 1
+    if start < len(frames):
+        chunks.append((frames[start], frames[-1], sum(c[start:])))
+
+    return chunks
+
+
+def render_chunk(blender, blendfile, chunkdir, first, last, threads=0):
+    """Render frames first..last with one Blender process into chunkdir,
+    returns elapsed time in seconds. Raises RuntimeError on failure."""
+    if os.path.isdir(chunkdir):
+        shutil.rmtree(chunkdir)
+    os.makedirs(chunkdir)
+
+    cmd = [blender, '-b', blendfile,
+           '-o', os.path.join(chunkdir, 'frame_#####'),
+           '-t', str(threads),
+           '-s', str(first), '-e', str(last), '-a']
+    t0 = time.time()
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    elapsed = time.time() - t0
+    if proc.returncode != 0:
+        raise RuntimeError("frames %d-%d: blender exited with code %d:\n%s"
+                           % (first, last, proc.returncode,
+                              proc.stdout[-2000:]))
+
+    rendered = [n for n in os.listdir(chunkdir) if n.startswith('frame_')]
+    if len(rendered) < last - first + 1:
+        raise RuntimeError("frames %d-%d: only %d frame(s) written."
+                           % (first, last, len(rendered)))
+
+    return elapsed
+
+
+def render(blendfile, outdir, start, end, workers, blender='blender',
+           chunks_per_worker=4, retries=2, threads=0):
+    """Render frames start..end of a blend-file with parallel workers
+    blendfile -- the blend-file, e.g. as saved after create_planet.py
+    outdir -- directory for the rendered frames
+    start, end -- frame range
+    workers -- number of Blender processes running at the same time
+    blender -- Blender executable
+    chunks_per_worker -- number of chunks per worker, more chunks balance
+                         the load better, fewer chunks load the blend-file
+                         less often
+    retries -- number of retries for a failed chunk
+    threads -- render threads per Blender process, 0 for automatic
+    Returns list of chunks which failed finally.
+    """
+    costfile = blendfile + '.frametimes.json'
+    costs = read_costs(costfile)
+    frames = list(range(start, end+1))
+    chunks = split_frames(frames, costs, workers*chunks_per_worker)
+    # most expensive chunks first, so the workers finish at about
+    # the same time
+    chunks.sort(key=lambda chunk: -chunk[2])
+
+    os.makedirs(outdir, exist_ok=True)
+    tmpdir = os.path.join(outdir, '.chunks')
+    print("Rendering frames %d-%d in %d chunks with %d workers."
+          % (start, end, len(chunks), workers))
+
+    def job(chunk):
+        first, last, cost = chunk
+        chunkdir = os.path.join(tmpdir, '%d-%d' % (first, last))
+        for attempt in range(retries+1):
+            try:
+                elapsed = render_chunk(blender, blendfile, chunkdir,
+                                       first, last, threads)
+                break
+            except RuntimeError as err:
+                print("Chunk failed (attempt %d): %s" % (attempt+1, err))
+        else:
+            return chunk, None
+
+        # move frames into the common sequence
+        for name in os.listdir(chunkdir):
+            os.replace(os.path.join(chunkdir, name),
+                       os.path.join(outdir, name))
+        shutil.rmtree(chunkdir)
+        print("Frames %d-%d done in %.1f s." % (first, last, elapsed))
+
+        return chunk, elapsed
+
+    failed = []
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk, elapsed in pool.map(job, chunks):
+            first, last, cost = chunk
+            if elapsed is None:
+                failed.append(chunk)
+                continue
+            for f in range(first, last+1):
+                costs[f] = elapsed / (last - first + 1)
+
+    write_costs(costfile, costs)
+    if os.path.isdir(tmpdir) and not os.listdir(tmpdir):
+        os.rmdir(tmpdir)
+
+    print("Rendered %d frame(s) in %.1f s, %d chunk(s) failed."
+          % (end - start + 1 - sum(c[1]-c[0]+1 for c in failed),
+             time.time() - t0, len(failed)))
+
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Render an animation with parallel Blender processes.")
+    parser.add_argument('blendfile')
+    parser.add_argument('-o', '--outdir', default='render',
+                        help="output directory (default: render)")
+    parser.add_argument('-s', '--start', type=int,
+                        help="first frame (default: from the scene)")
+    parser.add_argument('-e', '--end', type=int,
+                        help="last frame (default: from the scene)")
+    parser.add_argument('-w', '--workers', type=int,
+                        default=os.cpu_count() or 1,
+                        help="number of Blender processes")
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help="render threads per process (0: automatic)")
+    parser.add_argument('-b', '--blender', default='blender',
+                        help="Blender executable")
+    parser.add_argument('-r', '--retries', type=int, default=2,
+                        help="retries for failed chunks")
+    parser.add_argument('-c', '--chunks-per-worker', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    start, end = args.start, args.end
+    if start is None or end is None:
+        scene_start, scene_end = scene_frame_range(args.blender,
+                                                   args.blendfile)
+        start = scene_start if start is None else start
+        end = scene_end if end is None else end
+
+    failed = render(os.path.abspath(args.blendfile), args.outdir, start, end,
+                    args.workers, args.blender, args.chunks_per_worker,
+                    args.retries, args.threads)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,61 +1,215 @@
-import bpy
-import math
+import numpy as np
+try:
+    import bpy
+    import mathutils
+    import texture_cache
+except ImportError:
+    # ring geometry and profiles only, e.g. for preview.py
+    bpy = None
+
+# Ring systems from a catalog (rings.csv, see planetdata.load_rings).
+# All rings of a planet become one flat mesh with one material: the
+# annuli (overlapping rings merged) are built vectorized and filled in
+# bulk, with u running outward across the ring system and v around it.
+# The material either maps the planet's ring texture (a radial strip,
+# like Saturn_rings_thin.png) onto this range, or a radial profile image
+# computed from the colors and opacities of the rings.
+
+# width of the radial profile images in pixels
+PROFILE_SIZE = 2048
+
+
+def set_parent_unscaled(obj, parentobj):
+    """Set parent of an object without inheriting the parent's scale
+    (planet spheres get their radius and flattening via their scale)
+    obj -- object which shall become the child
+    parentobj -- new parent object
+    """
+    sx, sy, sz = parentobj.scale
+    obj.parent = parentobj
+    obj.matrix_parent_inverse = mathutils.Matrix((
+        (1/sx, 0, 0, 0),
+        (0, 1/sy, 0, 0),
+        (0, 0, 1/sz, 0),
+        (0, 0, 0, 1)))
+
+    return
+
+
+def widen(inner, outer, min_width):
+    """Widen rings narrower than min_width around their middle,
+    returns the new inner and outer radii"""
+    middle = 0.5*(inner + outer)
+    half = 0.5*np.maximum(outer - inner, min_width)
+
+    return middle - half, middle + half
+
 
-def add_saturn_rings(parentobj, name, sizescale, imgname):
-    """Add ring system for Saturn, in the planet's x-y-plane
+def merge(inner, outer):
+    """Return the union of the intervals [inner, outer] as sorted,
+    disjoint intervals (arrays of inner and outer radii)"""
+    order = np.argsort(inner)
+    inner = inner[order]
+    outer = outer[order]
+    reach = np.maximum.accumulate(outer)
+    starts = np.flatnonzero(np.concatenate(([True], inner[1:] > reach[:-1])))
+
+    return inner[starts], np.maximum.reduceat(outer, starts)
+
+
+def ring_geometry(inner, outer, uvrange, segments=100):
+    """Return vertex coordinates (verts, 3), quads (faces, 4) and uv
+    coordinates per loop (faces*4, 2) of flat annuli in the x-y-plane
+    inner, outer -- radii of the annuli (arrays)
+    uvrange -- radii at u = 0 and u = 1
+    segments -- number of segments around each annulus
+    """
+    n = len(inner)
+    # the first and last vertex around coincide, for the uv seam
+    phi = np.linspace(0, 2*np.pi, segments+1)
+    radii = np.stack([inner, outer], axis=1)
+
+    co = np.zeros((n, 2, segments+1, 3))
+    co[...,0] = radii[:,:,None]*np.cos(phi)
+    co[...,1] = radii[:,:,None]*np.sin(phi)
+
+    # counter-clockwise when seen from +z
+    idx = np.arange(n*2*(segments+1)).reshape(n, 2, segments+1)
+    j = np.arange(segments)
+    faces = np.stack([idx[:,0,j], idx[:,1,j], idx[:,1,j+1], idx[:,0,j+1]],
+                     axis=-1).reshape(-1, 4)
+
+    rmin, rmax = uvrange
+    uv = np.empty((n, 2, segments+1, 2))
+    uv[...,0] = ((radii - rmin)/(rmax - rmin))[:,:,None]
+    uv[...,1] = phi/(2*np.pi)
+    uvs = uv.reshape(-1, 2)[faces.ravel()]
+
+    return co.reshape(-1, 3), faces, uvs
+
+
+def fill_ring_mesh(ringobj, inner, outer, uvrange, segments=100):
+    """Give a ring object a new flat mesh of annuli, with uv coordinates;
+    the materials of the old mesh are kept
+    ringobj -- ring object
+    inner, outer -- radii of the annuli (arrays, disjoint)
+    uvrange -- radii at u = 0 and u = 1
+    segments -- number of segments around the rings
+    """
+    inner = np.asarray(inner, dtype=float)
+    outer = np.asarray(outer, dtype=float)
+    co, faces, uvs = ring_geometry(inner, outer, uvrange, segments)
+
+    # fill the mesh in bulk
+    mesh = bpy.data.meshes.new(ringobj.name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set("vertex_index", faces.ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, faces.size, 4))
+    mesh.polygons.foreach_set("loop_total", np.full(len(faces), 4))
+    mesh.update(calc_edges=True)
+
+    # uv_layers.new in Blender 2.80 and newer
+    if hasattr(mesh, 'uv_textures'):
+        mesh.uv_textures.new('UVMap')
+    else:
+        mesh.uv_layers.new(name='UVMap')
+    mesh.uv_layers['UVMap'].data.foreach_set("uv", uvs.ravel())
+
+    oldmesh = ringobj.data
+    if oldmesh is not None:
+        for mat in oldmesh.materials:
+            mesh.materials.append(mat)
+    ringobj.data = mesh
+    if oldmesh is not None and oldmesh.users == 0:
+        bpy.data.meshes.remove(oldmesh)
+    mesh.name = ringobj.name
+
+    # remember the geometry, to rebuild it with another resolution
+    ringobj['ring_radii'] = np.stack([inner, outer], axis=1).ravel().tolist()
+    ringobj['ring_uv_range'] = list(uvrange)
+    ringobj['ring_segments'] = segments
+
+    return mesh
+
+
+def radial_profile(inner, outer, opacity, color, uvrange, size=PROFILE_SIZE):
+    """Return the RGBA pixels (size, 4) of a radial profile of rings;
+    each pixel covers its part of uvrange, rings narrower than a pixel
+    contribute with the covered fraction, overlapping rings are
+    composited
+    inner, outer, opacity -- radii and opacity of the rings (arrays)
+    color -- colors of the rings (rings, 4)
+    uvrange -- radii at the first and the last pixel
+    size -- number of pixels
+    """
+    rmin, rmax = uvrange
+    edges = rmin + (rmax - rmin)*np.arange(size+1)/float(size)
+    cover = (np.minimum(edges[1:,None], outer[None,:])
+             - np.maximum(edges[:-1,None], inner[None,:]))
+    cover = np.clip(cover/(edges[1] - edges[0]), 0, 1)*opacity[None,:]
+
+    pixels = np.zeros((size, 4))
+    weight = cover.sum(axis=1)
+    has = weight > 0
+    pixels[has,:3] = cover[has].dot(color[:,:3]) / weight[has,None]
+    pixels[:,3] = 1 - np.prod(1 - cover, axis=1)
+
+    return pixels
+
+
+def get_profile_texture(name, pixels):
+    """Return an image texture showing the given pixels (one row);
+    image and texture of the same name are reused"""
+    img = bpy.data.images.get(name)
+    if img is None or tuple(img.size) != (len(pixels), 1):
+        img = bpy.data.images.new(name, len(pixels), 1, alpha=True)
+    img.pixels[:] = pixels.astype(np.float32).ravel().tolist()
+    tex = bpy.data.textures.get(name)
+    if tex is None or tex.type != 'IMAGE':
+        tex = bpy.data.textures.new(name, type='IMAGE')
+    tex.image = img
+    tex.extension = 'CLIP'
+
+    return tex
+
+
+def add_rings(parentobj, name, sizescale, rings, imgpath='', segments=100,
+              min_width=300):
+    """Add the ring system of a planet as one mesh, in the planet's
+    x-y-plane; returns the ring object, or None without rings
     parentobj -- planet-object, to which the ring system is to be added as child
     name -- base name of the planet
     sizescale -- sizescale of the planet, to be used for rings as well
-    img -- texture image for the rings
+    rings -- rows of the ring catalog for this planet, see
+             planetdata.load_rings; if rings have a texture, the first one
+             is used for the planet, spanning the rings which have it
+    imgpath -- path of the texture images
+    segments -- number of segments around the rings
+    min_width -- minimum width of a ring in km; narrower rings would be
+                 invisible, so they are widened artificially
     """
-    
-    # add thin disk with hole inside; construct vertices and faces "by hand"
-    rin = 68937 #km
-    rout = 142731 #km
-        
-    rin *= sizescale
-    rout *= sizescale
-    
-    bpy.ops.object.add(type='MESH', location = (0,0,0))
-    ringobj = bpy.context.object
-    ringobj.name = 'Planet-'+name+'-Rings'        
-    mesh = ringobj.data
-        
-    verts = []
-    verts2 = []
-    num = 100
-    for j in range(num):
-        phi = j*1./num*(2*math.pi)
-        x = rin*math.cos(phi)
-        y = rin*math.sin(phi)
-        z = 0             
-        verts.append((x,y,z))
-            
-        phi = j*1./num*(2*math.pi)
-        x = rout*math.cos(phi)
-        y = rout*math.sin(phi)
-        z = 0             
-        verts2.append((x,y,z))
-
-    verts = verts + verts2
-    faces = []
-    for j in range(num):
-        j1 = j-1
-        if j == 0: 
-            j1 = num-1
-        faces.append((j1,j,num+j, num+j1))
-            
-        
-    mesh.from_pydata(verts, [], faces)
-    mesh.update()
-        
-    # uv unwrap
-    bpy.ops.object.mode_set(mode='EDIT')
-    bpy.ops.uv.follow_active_quads()
-    bpy.ops.object.mode_set(mode='OBJECT')
+    if len(rings) == 0:
+        return None
+
+    inner, outer = widen(rings['inner'], rings['outer'], min_width)
+    textured = rings['texture'] != ''
+    if textured.any():
+        uvrange = (inner[textured].min(), outer[textured].max())
+    else:
+        uvrange = (inner.min(), outer.max())
+    uvrange = (uvrange[0]*sizescale, uvrange[1]*sizescale)
+    inner = inner*sizescale
+    outer = outer*sizescale
+
+    ringname = 'Planet-'+name+'-Rings'
+    ringobj = bpy.data.objects.new(ringname, bpy.data.meshes.new(ringname))
+    bpy.context.scene.objects.link(ringobj)
 
     # create and add material
-    matname = 'Material-'+name
+    matname = 'Material-Rings-'+name
     mat = bpy.data.materials.new(matname)
     mat.specular_intensity = 0.1
     mat.use_transparency = True
@@ -63,12 +217,17 @@ def add_saturn_rings(parentobj, name, sizescale, imgname):
     mat.specular_alpha = 0
     ringobj.data.materials.append(mat)
 
-    # create texture, add image
-    img = bpy.data.images.load(imgname)
-    tex = bpy.data.textures.new(imgname, type='IMAGE')
-    tex.image = img
-    tex.use_flip_axis = True
-    
+    if textured.any():
+        # get texture with image, reusing already loaded images
+        imgname = imgpath + rings['texture'][textured][0]
+        tex = texture_cache.get_image_texture(imgname)
+    else:
+        pixels = radial_profile(inner, outer, rings['opacity'],
+                                rings['color'], uvrange)
+        tex = get_profile_texture(ringname+'-Profile', pixels)
+        mat.diffuse_intensity = 1.0
+        mat.emit = 0.1
+
     # add texture to material, set mapping
     mtex = mat.texture_slots.add()
     mtex.texture = tex
@@ -77,56 +236,11 @@ def add_saturn_rings(parentobj, name, sizescale, imgname):
     mtex.uv_layer = 'UVMap'
     mtex.mapping = 'FLAT'
     mtex.use_map_alpha = True
-    
-    # set the ring system's parent
-    ringobj.parent = parentobj
-        
-    return ringobj
-
-
-def add_uranus_rings(parentobj, name, sizescale):
-    """ Add ring system for Uranus, in the planet's x-y-plane
-    parentobj -- planet-object, to which the ring system is to be added as child
-    name -- base name of the planet
-    sizescale -- sizescale of the planet, to be used for rings as well
-    """
-
-    r = 51150 #km
-    width = 60 #km
-    # This is too small to be visible, so increase the ring size artificially.
-    width *= 5
-
-    r *= sizescale
-    width *= sizescale
-    
-    ringname = 'Planet-'+name+'-Rings'
-
-    # add circle for ring
-    bpy.ops.curve.primitive_bezier_circle_add(radius=r, location=(0,0,0))
-    ringobj = bpy.context.object
-    ringobj.name = ringname
-
 
-    # add bevel object for ring width
-    bevelname = 'Planet-'+name+'-Rings-bevelobject'
-    bpy.ops.curve.primitive_bezier_circle_add(radius=0.5*width, location=(0,0,0))
-    bevelobj = bpy.context.object
-    bevelobj.name = bevelname
-
-    # set ring's thickness via bevel object
-    ringobj.data.bevel_object = bevelobj
-        
-    # add material
-    matname = 'Material-Rings-'+name
-    mat = bpy.data.materials.new(matname)
-    mat.specular_intensity = 0.1
-    mat.diffuse_color = [0.8,0.8,1.0]
-    mat.diffuse_intensity = 1.0
-    mat.emit = 0.1
-    ringobj.data.materials.append(mat)
+    fill_ring_mesh(ringobj, *merge(inner, outer), uvrange=uvrange,
+                   segments=segments)
 
-    # set parent        
-    ringobj.parent = parentobj
+    # set the ring system's parent
+    set_parent_unscaled(ringobj, parentobj)
 
     return ringobj
-
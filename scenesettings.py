@@ -0,0 +1,38 @@
+"""Settings of the scene built by create_planet.py.
+
+Shared with the modules which rebuild the scene without Blender, e.g.
+preview.py, so both use the same sizes and timing.
+"""
+
+# default settings (create_planet.default_settings adds imgpath)
+DEFAULTS = {
+    # size scale factor
+    'sizescale_basic': 1/100000.,
+
+    # additional factors for sizes (enlarge planets for better visibility)
+    'sizefactor_rockplanet': 2, #6
+    'sizefactor_gasplanet': 2, #2
+
+    # time factor to convert from days to number of frames
+    'timefactor': 80,
+
+    # first frame of the orbit animations
+    'startframe': 50,
+}
+
+# planets enlarged by sizefactor_rockplanet, the others (except the sun)
+# by sizefactor_gasplanet
+ROCK_PLANETS = ['Mercurio', 'Venus', 'Terra', 'Marte']
+
+
+def planet_sizescale(name, settings):
+    """Return the scale factor for the size of a planet (or the sun)
+    name -- name of the planet
+    settings -- dictionary with the scale factors, see DEFAULTS
+    """
+    sizescale_basic = settings['sizescale_basic']
+    if name in ROCK_PLANETS:
+        return sizescale_basic * settings['sizefactor_rockplanet']
+    elif name != 'Sol':
+        return sizescale_basic * settings['sizefactor_gasplanet']
+    return sizescale_basic
@@ -0,0 +1,210 @@
+"""Build variants of the scene for a grid of settings, in parallel.
+
+Each combination of the given values of the settings of create_planet.py
+(sizescale_basic, sizefactor_rockplanet, sizefactor_gasplanet,
+timefactor, startframe) is built by its own headless Blender process
+from the template blend-file and saved as one blend-file per variant.
+The inputs shared by all variants are prepared once before: the parsed
+planets.csv, the procedural textures and the decoded texture images
+(see texture_prefetch.decoded_cachedir), so the variants only read them.
+A summary with the build time of each variant is printed and written
+as summary.json into the output directory.
+
+Usage (no Blender needed to start it):
+    python sweep.py planets-template.blend -o variants/ -w 4 \\
+        -p timefactor=40,80 -p sizefactor_gasplanet=1,2,4
+
+This does not use bpy, it only starts Blender as external program.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import concurrent.futures
+import planetdata
+import proctex
+import texture_prefetch
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_values(text):
+    """Parse 'name=value,value,...' into (name, list of values); values
+    are taken as JSON (numbers), otherwise as strings"""
+    name, sep, values = text.partition('=')
+    if not sep or not values:
+        raise argparse.ArgumentTypeError("expected name=value,value,...")
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(json.loads(value))
+        except ValueError:
+            parsed.append(value)
+
+    return name.strip(), parsed
+
+
+def grid(params):
+    """Return all combinations of the values of the parameters
+    params -- list of (name, list of values)
+    Returns list of dictionaries name -> value.
+    """
+    names = [name for name, values in params]
+    return [dict(zip(names, combination)) for combination in
+            itertools.product(*[values for name, values in params])]
+
+
+def variant_name(overrides):
+    """Return a file name for a variant, e.g. 'timefactor-40_startframe-1'"""
+    if not overrides:
+        return 'default'
+    parts = ['%s-%s' % (name, value) for name, value in overrides.items()]
+    return '_'.join(parts).replace(os.sep, '-').replace(' ', '')
+
+
+def prepare(basedir, cachedir, workers=1):
+    """Fill the caches shared by all variants, returns number of decoded
+    textures
+    basedir -- directory with planets.csv and textures/
+    cachedir -- directory for the decoded textures
+    workers -- number of processes for the procedural textures
+    """
+    imgpath = os.path.join(basedir, 'textures') + os.sep
+    planets = planetdata.load_planets(os.path.join(basedir, 'planets.csv'))
+    fallbacks = proctex.fallback_textures(planets, imgpath, workers=workers)
+
+    filenames = set(fallbacks.values())
+    filenames.update(imgpath + t for t in planets['texture'])
+    ringfile = os.path.join(basedir, 'rings.csv')
+    if os.path.isfile(ringfile):
+        filenames.update(imgpath + t for t in
+                         planetdata.load_rings(ringfile)['texture'] if t)
+    n = 0
+    for filename in sorted(filenames):
+        if os.path.isfile(filename):
+            if texture_prefetch.decode_cached(filename, cachedir) is not None:
+                n += 1
+
+    return n
+
+
+def build_variant(blender, template, overrides, blendfile, cachedir):
+    """Build one variant with one Blender process and save it,
+    returns elapsed time in seconds. Raises RuntimeError on failure;
+    the output of Blender is kept in blendfile + '.log'."""
+    cmd = [blender, '-b', template,
+           '--python', os.path.join(script_dir, 'create_planet.py'), '--',
+           '--settings', json.dumps(overrides),
+           '--save', blendfile,
+           '--decoded-cache', cachedir]
+    t0 = time.time()
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+    elapsed = time.time() - t0
+    with open(blendfile + '.log', 'w') as f:
+        f.write(proc.stdout)
+    if proc.returncode != 0 or not os.path.isfile(blendfile):
+        raise RuntimeError("%s: blender exited with code %d:\n%s"
+                           % (os.path.basename(blendfile), proc.returncode,
+                              proc.stdout[-2000:]))
+
+    return elapsed
+
+
+def sweep(template, outdir, params, workers, blender='blender', retries=1):
+    """Build all variants of a parameter grid with parallel workers
+    template -- blend-file next to create_planet.py, planets.csv and
+                textures/, e.g. planets-template.blend
+    outdir -- directory for the blend-files of the variants
+    params -- list of (setting name, list of values)
+    workers -- number of Blender processes running at the same time
+    blender -- Blender executable
+    retries -- number of retries for a failed variant
+    Returns list of summary entries (one dictionary per variant).
+    """
+    template = os.path.abspath(template)
+    os.makedirs(outdir, exist_ok=True)
+    cachedir = os.path.join(os.path.dirname(template), '.cache', 'decoded')
+
+    t0 = time.time()
+    n = prepare(os.path.dirname(template), cachedir, workers)
+    print("Shared inputs prepared in %.1f s (%d decoded texture(s))."
+          % (time.time() - t0, n))
+
+    variants = grid(params)
+    print("Building %d variant(s) with %d workers." % (len(variants), workers))
+
+    def job(overrides):
+        blendfile = os.path.abspath(os.path.join(
+            outdir, variant_name(overrides) + '.blend'))
+        for attempt in range(retries+1):
+            try:
+                elapsed = build_variant(blender, template, overrides,
+                                        blendfile, cachedir)
+                break
+            except RuntimeError as err:
+                print("Variant failed (attempt %d): %s" % (attempt+1, err))
+        else:
+            return {'settings': overrides, 'file': blendfile,
+                    'time': None, 'ok': False}
+
+        print("%s done in %.1f s." % (os.path.basename(blendfile), elapsed))
+        return {'settings': overrides, 'file': blendfile,
+                'time': elapsed, 'ok': True}
+
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        summary = list(pool.map(job, variants))
+    total = time.time() - t0
+
+    with open(os.path.join(outdir, 'summary.json'), 'w') as f:
+        json.dump({'total_time': total, 'variants': summary}, f, indent=1)
+    report(summary, total)
+
+    return summary
+
+
+def report(summary, total):
+    """Print the build time of each variant"""
+    width = max([len(os.path.basename(entry['file'])) for entry in summary]
+                + [7])
+    print("%-*s  %8s" % (width, 'variant', 'time [s]'))
+    for entry in sorted(summary, key=lambda e: -(e['time'] or 0)):
+        time_s = '%8.1f' % entry['time'] if entry['ok'] else '  failed'
+        print("%-*s  %s" % (width, os.path.basename(entry['file']), time_s))
+    nfailed = sum(1 for entry in summary if not entry['ok'])
+    print("%d variant(s) in %.1f s, %d failed."
+          % (len(summary), total, nfailed))
+
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build scene variants for a grid of settings.")
+    parser.add_argument('template')
+    parser.add_argument('-o', '--outdir', default='variants',
+                        help="output directory (default: variants)")
+    parser.add_argument('-p', '--param', type=parse_values, action='append',
+                        default=[], metavar='NAME=V1,V2,...',
+                        help="values of one setting, repeat for a grid")
+    parser.add_argument('-w', '--workers', type=int,
+                        default=os.cpu_count() or 1,
+                        help="number of Blender processes")
+    parser.add_argument('-b', '--blender', default='blender',
+                        help="Blender executable")
+    parser.add_argument('-r', '--retries', type=int, default=1,
+                        help="retries for failed variants")
+    args = parser.parse_args(argv)
+
+    summary = sweep(args.template, args.outdir, args.param, args.workers,
+                    args.blender, args.retries)
+
+    return 1 if any(not entry['ok'] for entry in summary) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules are not a package, import them from the repository root
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+    sys.path.insert(0, root)
@@ -0,0 +1,111 @@
+"""Tests of the modules which do not need Blender; run with
+    python -m pytest tests
+"""
+import os
+import numpy as np
+import pytest
+import kepler
+import ephemeris
+import planetdata
+import paths
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def ellipse_segments(a=3., b=1.):
+    """Control points of a Bezier ellipse like Blender's circle, scaled"""
+    k = 0.5523
+    circle = np.array([
+        [[1, 0, 0], [1, k, 0], [k, 1, 0], [0, 1, 0]],
+        [[0, 1, 0], [-k, 1, 0], [-1, k, 0], [-1, 0, 0]],
+        [[-1, 0, 0], [-1, -k, 0], [-k, -1, 0], [0, -1, 0]],
+        [[0, -1, 0], [k, -1, 0], [1, -k, 0], [1, 0, 0]]], dtype=float)
+
+    return circle * np.array([a, b, 1.])
+
+
+@pytest.fixture(scope='module')
+def tables():
+    segments = ellipse_segments()
+    return paths.build_table(segments, 100), paths.build_table(segments, 12)
+
+
+def test_paths_fractions_round_trip(tables):
+    fine, coarse = tables
+    s = np.array([0., 0.1, 0.37, 0.9, 1., 1.3, 2.])
+    b = paths.blender_fractions(fine, s)
+    assert np.allclose(paths.arc_fractions(fine, b), s)
+    # converting keys between resolutions, as paths.set_resolution
+    converted = paths.blender_fractions(coarse, paths.arc_fractions(fine, b))
+    assert np.allclose(converted, paths.blender_fractions(coarse, s))
+
+
+@pytest.mark.parametrize('value', [0.37, 1.3, 1, 2, 0])
+def test_paths_fractions_scalar(tables, value):
+    fine, coarse = tables
+    b = paths.blender_fractions(fine, value)
+    assert np.ndim(b) == 0
+    assert np.isclose(paths.arc_fractions(fine, b), value)
+    # the end of a turn stays the end of that turn
+    if value > 0 and value == int(value):
+        assert np.isclose(b, value)
+        assert paths.arc_fractions(coarse, b) == pytest.approx(value)
+
+
+@pytest.mark.parametrize('e', [0., 0.3, 0.95, 0.999])
+def test_kepler_residual(e):
+    M = np.linspace(-4*np.pi, 4*np.pi, 1001)
+    E = kepler.solve_kepler(M, e)
+    assert np.abs(E - e*np.sin(E) - M).max() < 1e-9
+    if e == 0:
+        assert np.allclose(E, M)
+
+
+def test_kepler_residual_float32():
+    M = np.linspace(0, 2*np.pi, 101, dtype=np.float32)
+    E = kepler.solve_kepler(M, np.float32(0.9))
+    assert E.dtype == np.float32
+    assert np.abs(E - 0.9*np.sin(E) - M).max() < 1e-5
+
+
+@pytest.fixture(scope='module')
+def elements():
+    planets = planetdata.parse_csv(os.path.join(ROOT, 'planets.csv'),
+                                   planetdata.PLANET_SCHEMA)
+    return ephemeris.elements(planets)
+
+
+def test_ephemeris_positions_shape(elements):
+    t = np.linspace(0, 1000, 7)
+    pos = ephemeris.positions(elements, t)
+    assert pos.shape == (len(elements['name']), len(t), 3)
+    art = ephemeris.positions(elements, t, art=True)
+    assert art.shape == pos.shape
+
+
+def test_ephemeris_positions_period(elements):
+    moving = np.flatnonzero(np.isfinite(elements['period']))
+    assert len(moving) > 0
+    for i in moving:
+        period = elements['period'][i]
+        t = 12.5 + np.array([0, 0.5, 1])*period
+        pos = ephemeris.positions(elements, t)[i]
+        assert np.allclose(pos[0], pos[2], atol=1e-9*elements['a'][i])
+        # and somewhere else half an orbit later
+        assert not np.allclose(pos[0], pos[1])
+    # the sun does not move
+    pos = ephemeris.positions(elements, [0., 12.5, 1e4])
+    fixed = np.flatnonzero(~np.isfinite(elements['period']))
+    assert np.allclose(pos[fixed], 0)
+    ephemeris.clear()
+
+
+def test_planetdata_malformed_value(tmp_path):
+    filename = tmp_path / 'masses.csv'
+    filename.write_text("name;mass\n"
+                        "# comment\n"
+                        "Sol;1.989e30\n"
+                        "Terra;5.97x24\n")
+    with pytest.raises(RuntimeError) as info:
+        planetdata.parse_csv(str(filename), planetdata.MASS_SCHEMA)
+    assert "line 4, column 2 (mass): '5.97x24'" in str(info.value)
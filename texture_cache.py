@@ -0,0 +1,154 @@
+import bpy
+import os
+
+# Cache for images and image textures.
+# Images are identified by their absolute file path and reused as long
+# as the file's modification time did not change; changed files are
+# reloaded in place. This avoids loading duplicate copies
+# (Image.001, Image.002, ...) when rerunning the scripts.
+# The path and mtime are stored as custom properties on the datablocks,
+# so images loaded in earlier runs (or saved in the blend-file) are
+# found again.
+
+# cache key -> name of the datablock
+_images = {}
+_textures = {}
+
+_stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+# optional function, which returns a new image for a given file (or None);
+# used for images which are not in the cache yet, e.g. to take
+# images decoded in the background (see texture_prefetch.py)
+image_loader = None
+
+
+def _find_image(path):
+    """Return an image with the given absolute path from the cache index
+    or from bpy.data.images, or None"""
+    name = _images.get(path)
+    if name is not None:
+        img = bpy.data.images.get(name)
+        if img is not None and img.get('cache_path') == path:
+            return img
+
+    for img in bpy.data.images:
+        if img.get('cache_path') == path:
+            _images[path] = img.name
+            return img
+        if (img.source == 'FILE' and img.filepath and
+                os.path.abspath(bpy.path.abspath(img.filepath)) == path):
+            _images[path] = img.name
+            return img
+
+    return None
+
+
+def _is_blank(img):
+    """Check if an image lost its pixels: created from prefetched pixels
+    (generated) and saved without packing them"""
+    return (img.source == 'GENERATED' and img.packed_file is None and
+            not img.has_data)
+
+
+def _find_texture(key):
+    """Return an image texture with the given cache key from the cache
+    index or from bpy.data.textures, or None"""
+    name = _textures.get(key)
+    if name is not None:
+        tex = bpy.data.textures.get(name)
+        if tex is not None and tex.get('cache_key') == key:
+            return tex
+
+    for tex in bpy.data.textures:
+        if tex.type == 'IMAGE' and tex.get('cache_key') == key:
+            _textures[key] = tex.name
+            return tex
+
+    return None
+
+
+def load_image(imgname):
+    """Return the image for the given file, load it only if necessary
+    imgname -- name of the image file, including file path
+    """
+    path = os.path.abspath(imgname)
+    mtime = os.path.getmtime(path)
+
+    img = _find_image(path)
+    if img is None:
+        if image_loader is not None:
+            img = image_loader(path)
+        if img is None:
+            img = bpy.data.images.load(path)
+        _stats['misses'] += 1
+    elif img.get('cache_mtime') != mtime or _is_blank(img):
+        # file changed on disk (or image not loaded via the cache before,
+        # or its pixels were lost)
+        if img.source == 'FILE':
+            img.reload()
+        else:
+            # pixels were set from a file decoded elsewhere, 
+            # let Blender read the file instead
+            img.filepath = path
+            img.source = 'FILE'
+        _stats['reloads'] += 1
+    else:
+        _stats['hits'] += 1
+
+    img['cache_path'] = path
+    img['cache_mtime'] = mtime
+    _images[path] = img.name
+
+    return img
+
+
+def is_cached(imgname):
+    """Check if the image file is loaded already and unchanged
+    imgname -- name of the image file, including file path
+    """
+    path = os.path.abspath(imgname)
+    img = _find_image(path)
+    return (img is not None and not _is_blank(img) and
+            img.get('cache_mtime') == os.path.getmtime(path))
+
+
+def get_image_texture(imgname, **settings):
+    """Return an image texture for the given file, with the given
+    texture settings; reuse an existing one with the same settings
+    imgname -- name of the image file, including file path
+    settings -- texture attributes, e.g. use_flip_axis=True
+    """
+    img = load_image(imgname)
+    key = img['cache_path'] + repr(sorted(settings.items()))
+
+    tex = _find_texture(key)
+    if tex is None:
+        tex = bpy.data.textures.new(os.path.basename(imgname), type='IMAGE')
+        tex['cache_key'] = key
+        for attr, value in settings.items():
+            setattr(tex, attr, value)
+        _textures[key] = tex.name
+    tex.image = img
+
+    return tex
+
+
+def stats():
+    """Return number of cache hits, misses and reloads"""
+    return dict(_stats)
+
+
+def reset_stats():
+    """Reset the counters of hits, misses and reloads"""
+    for k in _stats:
+        _stats[k] = 0
+
+    return
+
+
+def report():
+    """Print number of cache hits, misses and reloads"""
+    print("Texture cache: %d hit(s), %d miss(es), %d reload(s)."
+          % (_stats['hits'], _stats['misses'], _stats['reloads']))
+
+    return
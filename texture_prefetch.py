@@ -0,0 +1,364 @@
+import os
+import io
+import zlib
+import hashlib
+import struct
+import concurrent.futures
+import numpy as np
+try:
+    import bpy
+    from bpy.app.handlers import persistent
+    import texture_cache
+except ImportError:
+    # decoding only, e.g. for mipmaps.py without Blender
+    bpy = None
+    persistent = lambda func: func
+
+# Decode texture images in background threads, while the main thread
+# creates the planets' geometry and animations. Only the decoding runs in
+# the worker threads; Blender's data may only be changed from the main
+# thread, so the decoded pixels are written into images there, with one
+# foreach_set per image (get_image). Such images are generated images,
+# whose pixels are not saved with the blend-file; before saving, they
+# are switched to their files (save_pre_handler), unless packed.
+#
+# PNG files are decoded with numpy (decode_png). JPEG files need the
+# Pillow module, if it is not available (or a file cannot be decoded),
+# the image is loaded by Blender as usual.
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# state of the prefetching: thread pool and futures (absolute path -> future)
+_pool = None
+_futures = {}
+
+# directory for decoded images (8-bit RGBA as .npy files), shared by
+# several processes, e.g. the variants built by sweep.py;
+# None: decode every time
+decoded_cachedir = None
+
+
+def _unfilter_paeth_avg(P, O, ftypes):
+    """Undo filter types 3 (average) and 4 (Paeth) for a block of rows.
+    Each pixel depends on its left and upper neighbours, so the block is
+    processed along anti-diagonals, which are independent of each other.
+    P -- filtered rows, array (rows, pixels, bytes per pixel)
+    O -- output incl. the previous row and a zero pixel on the left,
+         array (rows+1, pixels+1, bytes per pixel), filled in place
+    ftypes -- filter type of each row
+    """
+    n, w = P.shape[:2]
+    ftypes = np.asarray(ftypes)
+    for d in range(n + w - 1):
+        i = np.arange(max(0, d-w+1), min(n-1, d)+1)
+        x = d - i
+        a = O[i+1, x].astype(np.int16)
+        b = O[i, x+1].astype(np.int16)
+        c = O[i, x].astype(np.int16)
+        p = a + b - c
+        pa = np.abs(p - a)
+        pb = np.abs(p - b)
+        pc = np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        pred = np.where((ftypes[i] == 3)[:,None], (a + b) >> 1, paeth)
+        O[i+1, x+1] = (P[i, x] + pred) & 255
+
+    return
+
+
+def _unfilter(data, height, stride, bpp):
+    """Undo the PNG row filters
+    data -- decompressed image data, each row starting with its filter type
+    height -- number of rows
+    stride -- number of bytes per row (without filter type)
+    bpp -- number of bytes per complete pixel (at least 1)
+    """
+    data = np.frombuffer(data, dtype=np.uint8)[:height*(stride+1)]
+    data = data.reshape(height, stride+1)
+    ftypes = data[:,0]
+    rows = data[:,1:]
+    if ftypes.max() > 4:
+        raise ValueError("invalid PNG filter type")
+
+    # output with one empty row above and one empty pixel to the left
+    out = np.zeros((height+1, stride+bpp), dtype=np.uint8)
+    r = 0
+    while r < height:
+        f = ftypes[r]
+        if f == 0:
+            out[r+1, bpp:] = rows[r]
+        elif f == 1:
+            out[r+1, bpp:] = np.cumsum(rows[r].reshape(-1, bpp), axis=0,
+                                       dtype=np.uint8).ravel()
+        elif f == 2:
+            out[r+1, bpp:] = rows[r] + out[r, bpp:]
+        else:
+            # consecutive rows with average or Paeth filter
+            r1 = r + 1
+            while r1 < height and ftypes[r1] >= 3:
+                r1 += 1
+            n = r1 - r
+            P = rows[r:r1].reshape(n, -1, bpp)
+            O = out[r:r1+1].reshape(n+1, -1, bpp)
+            _unfilter_paeth_avg(P, O, ftypes[r:r1])
+            r = r1
+            continue
+        r += 1
+
+    return out[1:, bpp:]
+
+
+def decode_png(data):
+    """Decode a (non-interlaced) PNG image with numpy
+    data -- content of the PNG file
+    Returns an array (height, width, 4) of RGBA values between 0 and 1,
+    first row at the top.
+    """
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError("not a PNG file")
+
+    pos = 8
+    idat = []
+    palette = None
+    trns = None
+    while pos < len(data):
+        length, ctype = struct.unpack('>I4s', data[pos:pos+8])
+        chunk = data[pos+8:pos+8+length]
+        pos += 12 + length
+        if ctype == b'IHDR':
+            (width, height, depth, colortype, compression, filtering,
+             interlace) = struct.unpack('>IIBBBBB', chunk)
+        elif ctype == b'PLTE':
+            palette = np.frombuffer(chunk, dtype=np.uint8).reshape(-1, 3)
+        elif ctype == b'tRNS':
+            trns = chunk
+        elif ctype == b'IDAT':
+            idat.append(chunk)
+        elif ctype == b'IEND':
+            break
+
+    if interlace != 0:
+        raise ValueError("interlaced PNG files are not supported")
+    channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[colortype]
+    bits = channels * depth
+    stride = (width*bits + 7) // 8
+    bpp = max(1, bits // 8)
+
+    raw = _unfilter(zlib.decompress(b''.join(idat)), height, stride, bpp)
+
+    # samples
+    if depth == 16:
+        samples = raw.view('>u2').reshape(height, width, channels)
+        maxval = 65535.
+    elif depth == 8:
+        samples = raw.reshape(height, width, channels)
+        maxval = 255.
+    else:
+        bitsarr = np.unpackbits(raw, axis=1).reshape(height, -1, depth)
+        weights = 1 << np.arange(depth-1, -1, -1)
+        samples = (bitsarr * weights).sum(axis=2)[:, :width, None]
+        maxval = float((1 << depth) - 1)
+
+    rgba = np.ones((height, width, 4), dtype=np.float32)
+    if colortype == 3:
+        index = samples[:,:,0]
+        rgba[:,:,:3] = palette[index] / 255.
+        if trns is not None:
+            alpha = np.full(256, 255, dtype=np.uint8)
+            t = np.frombuffer(trns, dtype=np.uint8)
+            alpha[:len(t)] = t
+            rgba[:,:,3] = alpha[index] / 255.
+    elif colortype in (0, 4):
+        rgba[:,:,:3] = samples[:,:,:1] / maxval
+        if colortype == 4:
+            rgba[:,:,3] = samples[:,:,1] / maxval
+    else:
+        rgba[:,:,:channels] = samples / maxval
+
+    return rgba
+
+
+def decode_file(filename):
+    """Read and decode an image file, returns RGBA array (see decode_png)
+    or None, if the format is not supported here"""
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        try:
+            return decode_png(data)
+        except (ValueError, KeyError, zlib.error):
+            pass
+    if Image is not None:
+        img = Image.open(io.BytesIO(data)).convert('RGBA')
+        return np.asarray(img, dtype=np.float32) / 255.
+
+    return None
+
+
+def decode_cached(filename, cachedir):
+    """Return the RGBA array of an image file (see decode_file), read
+    from the cache directory if it was decoded before (keyed by path,
+    size and modification time), otherwise decoded and written there
+    with 8 bits per channel"""
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = hashlib.sha1(repr((path, stat.st_size, stat.st_mtime))
+                       .encode()).hexdigest()
+    cachename = os.path.join(cachedir, '%s-%s.npy'
+                             % (os.path.basename(path), key[:16]))
+    if os.path.isfile(cachename):
+        return np.load(cachename).astype(np.float32) / 255.
+
+    rgba = decode_file(path)
+    if rgba is None:
+        return None
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        # write under another name first, other processes may read it
+        tmpname = '%s.%d.tmp' % (cachename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            np.save(f, np.round(rgba*255).astype(np.uint8))
+        os.replace(tmpname, cachename)
+    except OSError as err:
+        print("Could not write cache file %s: %s" % (cachename, err))
+
+    return rgba
+
+
+def _decode(filename):
+    """Decode an image in a worker thread, returns
+    (width, height, pixels in Blender's order) or None"""
+    if decoded_cachedir is not None:
+        rgba = decode_cached(filename, decoded_cachedir)
+    else:
+        rgba = decode_file(filename)
+    if rgba is None:
+        return None
+    height, width = rgba.shape[:2]
+    # Blender's pixels start with the bottom row
+    pixels = np.ascontiguousarray(rgba[::-1]).ravel()
+
+    return width, height, pixels
+
+
+def start(filenames, workers=None):
+    """Start decoding the given image files in background threads;
+    files which are already loaded and unchanged are skipped
+    filenames -- names of the image files, including file path
+    workers -- number of threads, default: number of CPUs
+    """
+    global _pool
+    if _pool is None:
+        _pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or os.cpu_count() or 1)
+
+    n = 0
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        if path in _futures or not os.path.isfile(path):
+            continue
+        if texture_cache.is_cached(path):
+            continue
+        _futures[path] = _pool.submit(_decode, path)
+        n += 1
+
+    # let the texture cache take new images from here
+    texture_cache.image_loader = get_image
+    register_handler()
+
+    print("Decoding %d texture(s) in the background." % n)
+
+    return
+
+
+def get_image(filename):
+    """Return a new image with the decoded pixels of the given file,
+    waits for the decoding if necessary. Returns None if the file was not
+    prefetched or could not be decoded.
+    filename -- name of the image file, including file path
+    """
+    path = os.path.abspath(filename)
+    future = _futures.pop(path, None)
+    if future is None:
+        return None
+    try:
+        result = future.result()
+    except Exception as err:
+        print("Could not decode %s: %s" % (path, err))
+        return None
+    if result is None:
+        return None
+
+    width, height, pixels = result
+    img = bpy.data.images.new(os.path.basename(path), width, height,
+                              alpha=True)
+    img.pixels.foreach_set(pixels)
+    img.filepath_raw = path
+
+    return img
+
+
+def pack_images():
+    """Pack images created from prefetched pixels into the blend-file,
+    so the saved file does not need the texture files (otherwise they
+    are switched to their files when saving, see save_pre_handler)"""
+    n = 0
+    for img in bpy.data.images:
+        if img.source == 'GENERATED' and img.get('cache_path'):
+            img.pack(as_png=True)
+            n += 1
+
+    print("%d prefetched image(s) packed." % n)
+
+    return n
+
+
+def use_files():
+    """Let images created from prefetched pixels (and not packed) read
+    their files, as generated images lose their pixels when saved;
+    returns number of changed images"""
+    n = 0
+    for img in bpy.data.images:
+        if (img.source == 'GENERATED' and img.get('cache_path') and
+                img.packed_file is None):
+            img.filepath = img['cache_path']
+            img.source = 'FILE'
+            n += 1
+
+    return n
+
+
+@persistent
+def save_pre_handler(*args):
+    """Switch prefetched images to their files before saving"""
+    use_files()
+
+    return
+
+
+def register_handler():
+    """Add the save handler (once, also after module reloads)"""
+    handlers = bpy.app.handlers.save_pre
+    for h in list(handlers):
+        if (h.__name__ == save_pre_handler.__name__ and
+                h.__module__ == save_pre_handler.__module__):
+            handlers.remove(h)
+    handlers.append(save_pre_handler)
+
+    return
+
+
+def stop():
+    """Wait for outstanding decoding jobs and stop the threads"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+    _futures.clear()
+    texture_cache.image_loader = None
+
+    return
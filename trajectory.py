@@ -0,0 +1,313 @@
+"""Trajectory cache: positions and rotations of all bodies per frame.
+
+The trajectories are baked once from the orbital elements (see
+ephemeris.py) into a binary file, which is memory-mapped when used:
+a header (magic, version, numbers of bodies and frames, first frame,
+values per body, length of the names), the body names as JSON, and a
+float32 array of shape (frames, bodies, 4) with the location x, y, z
+of each body and its rotation angle around its own axis.
+
+A frame change handler applies the slice of the current frame to the
+objects of the scene: the location to 'Planet-<name>-Axes' and the
+rotation to 'Planet-<name>'. The Follow Path constraints and the
+rotation F-curves are muted meanwhile, so neither keyframes nor
+constraints need to be evaluated. They are unmuted in saved blend-files,
+which thus play (and render) without this module; when this module is
+loaded, the caches are attached again after loading a blend-file.
+
+Bake without Blender:
+    python trajectory.py planets.csv planets.traj -s 1 -e 100000
+
+The baking works without Blender, only the handler needs it.
+"""
+import os
+import sys
+import json
+import struct
+import argparse
+import numpy as np
+try:
+    import bpy
+    from bpy.app.handlers import persistent
+except ImportError:
+    # baking only
+    bpy = None
+    persistent = lambda func: func
+import ephemeris
+
+MAGIC = b'PLTRAJ\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIIiII')
+NVALUES = 4
+
+# open caches: filename -> (mtime, names, array, first frame);
+# kept when the module is reloaded
+if '_open' not in globals():
+    _open = {}
+
+
+def write(filename, names, startframe, nframes):
+    """Create a trajectory file and return it as writable memory-mapped
+    array of shape (frames, bodies, 4)
+    filename -- name of the new file
+    names -- names of the bodies
+    startframe -- frame of the first entry
+    nframes -- number of frames
+    """
+    # an open memory map of the old file must not see it truncated
+    close(filename)
+    namedata = json.dumps([str(n) for n in names]).encode('utf-8')
+    # start the array at a multiple of 64 bytes
+    offset = -(-(HEADER.size + len(namedata)) // 64) * 64
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(names), nframes, startframe,
+                            NVALUES, len(namedata)))
+        f.write(namedata)
+        f.write(b'\x00' * (offset - HEADER.size - len(namedata)))
+
+    return np.memmap(filename, dtype='<f4', mode='r+', offset=offset,
+                     shape=(nframes, len(names), NVALUES))
+
+
+def read(filename):
+    """Open a trajectory file, returns header (dictionary), body names
+    and the read-only memory-mapped array (frames, bodies, 4)"""
+    with open(filename, 'rb') as f:
+        head = f.read(HEADER.size)
+        if len(head) < HEADER.size:
+            raise RuntimeError("read: %s is too short." % filename)
+        (magic, version, nbodies, nframes, startframe, nvalues,
+         namelen) = HEADER.unpack(head)
+        if magic != MAGIC or version != VERSION or nvalues != NVALUES:
+            raise RuntimeError("read: %s is not a trajectory file "
+                               "of version %d." % (filename, VERSION))
+        names = json.loads(f.read(namelen).decode('utf-8'))
+    offset = -(-(HEADER.size + namelen) // 64) * 64
+    data = np.memmap(filename, dtype='<f4', mode='r', offset=offset,
+                     shape=(nframes, nbodies, NVALUES))
+    header = {'bodies': nbodies, 'frames': nframes, 'startframe': startframe}
+
+    return header, names, data
+
+
+def bake(filename, planetsfile, frame_start, frame_end, startframe=50,
+         timefactor=80, chunksize=10000):
+    """Bake the trajectories of all planets into a trajectory file,
+    with the timing of the scene built by create_planet.py
+    filename -- name of the trajectory file
+    planetsfile -- csv-file with the planet parameters
+    frame_start, frame_end -- frame range
+    startframe -- first frame of the orbit animations (at perihelion)
+    timefactor -- number of frames per day
+    chunksize -- number of frames computed at once
+    """
+    el = ephemeris.load(planetsfile)
+    nframes = frame_end - frame_start + 1
+    data = write(filename, el['name'], frame_start, nframes)
+    for i in range(0, nframes, chunksize):
+        frames = np.arange(frame_start + i,
+                           min(frame_start + i + chunksize, frame_end + 1))
+        # orbits start at startframe, rotations at frame 1
+        t = ephemeris.frames_to_days(frames, startframe, timefactor)
+        trot = ephemeris.frames_to_days(frames, 1, timefactor)
+        chunk = data[i:i+len(frames)]
+        chunk[...,:3] = ephemeris.positions(el, t, art=True).transpose(1,0,2)
+        # wrapped before the cast to float32, which keeps large angles
+        # only to a fraction of a turn
+        chunk[...,3] = np.mod(ephemeris.rotation_angles(el, trot).T,
+                              2*np.pi)
+        ephemeris.clear()
+    data.flush()
+    del data
+
+    print("Trajectories of %d bodies for frames %d-%d written to %s."
+          % (len(el['name']), frame_start, frame_end, filename))
+
+    return
+
+
+def close(filename):
+    """Forget the memory-mapped array of a trajectory file, e.g. before
+    it is written again"""
+    _open.pop(os.path.abspath(filename), None)
+
+    return
+
+
+def load(filename):
+    """Return names, array and first frame of a trajectory file, opened
+    only once (again if the file changed)"""
+    filename = os.path.abspath(filename)
+    mtime = os.path.getmtime(filename)
+    cached = _open.get(filename)
+    if cached is None or cached[0] != mtime:
+        header, names, data = read(filename)
+        cached = (mtime, names, data, header['startframe'])
+        _open[filename] = cached
+
+    return cached[1:]
+
+
+def apply(scene, filename, frame):
+    """Set locations and rotations of the bodies to the given frame"""
+    names, data, startframe = load(filename)
+    i = min(max(frame - startframe, 0), len(data) - 1)
+    values = data[i]
+    for name, (x, y, z, angle) in zip(names, values):
+        axisobj = scene.objects.get('Planet-' + name + '-Axes')
+        if axisobj is not None:
+            axisobj.location = (x, y, z)
+        obj = scene.objects.get('Planet-' + name)
+        if obj is not None:
+            obj.rotation_euler.z = angle
+
+    return
+
+
+@persistent
+def frame_change_handler(scene):
+    """Apply the trajectory cache of the scene to the current frame"""
+    filename = scene.get('trajectory_cache')
+    if filename is None or not os.path.isfile(filename):
+        return
+    apply(scene, filename, scene.frame_current)
+
+    return
+
+
+def _attached_scenes():
+    """Return (scene, body names) of the scenes with an existing
+    trajectory cache"""
+    scenes = []
+    for scene in bpy.data.scenes:
+        filename = scene.get('trajectory_cache')
+        if filename is not None and os.path.isfile(filename):
+            scenes.append((scene, load(filename)[0]))
+
+    return scenes
+
+
+@persistent
+def save_pre_handler(*args):
+    """Unmute the animation in the saved file"""
+    for scene, names in _attached_scenes():
+        _mute_animation(scene, names, False)
+
+    return
+
+
+@persistent
+def save_post_handler(*args):
+    """Mute the animation again after saving"""
+    for scene, names in _attached_scenes():
+        _mute_animation(scene, names, True)
+
+    return
+
+
+@persistent
+def load_post_handler(*args):
+    """Attach the trajectory caches of the scenes of a loaded file"""
+    for scene in bpy.data.scenes:
+        filename = scene.get('trajectory_cache')
+        if filename is None:
+            continue
+        if os.path.isfile(filename):
+            attach(filename, scene)
+        else:
+            print("Trajectory cache %s is missing, scene %s uses its "
+                  "animation." % (filename, scene.name))
+
+    return
+
+
+def register_handler():
+    """Add the frame change, save and load handlers (once, also after
+    module reloads)"""
+    for handlers, handler in [
+            (bpy.app.handlers.frame_change_pre, frame_change_handler),
+            (bpy.app.handlers.save_pre, save_pre_handler),
+            (bpy.app.handlers.save_post, save_post_handler),
+            (bpy.app.handlers.load_post, load_post_handler)]:
+        for h in list(handlers):
+            if (h.__name__ == handler.__name__ and
+                    h.__module__ == handler.__module__):
+                handlers.remove(h)
+        handlers.append(handler)
+
+    return
+
+
+def _mute_animation(scene, names, mute):
+    """Mute (or unmute) the Follow Path constraints of the axis objects,
+    the orbit animations and the rotation F-curves"""
+    for name in names:
+        axisobj = scene.objects.get('Planet-' + name + '-Axes')
+        if axisobj is not None:
+            for c in axisobj.constraints:
+                if c.type == 'FOLLOW_PATH':
+                    c.mute = mute
+        obj = scene.objects.get('Planet-' + name)
+        if obj is not None and obj.animation_data is not None:
+            action = obj.animation_data.action
+            if action is not None:
+                for fcu in action.fcurves:
+                    if fcu.data_path == 'rotation_euler':
+                        fcu.mute = mute
+
+    return
+
+
+def attach(filename, scene=None):
+    """Drive the planets of a scene by a trajectory file
+    filename -- trajectory file, see bake
+    scene -- scene (default: current scene)
+    """
+    scene = scene or bpy.context.scene
+    filename = os.path.abspath(filename)
+    names, data, startframe = load(filename)
+    _mute_animation(scene, names, True)
+    scene['trajectory_cache'] = filename
+    register_handler()
+    apply(scene, filename, scene.frame_current)
+
+    return
+
+
+def detach(scene=None):
+    """Use the constraints and keyframes again instead of the cache"""
+    scene = scene or bpy.context.scene
+    filename = scene.get('trajectory_cache')
+    if filename is None:
+        return
+    if os.path.isfile(filename):
+        names, data, startframe = load(filename)
+        _mute_animation(scene, names, False)
+    del scene['trajectory_cache']
+
+    return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Bake planet trajectories into a trajectory file.")
+    parser.add_argument('planetsfile')
+    parser.add_argument('filename')
+    parser.add_argument('-s', '--start', type=int, default=1,
+                        help="first frame")
+    parser.add_argument('-e', '--end', type=int, required=True,
+                        help="last frame")
+    parser.add_argument('--startframe', type=int, default=50,
+                        help="first frame of the orbit animations")
+    parser.add_argument('--timefactor', type=float, default=80,
+                        help="number of frames per day")
+    args = parser.parse_args(argv)
+
+    bake(args.filename, args.planetsfile, args.start, args.end,
+         args.startframe, args.timefactor)
+
+    return 0
+
+
+if __name__ == '__main__' and bpy is None:
+    sys.exit(main())